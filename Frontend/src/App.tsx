@@ -5,6 +5,7 @@ import ProcessingPipeline, {
   defaultSteps,
 } from "./components/ProcessingPipeline";
 import DownloadSection from "./components/DownloadSection";
+import PreviewCanvas from "./components/PreviewCanvas";
 
 type AppState = "upload" | "processing" | "results";
 
@@ -21,55 +22,105 @@ interface ClassificationStats {
   }>;
 }
 
+interface JobProgress {
+  phase: string;
+  step: number;
+  steps: number;
+  points_done: number;
+  points_total: number;
+  percent: number;
+  points_per_second: number;
+  eta_seconds: number | null;
+}
+
+interface JobStatus {
+  status: string;
+  error?: string;
+  progress?: JobProgress;
+  stalled?: boolean;
+}
+
+// Each pass (ground model, tiling, classification...) gets an equal share of the bar
+function overallPercent(progress: JobProgress): number {
+  if (!progress.steps) return progress.percent;
+  const overall = ((progress.step + progress.percent / 100) / progress.steps) * 100;
+  return Math.min(100, overall);
+}
+
 function App() {
   const [state, setState] = useState<AppState>("upload");
   const [selectedFile, setSelectedFile] = useState<File | null>(null);
   const [fileId, setFileId] = useState<string | null>(null);
   const [progress, setProgress] = useState(0);
+  const [jobProgress, setJobProgress] = useState<JobProgress | null>(null);
+  const [stalled, setStalled] = useState(false);
+  const [completed, setCompleted] = useState(false);
   const [steps, setSteps] = useState(defaultSteps);
   const [error, setError] = useState<string | null>(null);
   const [stats, setStats] = useState<ClassificationStats | null>(null);
   const [loadingStats, setLoadingStats] = useState(false);
 
-  // Poll for classification status ONLY
+  // Live progress: Server-Sent Events, falling back to polling /api/status
   useEffect(() => {
     if (state !== "processing" || !fileId) return;
 
-    const pollInterval = setInterval(async () => {
-      try {
-        const response = await fetch(`/api/status/${fileId}`);
-        const data = await response.json();
-
-        if (data.status === "completed") {
-          setProgress(100);
-          clearInterval(pollInterval);
-          // Don't automatically transition - wait for user to click "View Results"
-        } else if (data.status === "error") {
-          setError(data.error || "Classification failed");
-          clearInterval(pollInterval);
-          setState("upload");
-        }
-      } catch (err) {
-        console.error("Status check failed:", err);
-      }
-    }, 2000);
+    let pollInterval: ReturnType<typeof setInterval> | null = null;
+    let source: EventSource | null = null;
+    let finished = false;
 
-    return () => clearInterval(pollInterval);
-  }, [state, fileId]);
+    const handleStatus = (data: JobStatus) => {
+      if (data.progress) {
+        setJobProgress(data.progress);
+        setProgress(overallPercent(data.progress));
+      }
+      setStalled(Boolean(data.stalled));
+
+      if (data.status === "completed") {
+        finished = true;
+        setCompleted(true);
+        setProgress(100);
+        // Don't automatically transition - wait for user to click "View Results"
+      } else if (data.status === "error" || data.status === "cancelled") {
+        finished = true;
+        setError(data.error || `Classification ${data.status === "cancelled" ? "cancelled" : "failed"}`);
+        setState("upload");
+      }
+    };
+
+    const startPolling = () => {
+      pollInterval = setInterval(async () => {
+        try {
+          const response = await fetch(`/api/status/${fileId}`);
+          handleStatus(await response.json());
+          if (finished && pollInterval) clearInterval(pollInterval);
+        } catch (err) {
+          console.error("Status check failed:", err);
+        }
+      }, 2000);
+    };
 
-  // Simulate progress while processing
-  useEffect(() => {
-    if (state === "processing") {
-      const interval = setInterval(() => {
-        setProgress((prev) => {
-          if (prev >= 95) return prev;
-          return prev + Math.random() * 10;
-        });
-      }, 1000);
-
-      return () => clearInterval(interval);
+    if (typeof EventSource !== "undefined") {
+      source = new EventSource(`/api/events/${fileId}`);
+      source.addEventListener("progress", (e) =>
+        handleStatus(JSON.parse((e as MessageEvent).data))
+      );
+      source.addEventListener("status", (e) => {
+        handleStatus(JSON.parse((e as MessageEvent).data));
+        source?.close();
+      });
+      source.onerror = () => {
+        source?.close();
+        if (!finished) startPolling();
+      };
+    } else {
+      startPolling();
     }
-  }, [state]);
+
+    return () => {
+      source?.close();
+      if (pollInterval) clearInterval(pollInterval);
+    };
+  }, [state, fileId]);
 
   useEffect(() => {
     if (state === "processing") {
@@ -95,6 +146,9 @@ function App() {
     setFileId(id);
     setState("processing");
     setProgress(0);
+    setJobProgress(null);
+    setStalled(false);
+    setCompleted(false);
     setError(null);
     setStats(null);
     setSteps(
@@ -167,6 +221,9 @@ function App() {
     setSelectedFile(null);
     setFileId(null);
     setProgress(0);
+    setJobProgress(null);
+    setStalled(false);
+    setCompleted(false);
     setError(null);
     setStats(null);
     setSteps(defaultSteps);
@@ -261,9 +318,15 @@ function App() {
                   </div>
                 )}
 
-                <ProcessingPipeline steps={steps} progress={progress} />
+                <ProcessingPipeline
+                  steps={steps}
+                  progress={progress}
+                  etaSeconds={jobProgress?.eta_seconds}
+                  pointsPerSecond={jobProgress?.points_per_second}
+                  stalled={stalled}
+                />
 
-                {progress >= 95 && (
+                {completed && (
                   <div className="mt-8 flex justify-center">
                     <button
                       onClick={handleFetchStats}
@@ -341,6 +404,10 @@ function App() {
                 </div>
               </div>
 
+              <div className="p-8 rounded-2xl bg-gradient-to-br from-[#0E111B] to-[#0B0F1A] border border-[#2A3441]">
+                <PreviewCanvas fileId={stats.file_id} />
+              </div>
+
               <div className="p-8 rounded-2xl bg-gradient-to-br from-[#0E111B] to-[#0B0F1A] border border-[#2A3441]">
                 <DownloadSection
                   onDownloadLAS={handleDownloadLAS}
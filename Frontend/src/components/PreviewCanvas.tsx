@@ -0,0 +1,138 @@
+import { useEffect, useRef, useState } from 'react';
+import { Eye, Loader2 } from 'lucide-react';
+
+interface PreviewMeta {
+  count: number;
+  levels: number[];
+  record: { size: number };
+  mins: number[];
+  scale: number[];
+  palette: Record<string, number[]>;
+  data_url: string;
+}
+
+interface PreviewCanvasProps {
+  fileId: string;
+  width?: number;
+  height?: number;
+}
+
+// Record layout from the backend: x, y, z as uint16 (quantized in the file bbox) + class uint8
+const OFFSET_X = 0;
+const OFFSET_Y = 2;
+const OFFSET_Z = 4;
+const OFFSET_CLASS = 6;
+
+function drawPoints(
+  canvas: HTMLCanvasElement,
+  view: DataView,
+  count: number,
+  meta: PreviewMeta
+) {
+  const ctx = canvas.getContext('2d');
+  if (!ctx) return;
+
+  const { width, height } = canvas;
+  const image = ctx.createImageData(width, height);
+  const depth = new Int32Array(width * height).fill(-1);
+  const palette: Record<number, number[]> = {};
+  Object.entries(meta.palette).forEach(([id, color]) => {
+    palette[Number(id)] = color;
+  });
+
+  // Top-down view, aspect ratio of the real extent; the highest point wins each pixel
+  const extentX = meta.scale[0] * 65535;
+  const extentY = meta.scale[1] * 65535;
+  const fit = Math.min(width / extentX, height / extentY);
+  const offsetX = (width - extentX * fit) / 2;
+  const offsetY = (height - extentY * fit) / 2;
+  const size = meta.record.size;
+
+  for (let i = 0; i < count; i++) {
+    const base = i * size;
+    const qx = view.getUint16(base + OFFSET_X, true);
+    const qy = view.getUint16(base + OFFSET_Y, true);
+    const qz = view.getUint16(base + OFFSET_Z, true);
+    const px = Math.floor(offsetX + qx * meta.scale[0] * fit);
+    const py = Math.floor(height - 1 - (offsetY + qy * meta.scale[1] * fit));
+    if (px < 0 || px >= width || py < 0 || py >= height) continue;
+
+    const pixel = py * width + px;
+    if (qz <= depth[pixel]) continue;
+    depth[pixel] = qz;
+
+    const color = palette[view.getUint8(base + OFFSET_CLASS)] ?? [200, 200, 200];
+    image.data[pixel * 4] = color[0];
+    image.data[pixel * 4 + 1] = color[1];
+    image.data[pixel * 4 + 2] = color[2];
+    image.data[pixel * 4 + 3] = 255;
+  }
+
+  ctx.putImageData(image, 0, 0);
+}
+
+export default function PreviewCanvas({ fileId, width = 900, height = 600 }: PreviewCanvasProps) {
+  const canvasRef = useRef<HTMLCanvasElement>(null);
+  const [loadedPoints, setLoadedPoints] = useState(0);
+  const [totalPoints, setTotalPoints] = useState(0);
+  const [error, setError] = useState<string | null>(null);
+
+  useEffect(() => {
+    let cancelled = false;
+
+    const load = async () => {
+      try {
+        const metaResponse = await fetch(`/api/preview/${fileId}`);
+        if (!metaResponse.ok) throw new Error('Preview not available');
+        const meta: PreviewMeta = await metaResponse.json();
+        setTotalPoints(meta.count);
+
+        // Coarse level first, then refine - every level is a uniform sample
+        for (let level = 0; level < meta.levels.length; level++) {
+          const response = await fetch(`${meta.data_url}?level=${level}`);
+          if (!response.ok) throw new Error('Failed to load preview data');
+          const buffer = await response.arrayBuffer();
+          if (cancelled || !canvasRef.current) return;
+
+          const count = Math.floor(buffer.byteLength / meta.record.size);
+          drawPoints(canvasRef.current, new DataView(buffer), count, meta);
+          setLoadedPoints(count);
+        }
+      } catch (err) {
+        if (!cancelled) setError(err instanceof Error ? err.message : 'Preview failed');
+      }
+    };
+
+    load();
+    return () => {
+      cancelled = true;
+    };
+  }, [fileId]);
+
+  return (
+    <div className="space-y-4">
+      <div className="flex items-center justify-between">
+        <h3 className="text-lg font-semibold text-[#E6E6E6] flex items-center gap-2">
+          <Eye className="w-5 h-5 text-[#00C7E6]" />
+          Point Cloud Preview
+        </h3>
+        <span className="text-xs text-[#6B7280] flex items-center gap-2">
+          {!error && loadedPoints < totalPoints && (
+            <Loader2 className="w-3 h-3 animate-spin" />
+          )}
+          {loadedPoints.toLocaleString()} / {totalPoints.toLocaleString()} points
+        </span>
+      </div>
+      {error ? (
+        <p className="text-sm text-[#A9B1C7]">{error}</p>
+      ) : (
+        <canvas
+          ref={canvasRef}
+          width={width}
+          height={height}
+          className="w-full rounded-xl bg-[#0B0F1A] border border-[#2A3441]"
+        />
+      )}
+    </div>
+  );
+}
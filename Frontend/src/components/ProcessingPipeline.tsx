@@ -10,9 +10,23 @@ interface PipelineStep {
 interface ProcessingPipelineProps {
   steps: PipelineStep[];
   progress: number;
+  etaSeconds?: number | null;
+  pointsPerSecond?: number;
+  stalled?: boolean;
 }
 
-export default function ProcessingPipeline({ steps, progress }: ProcessingPipelineProps) {
+function formatEta(seconds: number): string {
+  if (seconds < 60) return `~${Math.max(1, Math.round(seconds))} s`;
+  return `~${Math.round(seconds / 60)} min`;
+}
+
+export default function ProcessingPipeline({
+  steps,
+  progress,
+  etaSeconds,
+  pointsPerSecond,
+  stalled,
+}: ProcessingPipelineProps) {
   return (
     <div className="space-y-6">
       <div className="flex items-center justify-between mb-8">
@@ -96,9 +110,23 @@ export default function ProcessingPipeline({ steps, progress }: ProcessingPipeli
         <div className="flex items-center justify-between text-sm">
           <span className="text-[#A9B1C7]">Estimated time remaining:</span>
           <span className="text-[#E6E6E6] font-mono font-semibold">
-            {progress < 100 ? `~${Math.round((100 - progress) / 10)} min` : 'Complete'}
+            {progress >= 100
+              ? 'Complete'
+              : stalled
+              ? 'Stalled'
+              : etaSeconds != null
+              ? formatEta(etaSeconds)
+              : 'Estimating...'}
           </span>
         </div>
+        {pointsPerSecond ? (
+          <div className="flex items-center justify-between text-sm mt-2">
+            <span className="text-[#A9B1C7]">Throughput:</span>
+            <span className="text-[#E6E6E6] font-mono font-semibold">
+              {Math.round(pointsPerSecond).toLocaleString()} pts/s
+            </span>
+          </div>
+        ) : null}
       </div>
     </div>
   );
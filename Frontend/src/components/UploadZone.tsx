@@ -1,6 +1,71 @@
 import { Upload, FileType } from 'lucide-react';
 import { useState } from 'react';
 
+// Use direct backend URL to avoid proxy issues with large files
+const API_URL = 'http://localhost:5000/api';
+const PARALLEL_PARTS = 4;
+const PART_RETRIES = 5;
+
+// Resumable upload: init -> PUT byte ranges (in parallel, retried) -> complete
+async function uploadResumable(file: File): Promise<{ file_id: string }> {
+  const initResponse = await fetch(`${API_URL}/uploads`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ filename: file.name, size: file.size }),
+  });
+  const init = await initResponse.json();
+  if (!initResponse.ok) {
+    throw new Error(init.error || `Upload failed (${initResponse.status})`);
+  }
+
+  const partSize: number = init.part_size;
+  const starts: number[] = [];
+  for (let start = 0; start < file.size; start += partSize) starts.push(start);
+
+  const uploadPart = async (start: number) => {
+    const end = Math.min(start + partSize, file.size);
+    let lastError: unknown;
+    for (let attempt = 0; attempt <= PART_RETRIES; attempt++) {
+      if (attempt > 0) {
+        await new Promise((resolve) => setTimeout(resolve, 1000 * 2 ** (attempt - 1)));
+      }
+      try {
+        const response = await fetch(`${API_URL}/uploads/${init.upload_id}`, {
+          method: 'PUT',
+          headers: { 'Content-Range': `bytes ${start}-${end - 1}/${file.size}` },
+          body: file.slice(start, end),
+        });
+        if (response.ok) return;
+        const data = await response.json().catch(() => ({}));
+        lastError = new Error(data.error || `Upload failed (${response.status})`);
+        // 400 = incomplete part (retry); other 4xx will not get better by retrying
+        if (response.status > 400 && response.status < 500) break;
+      } catch (error) {
+        lastError = error; // network blip - retry just this part
+      }
+    }
+    throw lastError;
+  };
+
+  const queue = [...starts];
+  await Promise.all(
+    Array.from({ length: Math.min(PARALLEL_PARTS, queue.length) }, async () => {
+      while (queue.length > 0) {
+        await uploadPart(queue.shift() as number);
+      }
+    })
+  );
+
+  const completeResponse = await fetch(`${API_URL}/uploads/${init.upload_id}/complete`, {
+    method: 'POST',
+  });
+  const data = await completeResponse.json();
+  if (!completeResponse.ok) {
+    throw new Error(data.error || `Upload failed (${completeResponse.status})`);
+  }
+  return data;
+}
+
 interface UploadZoneProps {
   onFileSelect: (file: File, fileId: string) => void;
   onUploadStart?: () => void;
@@ -22,20 +87,7 @@ export default function UploadZone({
     setIsUploading(true);
 
     try {
-      const formData = new FormData();
-      formData.append('file', file);
-
-      // Use direct backend URL to avoid proxy issues with large files
-      const response = await fetch('http://localhost:5000/api/upload', {
-        method: 'POST',
-        body: formData,
-      });
-
-      const data = await response.json();
-
-      if (!response.ok) {
-        throw new Error(data.error || `Upload failed (${response.status})`);
-      }
+      const data = await uploadResumable(file);
 
       if (onUploadComplete) onUploadComplete();
       onFileSelect(file, data.file_id);
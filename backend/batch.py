@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""
+Wsadowa klasyfikacja katalogów / globów LAS i LAZ - bez serwera i uploadu.
+
+Każdy kafel to osobny process_file_streaming w procesie z puli (spawn),
+kilka kafli naraz. Kafel wchodzi do pracy, gdy jego szacowana pamięć
+(jobs.estimate_job_memory) mieści się w globalnym budżecie obok już
+działających - jak w kolejce zadań serwera; pusty batch zawsze przyjmuje
+jeden kafel. Największe kafle startują pierwsze, mniejsze wypełniają lukę.
+
+Wznawianie: po udanym kaflu obok wyniku ląduje <stem>_classified_stats.json
+(podsumowanie + klucz: rozmiar/mtime wejścia, wersja klasyfikatora, odcisk
+reguł, opcje). Kolejne uruchomienie pomija kafle z pasującym kluczem
+i istniejącymi wynikami - po awarii liczone są tylko brakujące i przerwane.
+
+Na końcu raport zbiorczy: report.json (wszystkie kafle, także pominięte)
+i report.csv (wiersz na kafel, kolumna na klasę).
+
+Użycie:
+    python batch.py /dane/korytarz/ --output-dir /wyniki --jobs 4 --memory-budget 48
+    python batch.py "/dane/*/tile_*.laz" --output-dir /wyniki --format laz --ply
+"""
+
+import argparse
+import contextlib
+import csv
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+
+import laspy
+
+from jobs import estimate_job_memory
+from rules import CLASSIFIER_VERSION, OUTPUT_FORMATS, load_rules
+
+INPUT_SUFFIXES = ('.las', '.laz')
+STATS_SUFFIX = '_stats.json'
+# Domyślny budżet: taka część pamięci fizycznej
+DEFAULT_MEMORY_FRACTION = 0.75
+
+
+class Tile:
+    """Jeden plik wejściowy i ścieżki jego wyników"""
+
+    def __init__(self, input_path, output_dir, relative_dir, suffix):
+        self.input_path = Path(input_path)
+        self.name = str(Path(relative_dir) / self.input_path.stem)
+        folder = Path(output_dir) / relative_dir
+        self.output_path = folder / f"{self.input_path.stem}_classified{suffix}"
+        self.stats_path = folder / f"{self.input_path.stem}_classified{STATS_SUFFIX}"
+        self.log_path = folder / f"{self.input_path.stem}_classified.log"
+        self.point_count = 0
+        self.memory = 0
+        self.key = None
+
+
+def find_inputs(sources, recursive=False):
+    """
+    (plik, katalog względny wyniku) dla katalogów, globów i plików.
+    Katalog: struktura podkatalogów jest odtwarzana w wynikach.
+    """
+    found = []
+    for source in sources:
+        path = Path(source)
+        if path.is_dir():
+            pattern = '**/*' if recursive else '*'
+            for file in sorted(path.glob(pattern)):
+                if file.is_file() and file.suffix.lower() in INPUT_SUFFIXES:
+                    found.append((file, file.parent.relative_to(path)))
+        elif path.is_file():
+            found.append((path, Path('.')))
+        else:
+            for name in sorted(glob.glob(source, recursive=recursive)):
+                file = Path(name)
+                if file.is_file() and file.suffix.lower() in INPUT_SUFFIXES:
+                    found.append((file, Path('.')))
+    return found
+
+
+def tile_key(input_path, rules, options):
+    """Klucz wyniku kafla: wejście (rozmiar, mtime) + klasyfikator + reguły + opcje"""
+    stat = Path(input_path).stat()
+    payload = json.dumps({
+        'input': {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns},
+        'classifier': CLASSIFIER_VERSION,
+        'rules': rules.fingerprint,
+        'options': {k: v for k, v in options.items() if k != 'chunk_size'},
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def load_done(tile):
+    """Zapisane podsumowanie kafla, jeśli pasuje do klucza i wyniki istnieją"""
+    try:
+        with open(tile.stats_path) as f:
+            stats = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if stats.get('key') != tile.key:
+        return None
+    outputs = [path for path in stats['summary']['outputs'].values() if path]
+    if not all(Path(path).exists() for path in outputs):
+        return None
+    return stats
+
+
+def _write_json(path, data):
+    tmp_path = Path(f"{path}.tmp")
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _init_tile_process(threads):
+    """
+    Proces kafla: wątki kerneli Numba ograniczone do jego przydziału rdzeni.
+    Z workers=1 klasyfikator woła kernel równoległy, który bez limitu bierze
+    wszystkie rdzenie - jobs procesów × wszystkie rdzenie. Numba jest
+    importowana dopiero w _classify_tile, więc zmienna zdąży zadziałać.
+    """
+    os.environ['NUMBA_NUM_THREADS'] = str(threads)
+
+
+def _classify_tile(input_path, output_path, log_path, options, workers, backend, rules_path):
+    """Jeden kafel w procesie z puli; wydruki klasyfikatora idą do logu kafla"""
+    from classifier_genius import GeniusStreamingClassifier
+
+    with open(log_path, 'w') as log, contextlib.redirect_stdout(log):
+        classifier = GeniusStreamingClassifier(workers=workers, backend=backend, rules=rules_path)
+        return classifier.process_file_streaming(input_path, output_path, **options)
+
+
+def default_memory_budget():
+    try:
+        return int(os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') * DEFAULT_MEMORY_FRACTION)
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def run_batch(sources, output_dir, options, jobs=None, memory_budget=None, backend='auto',
+              rules_path=None, recursive=False, force=False):
+    """
+    Klasyfikuje wszystkie kafle, które nie mają aktualnego wyniku.
+    Zwraca listę wpisów raportu (kafel, status, podsumowanie / błąd).
+    """
+    output_dir = Path(output_dir)
+    rules = load_rules(rules_path)
+    jobs = max(1, jobs or os.cpu_count() or 1)
+    # Rdzenie dzielone między równoległe kafle (jak CLASSIFIER_WORKERS w serwerze)
+    workers = max(1, (os.cpu_count() or 1) // jobs)
+    suffix = {fmt: s for s, fmt in OUTPUT_FORMATS.items()}[options['output_format']]
+
+    tiles = [Tile(path, output_dir, relative, suffix) for path, relative in find_inputs(sources, recursive)]
+    names = [tile.name for tile in tiles]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f"Several inputs map to the same output: {', '.join(duplicates)}")
+
+    entries = {}
+    pending = []
+    for tile in tiles:
+        tile.key = tile_key(tile.input_path, rules, options)
+        done = None if force else load_done(tile)
+        if done is not None:
+            entries[tile.name] = {'tile': tile.name, 'status': 'skipped', **done}
+            continue
+        try:
+            with laspy.open(tile.input_path) as f:
+                tile.point_count = f.header.point_count
+        except Exception as e:
+            # Uszkodzony / ucięty kafel nie zatrzymuje batcha - trafia do raportu
+            entries[tile.name] = {'tile': tile.name, 'status': 'error', 'error': str(e),
+                                  'input': str(tile.input_path)}
+            print(f"❌ {tile.name}: {e}")
+            continue
+        tile.memory = estimate_job_memory(tile.point_count, options['chunk_size'], workers + 2)
+        pending.append(tile)
+
+    budget = f"{memory_budget / 1024**3:.1f} GB" if memory_budget else "bez limitu"
+    unreadable = sum(entry['status'] == 'error' for entry in entries.values())
+    print(f"📁 Kafli: {len(tiles)} | do zrobienia: {len(pending)} | "
+          f"gotowe: {len(entries) - unreadable} | nieczytelne: {unreadable}")
+    print(f"   Równolegle: {jobs} × {workers} wątków, budżet pamięci: {budget}")
+
+    # Największe najpierw - krótki ogon na końcu batcha
+    pending.sort(key=lambda tile: tile.point_count, reverse=True)
+    running = {}
+    in_use = 0
+    t0 = time.time()
+
+    def admit():
+        nonlocal in_use
+        while pending and len(running) < jobs:
+            fits = [tile for tile in pending
+                    if not running or memory_budget is None or in_use + tile.memory <= memory_budget]
+            if not fits:
+                return
+            tile = fits[0]
+            pending.remove(tile)
+            tile.output_path.parent.mkdir(parents=True, exist_ok=True)
+            future = pool.submit(_classify_tile, str(tile.input_path), str(tile.output_path),
+                                 str(tile.log_path), options, workers, backend,
+                                 str(rules_path) if rules_path else None)
+            running[future] = (tile, time.time())
+            in_use += tile.memory
+
+    pool = ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context('spawn'),
+                               initializer=_init_tile_process, initargs=(workers,))
+    try:
+        admit()
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                tile, started = running.pop(future)
+                in_use -= tile.memory
+                seconds = time.time() - started
+                try:
+                    summary = future.result()
+                except Exception as e:
+                    entries[tile.name] = {'tile': tile.name, 'status': 'error', 'error': str(e),
+                                          'input': str(tile.input_path), 'log': str(tile.log_path)}
+                    print(f"❌ {tile.name}: {e} (log: {tile.log_path})")
+                    continue
+                stats = {
+                    'key': tile.key,
+                    'input': str(tile.input_path),
+                    'log': str(tile.log_path),
+                    'seconds': round(seconds, 3),
+                    'summary': summary,
+                }
+                _write_json(tile.stats_path, stats)
+                entries[tile.name] = {'tile': tile.name, 'status': 'done', **stats}
+                print(f"✅ {tile.name}: {summary['total_points']:,} pkt w {seconds:.1f}s "
+                      f"({summary['total_points'] / max(seconds, 1e-9) / 1e6:.2f}M pkt/s) "
+                      f"| zostało {len(pending) + len(running)}")
+            admit()
+    except KeyboardInterrupt:
+        print("\n⚠️  Przerwano - gotowe kafle zostają, kolejne uruchomienie dokończy resztę")
+        raise
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+    print(f"\nBatch: {time.time() - t0:.1f}s")
+    return [entries[tile.name] for tile in tiles if tile.name in entries]
+
+
+def write_report(entries, output_dir, rules):
+    """report.json (pełne wpisy) + report.csv (wiersz na kafel, kolumna na klasę)"""
+    output_dir = Path(output_dir)
+    done = [e for e in entries if e['status'] in ('done', 'skipped')]
+    totals = {'points': 0, 'class_counts': {}}
+    for entry in done:
+        totals['points'] += entry['summary']['total_points']
+        for class_id, count in entry['summary']['class_counts'].items():
+            totals['class_counts'][class_id] = totals['class_counts'].get(class_id, 0) + count
+    _write_json(output_dir / 'report.json', {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'tiles': entries,
+        'totals': {
+            'tiles': len(entries),
+            'done': sum(e['status'] == 'done' for e in entries),
+            'skipped': sum(e['status'] == 'skipped' for e in entries),
+            'errors': sum(e['status'] == 'error' for e in entries),
+            **totals,
+        },
+    })
+
+    class_ids = sorted({int(c) for e in done for c in e['summary']['class_counts']})
+    names = rules.class_names
+    with open(output_dir / 'report.csv', 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['tile', 'status', 'points', 'seconds', 'points_per_second', 'error']
+                        + [f"{c} {names.get(c, f'Class {c}')}" for c in class_ids])
+        for entry in entries:
+            summary = entry.get('summary')
+            if summary is None:
+                writer.writerow([entry['tile'], entry['status'], '', '', '', entry.get('error', '')]
+                                + [''] * len(class_ids))
+                continue
+            counts = {int(c): n for c, n in summary['class_counts'].items()}
+            seconds = entry.get('seconds') or 0
+            writer.writerow([entry['tile'], entry['status'], summary['total_points'], seconds,
+                             round(summary['total_points'] / seconds) if seconds else '', '']
+                            + [counts.get(c, 0) for c in class_ids])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Wsadowa klasyfikacja plików LAS/LAZ")
+    parser.add_argument('inputs', nargs='+', help="katalogi, globy albo pliki LAS/LAZ")
+    parser.add_argument('--output-dir', required=True, help="katalog wyników i raportu")
+    parser.add_argument('--recursive', action='store_true', help="także podkatalogi (i ** w globach)")
+    parser.add_argument('--format', default='las', choices=sorted(OUTPUT_FORMATS.values()))
+    parser.add_argument('--ply', action='store_true', help="dodatkowo PLY z kolorami klas")
+    parser.add_argument('--ground-model', default='grid', choices=('grid', 'global'))
+    parser.add_argument('--geometric-features', action='store_true')
+    parser.add_argument('--spatial-index', action='store_true')
+    parser.add_argument('--preview', type=int, default=0, help="budżet punktów podglądu (0 = bez)")
+    parser.add_argument('--chunk-size', type=int, default=5_000_000)
+    parser.add_argument('--jobs', type=int, default=None, help="kafli naraz (domyślnie liczba rdzeni)")
+    parser.add_argument('--memory-budget', type=float, default=None,
+                        help=f"GB dla wszystkich kafli (domyślnie {DEFAULT_MEMORY_FRACTION * 100:.0f}%% RAM)")
+    parser.add_argument('--backend', default='auto', choices=('auto', 'numpy', 'numba'))
+    parser.add_argument('--rules', help="plik JSON z regułami (rules.py)")
+    parser.add_argument('--force', action='store_true', help="licz od nowa także gotowe kafle")
+    args = parser.parse_args(argv)
+
+    options = {
+        'output_format': args.format,
+        'export_ply': args.ply,
+        'ground_model': args.ground_model,
+        'geometric_features': args.geometric_features,
+        'spatial_index': args.spatial_index,
+        'preview_budget': args.preview,
+        'chunk_size': args.chunk_size,
+    }
+    memory_budget = (int(args.memory_budget * 1024**3) if args.memory_budget is not None
+                     else default_memory_budget())
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    try:
+        entries = run_batch(args.inputs, output_dir, options, args.jobs, memory_budget,
+                            args.backend, args.rules, args.recursive, args.force)
+    except ValueError as e:
+        parser.error(str(e))
+    except KeyboardInterrupt:
+        return 130
+
+    if not entries:
+        print("Brak plików LAS/LAZ", file=sys.stderr)
+        return 1
+    write_report(entries, output_dir, load_rules(args.rules))
+    errors = sum(entry['status'] == 'error' for entry in entries)
+    print(f"Raport: {output_dir / 'report.json'}, {output_dir / 'report.csv'}"
+          f"{f' | błędy: {errors}' if errors else ''}")
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
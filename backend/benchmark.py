@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+"""
+Benchmark klasyfikatora - syntetyczne chmury LAS i czasy poszczególnych faz.
+
+Deklaracje typu "277M punktów w 2m10s" muszą być powtarzalne: generator
+tworzy lokalnie plik LAS o zadanej liczbie punktów i formacie (z RGB
+i intensywnością), a każda faza GeniusStreamingClassifier jest mierzona
+osobno, w świeżym procesie - szczytowy RSS (ru_maxrss) dotyczy tylko tej
+fazy. Wynik to JSON (pts/s, sekundy, szczyt RSS); --baseline porównuje go
+z poprzednim przebiegiem i kończy się kodem 1 przy regresji.
+
+Wejście jest czytane jak w potoku: las_columns.open_reader (memmap kolumn dla
+nieskompresowanego LAS, laspy dla LAZ).
+
+Fazy:
+    read       - samo dekodowanie chunków (punkt odniesienia dla pozostałych)
+    stats      - globalne statystyki Z (tani pre-pass przez próbkowanie bloków)
+    ground     - grid terenu 2D (osobny przebieg)
+    classify   - odczyt + klasyfikacja, bez zapisu
+    las_write  - odczyt + zapis LAS (bez klasyfikacji)
+    laz_write  - odczyt + zapis LAZ
+    ply_write  - odczyt + kodowanie i zapis PLY
+    pipeline   - process_file_streaming od początku do końca (+ jego czasy faz)
+
+Użycie:
+    python benchmark.py --points 20000000 --point-format 3 --output bench.json
+    python benchmark.py --points 20000000 --baseline bench.json --tolerance 0.15
+"""
+
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+import laspy
+
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from las_columns import open_reader
+
+PHASES = ('read', 'stats', 'ground', 'classify', 'las_write', 'laz_write', 'ply_write', 'pipeline')
+RGB_POINT_FORMATS = (2, 3, 5, 7, 8, 10)
+
+DEFAULT_POINTS = 10_000_000
+DEFAULT_DENSITY = 20.0  # punktów / m²
+GENERATE_CHUNK = 2_000_000
+WARMUP_POINTS = 10_000
+
+# Scena syntetyczna: udział, wysokość nad terenem (min, max), kolor RGB 8-bit, intensywność (min, max)
+SCENE = {
+    'ground':     (0.50, (0.0, 0.05), (150, 120, 90), (8000, 20000)),
+    'low_veg':    (0.10, (0.1, 0.5), (120, 170, 80), (5000, 15000)),
+    'trees':      (0.15, (2.0, 20.0), (40, 110, 40), (3000, 12000)),
+    'building':   (0.12, (6.0, 15.0), (170, 90, 80), (15000, 40000)),
+    'road':       (0.08, (0.0, 0.02), (70, 70, 75), (2000, 6000)),
+    'water':      (0.03, (-0.5, -0.4), (40, 70, 160), (200, 1500)),
+    'wires':      (0.01, (8.0, 12.0), (30, 30, 30), (1000, 4000)),
+    'noise':      (0.01, (-60.0, 80.0), (128, 128, 128), (0, 65535)),
+}
+
+
+def _las_version(point_format):
+    if point_format >= 6:
+        return '1.4'
+    return '1.3' if point_format in (4, 5) else '1.2'
+
+
+def generate_las(path, n_points, point_format=3, density=DEFAULT_DENSITY, seed=0,
+                 chunk_size=GENERATE_CHUNK):
+    """
+    Syntetyczny LAS: pochyły, pofalowany teren z obiektami z SCENE (budynki,
+    drzewa, drogi, woda, przewody, szum). Generowany chunkami - pamięć nie
+    zależy od n_points; ten sam seed daje ten sam plik.
+    """
+    if point_format not in RGB_POINT_FORMATS:
+        raise ValueError(f"point_format must have RGB: one of {RGB_POINT_FORMATS}, got {point_format}")
+
+    side = float(np.sqrt(n_points / density))
+    x0, y0 = 500_000.0, 250_000.0
+    header = laspy.LasHeader(point_format=point_format, version=_las_version(point_format))
+    header.scales = np.array([0.01, 0.01, 0.01])
+    header.offsets = np.array([x0, y0, 0.0])
+
+    names = list(SCENE)
+    shares = np.array([SCENE[name][0] for name in names])
+    shares /= shares.sum()
+
+    with laspy.open(path, mode='w', header=header) as writer:
+        for index, start in enumerate(range(0, n_points, chunk_size)):
+            n = min(chunk_size, n_points - start)
+            rng = np.random.default_rng([seed, index])
+            points = laspy.ScaleAwarePointRecord.zeros(n, header=header)
+
+            x = rng.uniform(0, side, n)
+            y = rng.uniform(0, side, n)
+            terrain = 100.0 + 0.03 * x + 2.0 * np.sin(x / 50.0) * np.cos(y / 70.0)
+
+            kind = rng.choice(len(names), size=n, p=shares)
+            above = np.empty(n)
+            rgb = np.empty((n, 3))
+            intensity = np.empty(n)
+            for k, name in enumerate(names):
+                sel = kind == k
+                m = int(sel.sum())
+                _, (h0, h1), color, (i0, i1) = SCENE[name]
+                above[sel] = rng.uniform(h0, h1, m)
+                rgb[sel] = np.clip(np.asarray(color) + rng.normal(0, 12, (m, 3)), 0, 255)
+                intensity[sel] = rng.uniform(i0, i1, m)
+
+            points.x = x0 + x
+            points.y = y0 + y
+            points.z = terrain + above
+            points.intensity = intensity.astype(np.uint16)
+            # LAS trzyma kolory w 16 bitach
+            points.red = (rgb[:, 0] * 257).astype(np.uint16)
+            points.green = (rgb[:, 1] * 257).astype(np.uint16)
+            points.blue = (rgb[:, 2] * 257).astype(np.uint16)
+            writer.write_points(points)
+    return Path(path)
+
+
+def _peak_rss_mb():
+    """Szczytowy RSS bieżącego procesu (None, gdy system nie udostępnia ru_maxrss)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux podaje KB, macOS bajty
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def _warmup(classifier, input_path):
+    """Kompilacja JIT kerneli poza pomiarem (cache numby może być pusty)"""
+    with open_reader(input_path) as f:
+        chunk = next(f.chunk_iterator(WARMUP_POINTS))
+        z_min, z_max = float(f.header.mins[2]), float(f.header.maxs[2])
+    classifier._classify_points(*classifier._chunk_features(chunk), z_min, max(z_max - z_min, 1.0))
+
+
+def _phase(phase, input_path, work_dir, chunk_size, workers, backend):
+    """Jedna faza w procesie-dziecku; zwraca czasy i szczytowy RSS"""
+    from classifier_genius import GeniusStreamingClassifier, _PlyEncoder
+    from ground_model import DEFAULT_CELL_SIZE
+    from las_columns import writable_points
+
+    work_dir = Path(work_dir)
+    output_path = work_dir / f"bench_{phase}.las"
+    extra = {}
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        classifier = GeniusStreamingClassifier(workers=workers, backend=backend)
+        if phase in ('classify', 'pipeline'):
+            _warmup(classifier, input_path)
+        # RSS po importach i JIT - szczyt fazy należy czytać względem tej wartości
+        base_rss = _peak_rss_mb()
+
+        with laspy.open(input_path) as f:
+            n_total = f.header.point_count
+            header = f.header
+
+        ground = None
+        z_min = height_range = None
+        if phase == 'classify':
+            # Przygotowanie (statystyki + teren) poza pomiarem - mierzymy sam przebieg klasyfikacji
+            z_min, _, z_range, _ = classifier._get_global_stats(input_path)
+            ground = classifier._build_ground_model(input_path, output_path, chunk_size, DEFAULT_CELL_SIZE)
+            height_range = ground.height_range if ground is not None else z_range
+
+        t0 = time.perf_counter()
+        if phase == 'read':
+            with open_reader(input_path) as f:
+                for chunk in f.chunk_iterator(chunk_size):
+                    # Memmap jest leniwy - redukcja po Z wymusza odczyt stron rekordów
+                    np.asarray(chunk.Z).max()
+        elif phase == 'stats':
+            classifier._get_global_stats(input_path, source='sample')
+        elif phase == 'ground':
+            ground = classifier._build_ground_model(input_path, output_path, chunk_size, DEFAULT_CELL_SIZE)
+        elif phase == 'classify':
+            counts = np.zeros(256, dtype=np.int64)
+
+            def discard(chunk, labels):
+                counts[:] += np.bincount(labels, minlength=256)
+
+            with open_reader(input_path) as f:
+                classifier._stream_classify(f, chunk_size, z_min, height_range, discard, ground)
+            extra['classified_points'] = int(counts.sum())
+        elif phase in ('las_write', 'laz_write'):
+            compress = phase == 'laz_write'
+            output_path = output_path.with_suffix('.laz' if compress else '.las')
+            with open_reader(input_path) as f, \
+                    laspy.open(output_path, mode='w', header=header, do_compress=compress) as out:
+                for chunk in f.chunk_iterator(chunk_size):
+                    out.write_points(writable_points(chunk))
+        elif phase == 'ply_write':
+            output_path = output_path.with_suffix('.ply')
+            with open_reader(input_path) as f, open(output_path, 'wb') as out:
+                encoder = _PlyEncoder(f.header, classifier._build_color_lut())
+                out.write(encoder.header(n_total))
+                for chunk in f.chunk_iterator(chunk_size):
+                    out.write(encoder.encode(chunk, np.asarray(chunk.classification, dtype=np.uint8)))
+        elif phase == 'pipeline':
+            summary = classifier.process_file_streaming(input_path, output_path, export_ply=True,
+                                                        chunk_size=chunk_size)
+            extra['timings'] = summary['timings']
+            extra['profile'] = summary['profile']
+        else:
+            raise ValueError(f"Unknown phase: {phase}")
+        seconds = time.perf_counter() - t0
+
+        if ground is not None:
+            ground.release()
+
+    if output_path.exists():
+        extra['output_size_mb'] = round(output_path.stat().st_size / 1024 / 1024, 2)
+    return {
+        'seconds': round(seconds, 4),
+        'points_per_second': round(n_total / seconds) if seconds > 0 else None,
+        'peak_rss_mb': _peak_rss_mb(),
+        'base_rss_mb': base_rss,
+        **extra,
+    }
+
+
+def _environment():
+    try:
+        import numba
+        numba_version = numba.__version__
+    except ImportError:
+        numba_version = None
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'laspy': laspy.__version__,
+        'numba': numba_version,
+    }
+
+
+def run_benchmark(input_path, phases=PHASES, chunk_size=5_000_000, workers=None, backend='auto',
+                  work_dir=None):
+    """
+    Mierzy fazy po kolei, każdą w nowym procesie (spawn). Pliki wynikowe
+    faz trafiają do work_dir i są usuwane po każdej fazie.
+    """
+    input_path = Path(input_path)
+    with laspy.open(input_path) as f:
+        n_total = f.header.point_count
+        point_format = f.header.point_format.id
+
+    work_dir = Path(work_dir or tempfile.mkdtemp(prefix='cpk-bench-'))
+    work_dir.mkdir(parents=True, exist_ok=True)
+    results = {}
+    for phase in phases:
+        phase_dir = work_dir / phase
+        phase_dir.mkdir(exist_ok=True)
+        try:
+            with ProcessPoolExecutor(max_workers=1,
+                                     mp_context=multiprocessing.get_context('spawn')) as pool:
+                results[phase] = pool.submit(_phase, phase, str(input_path), str(phase_dir),
+                                             chunk_size, workers, backend).result()
+        finally:
+            shutil.rmtree(phase_dir, ignore_errors=True)
+        res = results[phase]
+        print(f"   {phase:10s} {res['seconds']:9.2f}s  {res['points_per_second'] / 1e6:7.2f}M pts/s  "
+              f"RSS {res['peak_rss_mb']} MB")
+
+    return {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'environment': _environment(),
+        'config': {
+            'input': input_path.name,
+            'input_size_mb': round(input_path.stat().st_size / 1024 / 1024, 2),
+            'points': n_total,
+            'point_format': point_format,
+            'chunk_size': chunk_size,
+            'workers': workers or os.cpu_count(),
+            'backend': backend,
+        },
+        'phases': results,
+    }
+
+
+def compare(results, baseline, tolerance=0.1):
+    """
+    Regresje względem baseline: faza wolniejsza (pts/s) albo z większym
+    szczytem RSS o więcej niż tolerance. Zwraca listę opisów (pusta = OK).
+    """
+    regressions = []
+    for phase, res in results['phases'].items():
+        base = baseline.get('phases', {}).get(phase)
+        if base is None:
+            continue
+        if base.get('points_per_second') and res.get('points_per_second') \
+                and res['points_per_second'] < base['points_per_second'] * (1 - tolerance):
+            regressions.append(f"{phase}: {res['points_per_second']:,} pts/s "
+                               f"(baseline {base['points_per_second']:,})")
+        if base.get('peak_rss_mb') and res.get('peak_rss_mb') \
+                and res['peak_rss_mb'] > base['peak_rss_mb'] * (1 + tolerance):
+            regressions.append(f"{phase}: peak RSS {res['peak_rss_mb']} MB "
+                               f"(baseline {base['peak_rss_mb']} MB)")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark faz GeniusStreamingClassifier")
+    parser.add_argument('--input', help="istniejący plik LAS/LAZ zamiast generowanego")
+    parser.add_argument('--points', type=int, default=DEFAULT_POINTS, help="liczba punktów syntetycznych")
+    parser.add_argument('--point-format', type=int, default=3, choices=RGB_POINT_FORMATS)
+    parser.add_argument('--density', type=float, default=DEFAULT_DENSITY, help="punktów / m²")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--chunk-size', type=int, default=5_000_000)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--backend', default='auto', choices=('auto', 'numpy', 'numba'))
+    parser.add_argument('--phases', default=','.join(PHASES), help="fazy po przecinku")
+    parser.add_argument('--work-dir', help="katalog roboczy (domyślnie tymczasowy)")
+    parser.add_argument('--keep', action='store_true', help="nie usuwaj wygenerowanego pliku")
+    parser.add_argument('--output', help="zapisz wynik JSON do pliku (domyślnie stdout)")
+    parser.add_argument('--baseline', help="JSON poprzedniego przebiegu - regresja = kod wyjścia 1")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="dopuszczalne pogorszenie (0.1 = 10%%)")
+    args = parser.parse_args(argv)
+
+    phases = [p.strip() for p in args.phases.split(',') if p.strip()]
+    unknown = set(phases) - set(PHASES)
+    if unknown:
+        parser.error(f"unknown phases: {', '.join(sorted(unknown))}")
+
+    work_dir = Path(args.work_dir or tempfile.mkdtemp(prefix='cpk-bench-'))
+    work_dir.mkdir(parents=True, exist_ok=True)
+    generated = args.input is None
+    input_path = Path(args.input) if args.input else work_dir / f"synthetic_{args.points}_pf{args.point_format}.las"
+
+    try:
+        if generated:
+            print(f"Generowanie {args.points:,} punktów (format {args.point_format}) → {input_path}",
+                  file=sys.stderr)
+            t0 = time.perf_counter()
+            generate_las(input_path, args.points, args.point_format, args.density, args.seed)
+            print(f"   {time.perf_counter() - t0:.1f}s", file=sys.stderr)
+
+        with contextlib.redirect_stdout(sys.stderr):
+            results = run_benchmark(input_path, phases, args.chunk_size, args.workers,
+                                    args.backend, work_dir)
+        results['config'].update(generated=generated, seed=args.seed if generated else None,
+                                 density=args.density if generated else None)
+    finally:
+        if generated and not args.keep:
+            input_path.unlink(missing_ok=True)
+        if not args.work_dir and not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + '\n')
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -7,74 +7,227 @@ Klasyfikuje KAŻDY punkt bez wczytywania całego pliku do pamięci.
 Eksportuje do PLY z kolorami dla każdej klasy!
 """
 
+import os
 import time
 import gc
+import queue
+import threading
+import multiprocessing
 import numpy as np
 import laspy
-import time
 
 from pathlib import Path
-from collections import defaultdict
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from classifier_kernels import NUMBA_AVAILABLE, classify_points_numba, get_workspace
+from ground_model import DEFAULT_CELL_SIZE, MEMMAP_CELLS, build_ground_grid
+from label_delta import LabelDeltaWriter, input_key
+from las_columns import LasColumns, copy_file, open_reader, writable_points
+from metrics import ChunkTiming, Trace
+from preview import PREVIEW_BUDGET, PreviewSampler
+from rules import CLASSIFIER_VERSION, OUTPUT_FORMATS, load_rules
+from spatial_index import INDEX_TILE_SIZE, TileSpool, write_index
+from tiling import (TILE_SIZE, compute_geometric_features,
+                    LINEARITY, PLANARITY, SCATTERING, VERTICALITY, DIRECTION_Z, DENSITY)
+
+
+class ClassificationCancelled(Exception):
+    """Przerwanie klasyfikacji przez cancel_event (sprawdzane co chunk)"""
+
+
+class _OrderedWriter(threading.Thread):
+    """
+    Writer stage: odbiera (chunk, future) w kolejności odczytu i zapisuje wyniki.
+    Ograniczona kolejka = ograniczona liczba chunków w locie (stała pamięć).
+    """
+    
+    def __init__(self, write_fn, max_inflight):
+        super().__init__(name='ChunkWriter', daemon=True)
+        self.write_fn = write_fn
+        self.queue = queue.Queue(maxsize=max_inflight)
+        self.error = None
+        # Kto kogo blokuje: writer czeka na wynik workerów / reader na miejsce w kolejce
+        self.result_wait = 0.0
+        self.put_wait = 0.0
+    
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            chunk, future = item
+            if self.error is not None:
+                future.cancel()  # po błędzie tylko opróżniamy kolejkę
+                continue
+            try:
+                t0 = time.perf_counter()
+                result = future.result()
+                self.result_wait += time.perf_counter() - t0
+                self.write_fn(chunk, result)
+            except BaseException as e:
+                self.error = e
+    
+    def put(self, chunk, future):
+        """Zwraca False jeśli writer już padł - reader powinien przerwać"""
+        t0 = time.perf_counter()
+        self.queue.put((chunk, future))
+        self.put_wait += time.perf_counter() - t0
+        return self.error is None
+    
+    def close(self):
+        self.queue.put(None)
+        self.join()
+
+
+# Rekord PLY: xyz względem origin (float32 albo int32 w jednostkach skali LAS) + kolor klasy
+PLY_DTYPES = {
+    'float': np.dtype([('x', '<f4'), ('y', '<f4'), ('z', '<f4'),
+                       ('r', 'u1'), ('g', 'u1'), ('b', 'u1'), ('class', 'u1')]),
+    'int32': np.dtype([('x', '<i4'), ('y', '<i4'), ('z', '<i4'),
+                       ('r', 'u1'), ('g', 'u1'), ('b', 'u1'), ('class', 'u1')]),
+}
+
+
+class _PlyEncoder:
+    """
+    Chunki PLY względem lokalnego origin zamiast współrzędnych w milionach
+    metrów (PL-1992/2000) rzutowanych na float32 - tam float32 gubi centymetry.
+
+    Origin leży na siatce skali LAS, więc x - origin liczone jest dokładnie
+    na surowych intach rekordu. coords='int32' zapisuje te inty wprost
+    (x = origin + wartość * scale, oba w komentarzach nagłówka).
+    dtype i bufor rekordów są tworzone raz - chunk to jeden write(bufor).
+    """
+    
+    def __init__(self, header, color_lut, coords='float'):
+        if coords not in PLY_DTYPES:
+            raise ValueError(f"coords must be one of {sorted(PLY_DTYPES)}, got {coords!r}")
+        self.coords = coords
+        self.dtype = PLY_DTYPES[coords]
+        self.color_lut = color_lut
+        
+        self.scales = np.asarray(header.scales, dtype=np.float64)
+        offsets = np.asarray(header.offsets, dtype=np.float64)
+        mins = np.asarray(header.mins, dtype=np.float64)
+        self.origin_raw = np.floor((mins - offsets) / self.scales).astype(np.int64)
+        self.origin = offsets + self.origin_raw * self.scales
+        
+        if coords == 'int32':
+            extent_raw = (np.asarray(header.maxs) - self.origin) / self.scales
+            if np.any(extent_raw >= 2**31):
+                raise ValueError("Point extent does not fit int32 at the LAS scale - use coords='float'")
+        
+        self._buffer = np.empty(0, dtype=self.dtype)
+    
+    def header(self, n_total):
+        """Nagłówek binarnego PLY dla n_total punktów"""
+        prop = 'int' if self.coords == 'int32' else 'float'
+        comments = [
+            "comment GENIUS Classifier - Classified Point Cloud",
+            "comment origin {!r} {!r} {!r}".format(*map(float, self.origin)),
+        ]
+        if self.coords == 'int32':
+            comments.append("comment scale {!r} {!r} {!r}".format(*map(float, self.scales)))
+        lines = [
+            "ply",
+            "format binary_little_endian 1.0",
+            *comments,
+            f"element vertex {n_total}",
+            f"property {prop} x",
+            f"property {prop} y",
+            f"property {prop} z",
+            "property uchar red",
+            "property uchar green",
+            "property uchar blue",
+            "property uchar classification",
+            "end_header",
+        ]
+        return ("\n".join(lines) + "\n").encode('ascii')
+    
+    def encode(self, chunk, labels):
+        """Rekordy chunka w buforze wielokrotnego użytku (widok - zapisać przed kolejnym)"""
+        n = len(labels)
+        if len(self._buffer) < n:
+            self._buffer = np.empty(n, dtype=self.dtype)
+        data = self._buffer[:n]
+        
+        for axis, name, raw in ((0, 'x', chunk.X), (1, 'y', chunk.Y), (2, 'z', chunk.Z)):
+            rel = np.subtract(raw, self.origin_raw[axis], dtype=np.int64)
+            if self.coords == 'int32':
+                data[name] = rel
+            else:
+                data[name] = rel * self.scales[axis]
+        
+        # ULTRA SZYBKIE mapowanie kolorów przez lookup table!
+        colors = self.color_lut[labels]
+        data['r'] = colors[:, 0]
+        data['g'] = colors[:, 1]
+        data['b'] = colors[:, 2]
+        data['class'] = labels
+        return data
 
 
 class GeniusStreamingClassifier:
     """
     GENIUS APPROACH:
     1. Wczytaj TYLKO sample punktów (do DBSCAN/statystyk)
-    2. Podziel przestrzeń na grid 2D
-    3. Dla każdego chunka: klasyfikuj heurystycznie
+    2. Podziel przestrzeń na grid 2D → lokalny model terenu (min Z w komórce)
+    3. Dla każdego chunka: klasyfikuj heurystycznie (wysokość nad terenem)
     4. Zapisuj bezpośrednio do pliku wyjściowego (streaming!)
     
     Rezultat: KAŻDY punkt sklasyfikowany, ZERO problemów z pamięcią!
     """
     
-    def __init__(self):
-        self.classes = {
-            1:  {'name': 'Unclassified', 'color': [200, 200, 200]},
-            2:  {'name': 'Ground', 'color': [139, 69, 19]},
-            3:  {'name': 'Low Vegetation', 'color': [144, 238, 144]},
-            4:  {'name': 'Medium Vegetation', 'color': [34, 139, 34]},
-            5:  {'name': 'High Vegetation', 'color': [0, 100, 0]},
-            6:  {'name': 'Building', 'color': [70, 130, 180]},
-            7:  {'name': 'Noise', 'color': [255, 0, 255]},
-            9:  {'name': 'Water', 'color': [0, 0, 255]},
-            11: {'name': 'Fence', 'color': [255, 255, 0]},  # Zmieniono z 36 na 11
-            13: {'name': 'Bridge', 'color': [128, 0, 128]},  # Zmieniono z 17 na 13
-            14: {'name': 'Rail', 'color': [255, 140, 0]},    # Zmieniono z 18 na 14
-            15: {'name': 'Pole', 'color': [255, 0, 0]},      # Zmieniono z 20 na 15
-            16: {'name': 'Sign', 'color': [255, 192, 203]},  # Zmieniono z 22 na 16
-            17: {'name': 'Road', 'color': [64, 64, 64]},     # Zmieniono z 30 na 17
-            18: {'name': 'Sidewalk', 'color': [192, 192, 192]},  # Zmieniono z 31 na 18
-        }
+    def __init__(self, workers=None, executor='thread', backend='auto', rules=None):
+        if executor not in ('thread', 'process'):
+            raise ValueError(f"executor must be 'thread' or 'process', got {executor!r}")
+        if backend not in ('auto', 'numpy', 'numba'):
+            raise ValueError(f"backend must be 'auto', 'numpy' or 'numba', got {backend!r}")
+        if backend == 'numba' and not NUMBA_AVAILABLE:
+            raise RuntimeError("backend='numba' requested but numba is not installed")
+        
+        # Silnik klasyfikacji: skompilowany kernel Numba lub wektoryzowany numpy
+        self.backend = 'numba' if backend == 'auto' and NUMBA_AVAILABLE else backend
+        if self.backend == 'auto':
+            self.backend = 'numpy'
+        
+        # Pula workerów klasyfikacji (None = wszystkie rdzenie)
+        self.workers = workers or os.cpu_count() or 1
+        self.executor = executor
+        
+        # Tabela klas i reguł (rules.py albo plik JSON strojony pod teren)
+        self.rules = load_rules(rules)
+        self.classes = self.rules.classes
+        self._program = self.rules.compile()
+        self._geometry_classes = self.rules.geometry_classes()
         
         print(f"🧠 GENIUS STREAMING CLASSIFIER - {len(self.classes)} klas")
         print("   Klasyfikuje KAŻDY punkt bez problemów z pamięcią!")
+        print(f"   Workers: {self.workers} ({self.executor}), backend: {self.backend}")
     
-    def _get_global_stats(self, input_path, sample_size=50000):
-        """Wczytaj sample punktów dla globalnych statystyk (z_min, z_max)"""
-        print(f"\n📊 Analiza pliku (sample {sample_size:,} punktów)...")
+    def _get_global_stats(self, input_path, sample_size=50000, source='header'):
+        """
+        Globalne statystyki (z_min, z_max) BEZ dekodowania całego pliku.
+
+        source='header' - granice Z z nagłówka LAS (zero I/O punktów),
+        source='sample' - tani pre-pass: kilkadziesiąt bloków przez seek().
+        Jeśli nagłówek ma niepoprawne granice, automatycznie używamy sample.
+        """
+        print(f"\n📊 Analiza pliku (źródło: {source})...")
         t0 = time.time()
         
-        with laspy.open(input_path) as f:
+        with open_reader(input_path) as f:
             n_total = f.header.point_count
             print(f"   Całkowita liczba punktów: {n_total:,}")
             
-            # Wczytaj równomierny sample
-            step = max(1, n_total // sample_size)
+            z_min, z_max = float(f.header.mins[2]), float(f.header.maxs[2])
+            header_ok = np.isfinite([z_min, z_max]).all() and z_max > z_min
             
-            z_values = []
-            count = 0
+            if source == 'sample' or not header_ok:
+                z_min, z_max = self._sample_z_bounds(f, n_total, sample_size)
             
-            for chunk in f.chunk_iterator(1_000_000):
-                indices = np.arange(0, len(chunk.z), step)
-                z_values.append(chunk.z[indices])
-                count += len(chunk.z)
-                print(f"   Progress: {count/n_total*100:.0f}%", end='\r')
-            
-            z_all = np.concatenate(z_values)
-            z_min, z_max = z_all.min(), z_all.max()
             z_range = z_max - z_min
-            
             print(f"   ✓ Z range: {z_min:.2f} - {z_max:.2f} (Δ={z_range:.2f}m)")
         
         t_stats = time.time() - t0
@@ -82,124 +235,367 @@ class GeniusStreamingClassifier:
         
         return z_min, z_max, z_range, n_total
     
-    def _classify_points_vectorized(self, z, intensity, rgb, z_min, z_range):
+    def _sample_z_bounds(self, reader, n_total, sample_size, n_blocks=64):
+        """Równomierny sample Z - czyta tylko n_blocks małych bloków (seek)"""
+        if reader.header.are_points_compressed:
+            n_blocks = min(n_blocks, 8)  # seek w LAZ = dekompresja od początku chunka
+        block = max(1, sample_size // n_blocks)
+        starts = np.linspace(0, max(0, n_total - block), n_blocks).astype(np.int64)
+        
+        z_values = []
+        for start in np.unique(starts):
+            reader.seek(int(start))
+            points = reader.read_points(block)
+            if len(points) > 0:
+                z_values.append(np.asarray(points.z))
+        
+        z_all = np.concatenate(z_values)
+        return float(z_all.min()), float(z_all.max())
+    
+    def _build_ground_model(self, input_path, output_path, chunk_size, cell_size,
+                            chunk_callback=None):
         """
-        ULEPSZONA wektoryzowana klasyfikacja - dokładniejsza!
-        Przetwarza cały chunk naraz (bez pętli!)
+        Grid 2D z terenem (min Z w komórce) - osobny strumieniowy przebieg.
+        Duży grid ląduje w memmap obok wyniku; dla puli procesów zawsze
+        (workery dostają ścieżkę zamiast kopii gridu).
         """
-        n = len(z)
-        
-        # Normalizacja
-        z_rel = (z - z_min) / (z_range + 1e-6)
-        intensity_norm = intensity.astype(np.float32) / 65535.0
-        
-        r = rgb[:, 0].astype(np.float32) / 65535.0
-        g = rgb[:, 1].astype(np.float32) / 65535.0
-        b = rgb[:, 2].astype(np.float32) / 65535.0
-        
-        # Dodatkowe cechy
-        greenness = g - (r + b) / 2.0
-        brightness = (r + g + b) / 3.0
-        blueness = b - (r + g) / 2.0
-        redness = r - (g + b) / 2.0
-        
-        # Inicjalizuj wszystkie jako Unclassified
-        labels = np.ones(n, dtype=np.uint8)
-        
-        # === ULEPSZONA PRIORYTETOWA KLASYFIKACJA ===
-        
-        # 1. GROUND - bardzo nisko, brązowe/szare, nie zielone
-        ground = (z_rel < 0.03) & (greenness < 0.08) & (brightness > 0.15)
-        labels[ground] = 2
-        
-        # 2. WATER - bardzo nisko, bardzo ciemne, niebieskawe
-        water = (z_rel < 0.02) & (brightness < 0.12) & (labels == 1)
-        labels[water] = 9
-        
-        # 3. VEGETATION - zielone (BARDZIEJ LIBERALNE PROGI!)
-        vegetation = (greenness > 0.08) & (labels == 1)
-        veg_low = vegetation & (z_rel < 0.15)
-        veg_med = vegetation & (z_rel >= 0.15) & (z_rel < 0.40)
-        veg_high = vegetation & (z_rel >= 0.40)
-        labels[veg_low] = 3
-        labels[veg_med] = 4
-        labels[veg_high] = 5
-        
-        # 4. ROAD - nisko, ciemne, wysokość pod mostem
-        road = (z_rel < 0.05) & (brightness < 0.35) & (intensity_norm > 0.45) & (labels == 1)
-        labels[road] = 17
-        
-        # 5. BRIDGE/MOST - średnia wysokość, jasne, struktury mostowe
-        # To jest główna powierzchnia mostu!
-        bridge = (z_rel > 0.10) & (z_rel < 0.35) & (brightness > 0.35) & (greenness < 0.05) & (labels == 1)
-        labels[bridge] = 13
-        
-        # 6. BUILDING - bardzo wysokie (wyżej niż most), jasne
-        building = (z_rel > 0.40) & (brightness > 0.30) & (greenness < 0.08) & (labels == 1)
-        labels[building] = 6
-        
-        # 7. SIDEWALK - nisko/średnio, jasne betonowe
-        sidewalk = (z_rel > 0.03) & (z_rel < 0.12) & (brightness > 0.35) & (brightness < 0.55) & (labels == 1)
-        labels[sidewalk] = 18
-        
-        # 8. RAIL - metaliczne szyny (wysoka intensywność)
-        rail = (z_rel < 0.08) & (intensity_norm > 0.65) & (brightness < 0.35) & (labels == 1)
-        labels[rail] = 14
-        
-        # 9. POLE/SŁUP - bardzo wysokie, wąskie (punkty nad mostem - słupy energetyczne)
-        # BARDZIEJ RESTRYKCYJNE PROGI!
-        pole = (z_rel > 0.70) & (labels == 1)
-        labels[pole] = 15
-        
-        # 10. FENCE - balustrady mostu, średnia wysokość
-        fence = (z_rel > 0.15) & (z_rel < 0.30) & (intensity_norm > 0.40) & (greenness < 0.05) & (labels == 1)
-        labels[fence] = 11
-        
-        # 11. SIGN - znaki drogowe (jasne, kolorowe, średnia wysokość)
-        sign = (z_rel > 0.10) & (z_rel < 0.25) & ((redness > 0.15) | (brightness > 0.60)) & (labels == 1)
-        labels[sign] = 16
+        print(f"\n🗺️  Model terenu: grid {cell_size:g} m...")
+        t0 = time.time()
+        
+        memmap_path = output_path.parent / f"{output_path.stem}_ground.npy"
+        memmap_cells = 0 if self.executor == 'process' and self.workers > 1 else MEMMAP_CELLS
+        
+        with open_reader(input_path) as f:
+            ground = build_ground_grid(f, chunk_size, cell_size=cell_size,
+                                       memmap_path=memmap_path, memmap_cells=memmap_cells,
+                                       chunk_callback=chunk_callback)
+        
+        if ground is None:
+            print("   ⚠️  Brak poprawnego zasięgu XY w nagłówku - globalne z_min")
+            return None
+        
+        ny, nx = ground.shape
+        print(f"   ✓ Grid {nx}×{ny} komórek ({ground.cell_size:g} m)"
+              f"{' [memmap]' if ground.path else ''}, "
+              f"wysokość nad terenem do {ground.height_range:.2f} m")
+        print(f"   ✓ Czas: {time.time() - t0:.1f}s")
+        return ground
+    
+    def _build_geometric_features(self, input_path, output_path, chunk_size, tile_size,
+                                  tiling_callback=None, features_callback=None):
+        """Cechy sąsiedztwa z kafli z halo - memmap obok wyniku (tiling.py)"""
+        print(f"\n🧩 Kafle {tile_size:g} m + halo, cechy sąsiedztwa...")
+        t0 = time.time()
+        
+        with open_reader(input_path) as f:
+            features = compute_geometric_features(
+                f, chunk_size, output_path.parent, output_path.stem,
+                tile_size=tile_size, workers=self.workers,
+                chunk_callback=tiling_callback, tile_callback=features_callback
+            )
         
+        if features is None:
+            print("   ⚠️  Brak poprawnego zasięgu XY w nagłówku - bez cech geometrycznych")
+            return None
+        
+        print(f"   ✓ Czas: {time.time() - t0:.1f}s")
+        return features
+    
+    def _refine_with_geometry(self, labels, features):
+        """
+        Korekta etykiet cechami sąsiedztwa - tam, gdzie reguły per-punkt
+        (wysokość, kolor) nie odróżniają klas.
+        """
+        features = np.asarray(features)
+        linearity = features[:, LINEARITY]
+        planarity = features[:, PLANARITY]
+        scattering = features[:, SCATTERING]
+        verticality = features[:, VERTICALITY]
+        direction_z = features[:, DIRECTION_Z]
+        density = features[:, DENSITY]
+        
+        # Numery klas z tabeli reguł (po nazwie) - None wyłącza dany krok
+        classes = self._geometry_classes
+        unclassified, pole_class = self.rules.default, classes['pole']
+        
+        def is_(*class_ids):
+            return np.isin(labels, [c for c in class_ids if c is not None])
+        
+        labels = labels.copy()
+        open_ = is_(unclassified, pole_class)
+        
+        # SŁUP - pionowa linia (reguła per-punkt patrzy tylko na wysokość)
+        pole = open_ & (linearity > 0.80) & (direction_z > 0.90) & (pole_class is not None)
+        # BUDYNEK - pozioma płaszczyzna (dach) zamiast "słupa" albo nieznanego
+        roof = open_ & ~pole & (planarity > 0.60) & (verticality < 0.30) & (scattering < 0.05)
+        # ZIELONY DACH - płaska "roślinność" średnia/wysoka
+        green_roof = (is_(classes['vegetation_medium'], classes['vegetation_high'])
+                      & (planarity > 0.70) & (verticality < 0.20))
+        # SZUM - izolowane punkty (16 sąsiadów w promieniu > ~2 m)
+        noise = is_(unclassified) & (density < 0.5)
+        
+        if pole_class is not None:
+            labels[pole] = pole_class
+            # słup bez geometrii linii → nieznany
+            labels[open_ & ~pole & (labels == pole_class)] = unclassified
+        if classes['building'] is not None:
+            labels[roof | green_roof] = classes['building']
+        if classes['noise'] is not None:
+            labels[noise & ~pole & ~roof] = classes['noise']
         return labels
     
-    def process_file_streaming(self, input_path, output_path):
+    def _classify_points(self, z_raw, z_scale, z_offset, intensity, red, green, blue,
+                         z_min, z_range, ground=None, xy=None):
         """
-        STREAMING PROCESSING - klasyfikuje chunk po chunku
+        Klasyfikacja chunka wybranym backendem (numba / numpy workspace)
+        według skompilowanych reguł (self.rules).
+        z_raw to surowe Z z rekordu LAS - skalowanie robi kernel/workspace.
+        Z gridem terenu (ground + surowe xy) z_rel to wysokość nad terenem.
+        """
+        if self.backend == 'numba':
+            return classify_points_numba(
+                z_raw, intensity, red, green, blue, z_min, z_range,
+                z_scale=z_scale, z_offset=z_offset, parallel=self.workers <= 1,
+                ground=ground, xy=xy, program=self._program
+            )
+        return get_workspace(len(z_raw)).classify(
+            z_raw, intensity, red, green, blue, z_min, z_range,
+            z_scale=z_scale, z_offset=z_offset, ground=ground, xy=xy, program=self._program
+        )
+    
+    def _classify_chunk(self, *args):
+        """_classify_points + pomiar (ChunkTiming) - wykonywane w workerze puli"""
+        start, cpu = time.perf_counter(), time.thread_time()
+        labels = self._classify_points(*args)
+        return labels, ChunkTiming(start, time.perf_counter() - start, time.thread_time() - cpu)
+    
+    def process_file_streaming(self, input_path, output_path, export_ply=True,
+                               stats_source='header', chunk_size=5_000_000,
+                               cancel_event=None, progress_callback=None,
+                               ground_model='grid', ground_cell_size=DEFAULT_CELL_SIZE,
+                               geometric_features=False, tile_size=TILE_SIZE,
+                               spatial_index=False, index_tile_size=INDEX_TILE_SIZE,
+                               preview_budget=PREVIEW_BUDGET, ply_coords='float',
+                               output_format=None, laz_backend=None, update_in_place=None,
+                               trace=None):
+        """
+        STREAMING PROCESSING - jeden przebieg: odczyt → klasyfikacja → zapis
+        Każdy chunk jest dekodowany RAZ i trafia jednocześnie do LAS i PLY.
         Nie wczytuje całego pliku do pamięci!
+        
+        Zwraca podsumowanie: histogram klas, czasy faz i ścieżki wyników
+        (serwer zapisuje je jako sidecar, żeby statystyki nie czytały punktów).
+        
+        cancel_event (threading.Event) - ustawiony przerywa zadanie przed
+        kolejnym chunkiem wyjątkiem ClassificationCancelled.
+        
+        progress_callback(dict) - wołany na starcie każdej fazy i po każdym
+        chunku: phase, step/steps (numer fazy), points_done, points_total,
+        percent, points_per_second, eta_seconds.
+        
+        ground_model='grid' - wysokość liczona nad lokalnym terenem (grid
+        ground_cell_size m, dodatkowy przebieg odczytu); 'global' - względem
+        jednego z_min całego pliku, jak w pierwszej wersji.
+        
+        geometric_features=True - kafle tile_size m z halo, cechy sąsiedztwa
+        (tiling.py, dwa dodatkowe przebiegi) i korekta etykiet geometrią.
+        
+        spatial_index=True - LAS zapisany kaflami index_tile_size m w kolejności
+        Mortona + sidecar {stem}_index.json (spatial_index.py) do zapytań bbox/klasy.
+        
+        preview_budget - podgląd dla przeglądarki {stem}_preview.bin/.json
+        (preview.py): tyle punktów z poziomami LOD; 0 = bez podglądu.
+        
+        ply_coords - 'float' (float32 względem origin) albo 'int32' (surowe
+        jednostki skali LAS względem origin), patrz _PlyEncoder.
+        
+        output_format - 'las', 'laz' albo 'labels' (None = z rozszerzenia
+        output_path). 'laz' kompresuje przez laspy; laz_backend=None wybiera
+        wielowątkowy LazrsParallel, gdy lazrs jest zainstalowany. 'labels'
+        zapisuje tylko etykiety przypięte do wejścia (label_delta.py) - bez
+        kopii punktów. Indeks przestrzenny dotyczy tylko 'las'.
+        
+        update_in_place - wynik LAS jako kopia wejścia (reflink/copy_file_range)
+        z etykietami wpisanymi w memmap rekordów zamiast przepisania każdego
+        rekordu przez laspy (las_columns.py). None = gdy się da: nieskompresowany
+        LAS → 'las' bez indeksu przestrzennego (kafle zmieniają kolejność
+        punktów). Nagłówek zostaje taki jak w wejściu.
+        
+        trace (metrics.Trace) - spany faz i chunków (decode, classify,
+        write_las, write_ply...), liczniki punktów/bajtów; None = nowy Trace
+        zapisujący tylko do rejestru procesu. Podsumowanie w summary['profile'].
         """
+        if ground_model not in ('grid', 'global'):
+            raise ValueError(f"ground_model must be 'grid' or 'global', got {ground_model!r}")
+        
         input_path = Path(input_path)
         output_path = Path(output_path)
+        if output_format is None:
+            output_format = OUTPUT_FORMATS.get(output_path.suffix.lower(), 'las')
+        if output_format not in OUTPUT_FORMATS.values():
+            raise ValueError(f"output_format must be one of {sorted(OUTPUT_FORMATS.values())}, "
+                             f"got {output_format!r}")
+        # Klasy spoza zakresu formatu punktów (0-31 w formatach 0-5) - błąd, nie obcięcie
+        with laspy.open(input_path) as f:
+            point_format_id = f.header.point_format.id
+        refine_classes = (c for c in self._geometry_classes.values() if c is not None)
+        self.rules.check_point_format(point_format_id,
+                                      tuple(refine_classes) if geometric_features else ())
+        
+        # Zakresy bajtów indeksu mają sens tylko w nieskompresowanym LAS
+        spatial_index = spatial_index and output_format == 'las'
+        can_update = self._can_update_in_place(input_path, output_path, output_format,
+                                               spatial_index)
+        if update_in_place and not can_update:
+            raise ValueError("update_in_place needs an uncompressed LAS input, a separate "
+                             "'las' output and no spatial index")
+        update_in_place = can_update if update_in_place is None else update_in_place
+        ply_path = output_path.parent / f"{output_path.stem}.ply"
+        trace = trace if trace is not None else Trace()
+        
+        phases = (['stats'] + (['ground'] if ground_model == 'grid' else [])
+                  + (['tiling', 'features'] if geometric_features else []) + ['classify']
+                  + (['index'] if spatial_index else []))
+        
+        def report(phase, done=0, total=0, speed=0.0, eta=None):
+            if progress_callback is not None:
+                progress_callback({
+                    'phase': phase,
+                    'step': phases.index(phase) if phase in phases else len(phases),
+                    'steps': len(phases),
+                    'points_done': int(done),
+                    'points_total': int(total),
+                    'percent': round(done / total * 100, 2) if total else 0.0,
+                    'points_per_second': round(speed),
+                    'eta_seconds': round(eta, 1) if eta is not None else None,
+                })
+        
+        # === KROK 1: GLOBALNE STATYSTYKI (nagłówek / sample) ===
+        t_start = time.time()
+        report('stats')
+        with trace.span('stats'):
+            z_min, z_max, z_range, n_total = self._get_global_stats(input_path, source=stats_source)
+        
+        def phase_progress(phase):
+            """Callback postępu przebiegu pomocniczego (+ sprawdzenie anulowania)"""
+            t1 = time.time()
+            report(phase, 0, n_total)
+            
+            def callback(done):
+                if cancel_event is not None and cancel_event.is_set():
+                    raise ClassificationCancelled(f"Cancelled during {phase}")
+                elapsed = time.time() - t1
+                speed = done / elapsed if elapsed > 0 else 0
+                report(phase, done, n_total, speed,
+                       (n_total - done) / speed if speed > 0 else None)
+            return callback
+        
+        # === KROK 1b: MODEL TERENU (grid 2D) ===
+        ground = None
+        if ground_model == 'grid':
+            with trace.span('ground'):
+                ground = self._build_ground_model(input_path, output_path, chunk_size,
+                                                  ground_cell_size, phase_progress('ground'))
+        
+        # === KROK 1c: CECHY SĄSIEDZTWA (kafle + halo) ===
+        features = None
+        if geometric_features:
+            try:
+                with trace.span('features'):
+                    features = self._build_geometric_features(
+                        input_path, output_path, chunk_size, tile_size,
+                        phase_progress('tiling'), phase_progress('features')
+                    )
+            except BaseException:
+                if ground is not None:
+                    ground.release()
+                raise
+        
+        # z_rel = wysokość nad terenem / zakres tej wysokości
+        height_range = ground.height_range if ground is not None else z_range
+        ground_info = {
+            'model': 'grid' if ground is not None else 'global',
+            'cell_size': ground.cell_size if ground is not None else None,
+            'shape': list(ground.shape) if ground is not None else None,
+            'height_range': float(height_range),
+        }
         
-        # === KROK 1: GLOBALNE STATYSTYKI ===
-        z_min, z_max, z_range, n_total = self._get_global_stats(input_path)
-        
-        # === KROK 2: STREAMING CLASSIFICATION ===
-        print(f"\nStreaming klasyfikacja {n_total:,} punktów...")
+        # === KROK 2: STREAMING KLASYFIKACJA + ZAPIS LAS/PLY ===
+        print(f"\nStreaming klasyfikacja {n_total:,} punktów "
+              f"({output_format.upper()}{' + PLY' if export_ply else ''})...")
         t0 = time.time()
         
-        chunk_size = 5_000_000  # 5M punktów na raz
         processed = 0
-        stats = defaultdict(int)
-        
-        # Klasyfikuj chunk po chunku i zapisz bezpośrednio
-        all_classifications = []
-        
-        with laspy.open(input_path) as f_in:
-            for chunk_idx, chunk in enumerate(f_in.chunk_iterator(chunk_size)):
-                # Klasyfikuj chunk
-                z = chunk.z
-                intensity = chunk.intensity
-                rgb = np.vstack([chunk.red, chunk.green, chunk.blue]).T
+        class_counts = np.zeros(256, dtype=np.int64)  # histogram klas - stała pamięć
+        color_lut = self._build_color_lut()
+        
+        with trace.span('stream'), \
+                (ground if ground is not None else nullcontext()), \
+                (features if features is not None else nullcontext()), \
+                open_reader(input_path, laz_backend) as f_in, \
+                self._open_output(output_path, f_in.header, output_format, input_path,
+                                  laz_backend, update_in_place) as f_out, \
+                (open(ply_path, 'wb') if export_ply else nullcontext()) as ply_file:
+            
+            ply_encoder = None
+            if ply_file is not None:
+                ply_encoder = _PlyEncoder(f_in.header, color_lut, ply_coords)
+                ply_file.write(ply_encoder.header(n_total))
+            
+            # Podgląd LOD - próbka o stałym budżecie zbierana w tym samym przebiegu
+            sampler = None
+            if preview_budget:
+                sampler = PreviewSampler(f_in.header.mins, f_in.header.maxs, preview_budget)
+            
+            # Tryb indeksu: rekordy najpierw do spoola kafli, LAS składany na końcu
+            spool = None
+            if spatial_index:
+                spool = TileSpool(output_path.parent / f"{output_path.stem}_spool",
+                                  f_in.header.point_format, f_in.header.mins[0],
+                                  f_in.header.mins[1], index_tile_size)
+            
+            def write_chunk(chunk, chunk_labels):
+                nonlocal processed, class_counts
+                
+                if cancel_event is not None and cancel_event.is_set():
+                    raise ClassificationCancelled(f"Cancelled after {processed:,} points")
+                
+                n = len(chunk_labels)
+                if features is not None:
+                    with trace.span('refine', chunk=True, points=n):
+                        chunk_labels = self._refine_with_geometry(
+                            chunk_labels, features[processed:processed + n]
+                        )
                 
-                chunk_labels = self._classify_points_vectorized(
-                    z, intensity, rgb, z_min, z_range
-                )
+                # Zapisz od razu do obu wyjść - bez ponownego dekodowania.
+                # Pełne rekordy tylko dla LAS/LAZ; 'labels' i kopia w miejscu ich nie potrzebują
+                with trace.span('write_las', chunk=True, points=n):
+                    if update_in_place:
+                        f_out.write_classification(processed, chunk_labels)
+                    elif spool is not None or output_format != 'labels':
+                        points = writable_points(chunk)
+                        points.classification = chunk_labels
+                        if spool is not None:
+                            spool.add(points, chunk_labels)
+                        else:
+                            f_out.write_points(points)
+                    else:
+                        f_out.write(chunk_labels)
                 
-                all_classifications.append(chunk_labels)
+                if ply_encoder is not None:
+                    with trace.span('write_ply', chunk=True, points=n):
+                        ply_file.write(ply_encoder.encode(chunk, chunk_labels))
                 
-                # Statystyki
-                unique, counts = np.unique(chunk_labels, return_counts=True)
-                for class_id, count in zip(unique, counts):
-                    stats[class_id] += count
+                if sampler is not None:
+                    with trace.span('sample', chunk=True, points=n):
+                        sampler.add(chunk.x, chunk.y, chunk.z, chunk_labels, processed)
+                
+                # Statystyki (bincount zamiast np.unique - bez sortowania chunka)
+                class_counts += np.bincount(chunk_labels, minlength=256)
+                
+                # Writer jest ostatnim użytkownikiem chunka - jego strony memmapu poza RSS
+                if isinstance(f_in, LasColumns):
+                    f_in.release(processed, processed + n)
                 
                 processed += len(chunk_labels)
                 progress = processed / n_total * 100
@@ -211,42 +607,36 @@ class GeniusStreamingClassifier:
                 print(f"   Progress: {progress:.1f}% | "
                       f"Speed: {speed/1e6:.1f}M pts/s | "
                       f"ETA: {eta:.0f}s", end='\r')
-        
-        print(f"\n   Klasyfikacja: {time.time() - t0:.1f}s")
-        
-        # === KROK 3: ZAPISZ WYNIK (używając chunk_iterator do zapisu) ===
-        print(f"\n💾 Zapisywanie wyniku (streaming)...")
-        t_save = time.time()
-        
-        # Połącz wszystkie klasyfikacje
-        all_classifications = np.concatenate(all_classifications)
-        
-        # Użyj laspy do zapisu w kawałkach
-        with laspy.open(input_path) as f_in:
-            # Skopiuj header
-            header = f_in.header
+                report('classify', processed, n_total, speed, eta)
             
-            # Utwórz nowy plik
-            with laspy.open(output_path, mode='w', header=header) as f_out:
-                offset = 0
-                for chunk in f_in.chunk_iterator(chunk_size):
-                    chunk_size_actual = len(chunk.classification)
-                    
-                    # Przypisz klasyfikacje do chunka
-                    chunk.classification = all_classifications[offset:offset+chunk_size_actual]
-                    
-                    # Zapisz chunk
-                    f_out.write_points(chunk)
-                    
-                    offset += chunk_size_actual
-                    progress = offset / n_total * 100
-                    print(f"   Zapisano: {progress:.1f}%", end='\r')
-        
-        print(f"   ✓ Zapisano: {time.time() - t_save:.1f}s")
-        
-        # === KROK 4: EKSPORT DO PLY ===
-        ply_path = output_path.parent / f"{output_path.stem}.ply"
-        self.export_to_ply(input_path, all_classifications, ply_path)
+            report('classify', 0, n_total)
+            try:
+                self._stream_classify(f_in, chunk_size, z_min, height_range, write_chunk, ground,
+                                      trace)
+                if spool is not None:
+                    print(f"\n   Zapis kafli w kolejności Mortona ({len(spool.tiles)} kafli)...")
+                    with trace.span('index'):
+                        index_entries = spool.write_sorted(f_out, phase_progress('index'))
+            finally:
+                if spool is not None:
+                    spool.discard()
+        
+        preview_path = None
+        if sampler is not None:
+            preview_path = output_path.parent / f"{output_path.stem}_preview.json"
+            palette = {class_id: info['color'] for class_id, info in self.classes.items()}
+            with trace.span('preview'):
+                sampler.write(output_path.parent / f"{output_path.stem}_preview.bin",
+                              preview_path, palette)
+        
+        index_path = None
+        if spatial_index:
+            index_path = output_path.parent / f"{output_path.stem}_index.json"
+            if write_index(index_path, output_path, index_tile_size,
+                           spool.x0, spool.y0, index_entries) is None:
+                index_path = None
+        
+        print(f"\n   Klasyfikacja + zapis: {time.time() - t0:.1f}s")
         
         # === PODSUMOWANIE ===
         total_time = time.time() - t0
@@ -258,93 +648,202 @@ class GeniusStreamingClassifier:
         print(f"Prędkość: {n_total/total_time/1e6:.2f}M punktów/s")
         print(f"\nStatystyki klasyfikacji:")
         
-        for class_id in sorted(stats.keys()):
-            count = stats[class_id]
+        for class_id in np.flatnonzero(class_counts):
+            count = int(class_counts[class_id])
             pct = count / n_total * 100
             name = self.classes.get(class_id, {}).get('name', 'Unknown')
             print(f"   [{class_id:2d}] {name:20s}: {count:12,} ({pct:5.1f}%)")
         
         print(f"\nPliki zapisane:")
-        print(f"   LAS: {output_path}")
-        print(f"   PLY: {ply_path}")
+        print(f"   {output_format.upper()}: {output_path}")
+        if export_ply:
+            print(f"   PLY: {ply_path}")
         print(f"{'='*70}\n")
-            
-    def export_to_ply(self, input_las_path, classifications, output_ply_path):
+        
+        report('done', processed, n_total, n_total / total_time if total_time > 0 else 0, 0)
+        
+        outputs = {
+            output_format: str(output_path),
+            'ply': str(ply_path) if export_ply else None,
+            'index': str(index_path) if index_path is not None else None,
+            'preview': str(preview_path) if preview_path is not None else None,
+        }
+        for kind, path in outputs.items():
+            trace.output(kind, path)
+        
+        return {
+            'total_points': int(processed),
+            'class_counts': {int(c): int(class_counts[c]) for c in np.flatnonzero(class_counts)},
+            'z_min': float(z_min),
+            'z_max': float(z_max),
+            'ground': ground_info,
+            'output_format': output_format,
+            'update_in_place': bool(update_in_place),
+            'timings': {
+                'stats': round(trace.seconds('stats'), 3),
+                'ground': round(trace.seconds('ground'), 3),
+                'features': round(trace.seconds('features'), 3),
+                'classify_write': round(total_time, 3),
+                'total': round(time.time() - t_start, 3),
+            },
+            'profile': trace.summary(),
+            'outputs': outputs,
+        }
+    
+    def _can_update_in_place(self, input_path, output_path, output_format, spatial_index):
+        """Czy wynik może być kopią wejścia z podmienioną klasyfikacją"""
+        if output_format != 'las' or spatial_index:
+            return False
+        if output_path.exists() and output_path.resolve() == input_path.resolve():
+            return False
+        try:
+            LasColumns(input_path).close()
+        except ValueError:
+            return False
+        return True
+    
+    def _open_output(self, output_path, header, output_format, input_path, laz_backend=None,
+                     update_in_place=False):
+        """
+        Writer wyniku: laspy (LAS/LAZ), LabelDeltaWriter (write(labels)) albo
+        kopia wejścia otwarta do zapisu klasyfikacji (write_classification).
+        """
+        if update_in_place:
+            method = copy_file(input_path, output_path)
+            print(f"   Kopia wejścia ({method}), zapis tylko bajtów klasyfikacji")
+            return LasColumns(output_path, mode='r+')
+        if output_format == 'labels':
+            return LabelDeltaWriter(output_path, input_key(input_path))
+        return laspy.open(output_path, mode='w', header=header,
+                          do_compress=output_format == 'laz', laz_backend=laz_backend)
+    
+    def _chunk_features(self, chunk):
+        """
+        Kolumny potrzebne klasyfikatorowi - widoki rekordów chunka, bez kopii
+        (surowe Z + scale/offset zamiast chunk.z, osobne kanały zamiast vstack).
+        """
+        return (
+            chunk.Z, chunk.scales[2], chunk.offsets[2],
+            chunk.intensity, chunk.red, chunk.green, chunk.blue,
+        )
+    
+    def _chunk_xy(self, chunk):
+        """Surowe X/Y + scale/offset - lookup komórki gridu terenu"""
+        return (
+            chunk.X, chunk.Y, chunk.scales[0], chunk.offsets[0],
+            chunk.scales[1], chunk.offsets[1],
+        )
+    
+    def _stream_classify(self, f_in, chunk_size, z_min, z_range, write_fn, ground=None,
+                         trace=None):
+        """
+        Reader → pula workerów → writer.
+        Chunki są klasyfikowane równolegle, ale write_fn dostaje je
+        ZAWSZE w kolejności z pliku (deterministyczny wynik).
+        trace dostaje decode i classify każdego chunka oraz czasy oczekiwania etapów.
+        """
+        trace = trace if trace is not None else Trace()
+        chunks = trace.decode(f_in.chunk_iterator(chunk_size))
+        
+        def xy(chunk):
+            return self._chunk_xy(chunk) if ground is not None else None
+        
+        def deliver(chunk, result):
+            labels, timing = result
+            trace.record_timing('classify', timing, len(labels))
+            write_fn(chunk, labels)
+        
+        if self.workers <= 1:
+            for chunk in chunks:
+                deliver(chunk, self._classify_chunk(
+                    *self._chunk_features(chunk), z_min, z_range, ground, xy(chunk)
+                ))
+            return
+        
+        if self.executor == 'process':
+            # spawn: fork z wielowątkowego procesu (Flask, wątki numby) potrafi się zakleszczyć
+            pool = ProcessPoolExecutor(max_workers=self.workers,
+                                       mp_context=multiprocessing.get_context('spawn'))
+        else:
+            pool = ThreadPoolExecutor(max_workers=self.workers)
+        
+        with pool:
+            writer = _OrderedWriter(deliver, max_inflight=self.workers + 2)
+            writer.start()
+            try:
+                for chunk in chunks:
+                    future = pool.submit(
+                        self._classify_chunk,
+                        *self._chunk_features(chunk), z_min, z_range, ground, xy(chunk)
+                    )
+                    if not writer.put(chunk, future):
+                        break
+            finally:
+                writer.close()
+                trace.wait('classify', writer.result_wait)
+                trace.wait('write', writer.put_wait)
+        
+        if writer.error is not None:
+            raise writer.error
+    
+    def _build_color_lut(self):
+        """Lookup table kolorów klas - mapowanie O(n) przez fancy indexing"""
+        max_class_id = max(self.classes.keys())
+        color_lut = np.zeros((max_class_id + 1, 3), dtype=np.uint8)
+        for class_id, info in self.classes.items():
+            color_lut[class_id] = info['color']
+        return color_lut
+    
+    def export_to_ply(self, input_las_path, classifications, output_ply_path, coords='float',
+                      trace=None):
         """
         ULTRA SZYBKI eksport do PLY z kolorami według klasyfikacji
-        Używa numpy i wektoryzacji - nie ma pętli!
+        Osobny przebieg - process_file_streaming pisze PLY w tym samym przebiegu.
+        
+        classifications=None → etykiety czytane strumieniowo z pola classification
+        pliku wejściowego (np. gotowego _classified.las), bez tablicy na całą chmurę.
+        Można też podać np.memmap - czytany jest tylko bieżący wycinek.
+        coords jak ply_coords w process_file_streaming, trace jak tam (spany
+        decode/write_ply na chunk, export_ply na całość).
         """
         print(f"\nKonwersja do PLY z kolorami...")
         t0 = time.time()
+        trace = trace if trace is not None else Trace()
         
         output_ply_path = Path(output_ply_path)
-        
-        # === PRZYGOTUJ LOOKUP TABLE DLA KOLORÓW (WAŻNE!) ===
-        # To przyspiesza konwersję z O(n*k) do O(n)
-        max_class_id = max(self.classes.keys())
-        color_lut = np.zeros((max_class_id + 1, 3), dtype=np.uint8)
-        for class_id, info in self.classes.items():
-            color_lut[class_id] = info['color']
+        color_lut = self._build_color_lut()
         
         # Wczytaj punkty w chunkach
         chunk_size = 10_000_000  # Większe chunki = szybciej
         
-        with laspy.open(input_las_path) as f:
+        with trace.span('export_ply'), open_reader(input_las_path) as f:
             n_total = f.header.point_count
             
+            encoder = _PlyEncoder(f.header, color_lut, coords)
             with open(output_ply_path, 'wb') as ply_file:
-                # Zapisz header PLY
-                header = f"""ply
-format binary_little_endian 1.0
-comment GENIUS Classifier - Classified Point Cloud
-element vertex {n_total}
-property float x
-property float y
-property float z
-property uchar red
-property uchar green
-property uchar blue
-property uchar classification
-end_header
-"""
-                ply_file.write(header.encode('ascii'))
+                ply_file.write(encoder.header(n_total))
                 
                 # Zapisz punkty chunk po chunku - WEKTORYZOWANE!
                 offset = 0
-                for chunk in f.chunk_iterator(chunk_size):
-                    chunk_size_actual = len(chunk.x)
+                for chunk in trace.decode(f.chunk_iterator(chunk_size)):
+                    chunk_size_actual = len(chunk)
                     
                     # Pobierz klasyfikacje dla tego chunka
-                    chunk_classifications = classifications[offset:offset+chunk_size_actual]
-                    
-                    # ULTRA SZYBKIE mapowanie kolorów przez lookup table!
-                    # Zamiast pętli przez klasy, używamy fancy indexing
-                    colors = color_lut[chunk_classifications]
-                    
-                    # === ULTRA SZYBKIE ZAPISYWANIE - NUMPY STRUCTURED ARRAY! ===
-                    # Przygotuj strukturalną tablicę z wszystkimi danymi
-                    dt = np.dtype([
-                        ('x', '<f4'), ('y', '<f4'), ('z', '<f4'),  # xyz jako float32
-                        ('r', 'u1'), ('g', 'u1'), ('b', 'u1'),      # rgb jako uint8
-                        ('class', 'u1')                             # klasyfikacja jako uint8
-                    ])
-                    
-                    # Utwórz tablicę i wypełnij ją
-                    data = np.empty(chunk_size_actual, dtype=dt)
-                    data['x'] = np.array(chunk.x, dtype=np.float32)
-                    data['y'] = np.array(chunk.y, dtype=np.float32)
-                    data['z'] = np.array(chunk.z, dtype=np.float32)
-                    data['r'] = colors[:, 0]
-                    data['g'] = colors[:, 1]
-                    data['b'] = colors[:, 2]
-                    data['class'] = chunk_classifications
+                    if classifications is None:
+                        chunk_classifications = np.asarray(chunk.classification, dtype=np.uint8)
+                    else:
+                        chunk_classifications = np.asarray(
+                            classifications[offset:offset+chunk_size_actual], dtype=np.uint8
+                        )
                     
-                    # Zapisz cały chunk naraz (MEGA SZYBKIE!)
-                    ply_file.write(data.tobytes())
+                    # Zapisz cały chunk naraz - jeden write bufora, bez kopii tobytes()
+                    with trace.span('write_ply', chunk=True, points=chunk_size_actual):
+                        ply_file.write(encoder.encode(chunk, chunk_classifications))
                     
                     offset += chunk_size_actual
                     progress = offset / n_total * 100
                     print(f"   Eksport PLY: {progress:.1f}%", end='\r')
         
+        trace.output('ply', output_ply_path)
         print(f"\n   PLY zapisany: {time.time() - t0:.1f}s")
         print(f"   Plik: {output_ply_path}")
@@ -0,0 +1,413 @@
+"""
+Backendy klasyfikacji - wykonują program reguł z rules.py (RuleSet.compile()).
+
+Numba (opcjonalne przyspieszenie): z programu generowany jest kod funkcji
+jednego punktu - progi jako stałe, warunki z tym samym początkiem (np.
+greenness > 0.08 trzech reguł roślinności) zagnieżdżone pod jednym if,
+pierwsza pasująca reguła kończy punkt. Jeden przebieg, ZERO tablic
+pośrednich. Kod trafia do pliku modułu (katalog RULES_MODULE_DIR), więc
+cache=True numby działa tak samo jak dla kodu pisanego ręcznie - kompilacja
+raz na zestaw reguł, nie raz na proces.
+
+Numpy: ClassificationWorkspace - te same reguły na prealokowanych buforach
+(ufunc z out=). Liczone są tylko cechy użyte w regułach, warunek wspólny
+dla kilku reguł - raz, a punkty już sklasyfikowane wypadają z dalszej
+pracy (kompakcja, gdy wolnych zostaje mniej niż połowa).
+
+Arytmetyka kolorów idzie w float32, wysokości w float64 - oba backendy
+dają etykiety identyczne bit w bit.
+
+Z lokalnym modelem terenu (ground_model.GroundGrid) z_min nie jest stałą:
+kernel sam wyznacza komórkę gridu z surowych X/Y i odejmuje teren pod punktem.
+"""
+
+import importlib.util
+import os
+import sys
+import tempfile
+import threading
+from pathlib import Path
+import numpy as np
+
+from rules import DEFAULT_RULES, FEATURES
+
+try:
+    import numba
+except ImportError:  # numba jest opcjonalna
+    numba = None
+
+NUMBA_AVAILABLE = numba is not None
+
+if NUMBA_AVAILABLE and 'NUMBA_THREADING_LAYER' not in os.environ:
+    # Kernele równoległe startują z wątków zadań serwera: TBB wiesza wtedy
+    # zamknięcie interpretera, workqueue nie znosi wywołań z wielu wątków
+    numba.config.THREADING_LAYER_PRIORITY = ['omp', 'tbb', 'workqueue']
+
+# Wygenerowane moduły kerneli (+ cache numby w ich __pycache__)
+RULES_MODULE_DIR = Path(__file__).resolve().parent / '__pycache__' / 'rules'
+
+_OPS = {'<': np.less, '<=': np.less_equal, '>': np.greater, '>=': np.greater_equal}
+
+# Cechy w kodzie generowanym dla numby (zmienne f_<nazwa>)
+_FEATURE_SOURCE = {
+    'height': 'z - base',
+    'z_rel': 'f_height / z_range_eps',
+    'intensity': 'np.float32(intensity) / SCALE',
+    'red': 'np.float32(red) / SCALE',
+    'green': 'np.float32(green) / SCALE',
+    'blue': 'np.float32(blue) / SCALE',
+    'greenness': 'f_green - (f_red + f_blue) / HALF',
+    'brightness': '(f_red + f_green + f_blue) / np.float32(3.0)',
+    'redness': 'f_red - (f_green + f_blue) / HALF',
+    'blueness': 'f_blue - (f_red + f_green) / HALF',
+}
+
+_NUMBA_TEMPLATE = '''\
+"""Kernele klasyfikacji wygenerowane z reguł {fingerprint} (classifier_kernels.py)"""
+import math
+import numba
+import numpy as np
+
+SCALE = np.float32(65535.0)
+HALF = np.float32(2.0)
+
+
+@numba.njit(inline='always', cache=True)
+def classify_point(z, intensity, red, green, blue, base, z_range_eps):
+{body}
+
+
+# Komórka gridu jak GroundGrid.flat_index: floor, potem przycięcie do zasięgu
+@numba.njit(inline='always', cache=True)
+def ground_at(x_raw, y_raw, x_scale, x_offset, y_scale, y_offset, ground, x0, y0, cell):
+    ny, nx = ground.shape
+    fx = math.floor((x_raw * x_scale + x_offset - x0) / cell)
+    fy = math.floor((y_raw * y_scale + y_offset - y0) / cell)
+    fx = min(max(fx, 0.0), nx - 1.0)
+    fy = min(max(fy, 0.0), ny - 1.0)
+    return ground[int(fy), int(fx)]
+
+
+# z_raw * z_scale + z_offset - dokładnie jak skalowanie w laspy (bez tablicy chunk.z)
+@numba.njit(parallel=True, cache=True)
+def kernel_parallel(z_raw, z_scale, z_offset, intensity, red, green, blue,
+                    z_min, z_range_eps, labels):
+    for i in numba.prange(z_raw.shape[0]):
+        labels[i] = classify_point(z_raw[i] * z_scale + z_offset, intensity[i], red[i], green[i],
+                                   blue[i], z_min, z_range_eps)
+
+
+@numba.njit(cache=True)
+def kernel_serial(z_raw, z_scale, z_offset, intensity, red, green, blue,
+                  z_min, z_range_eps, labels):
+    for i in range(z_raw.shape[0]):
+        labels[i] = classify_point(z_raw[i] * z_scale + z_offset, intensity[i], red[i], green[i],
+                                   blue[i], z_min, z_range_eps)
+
+
+@numba.njit(parallel=True, cache=True)
+def ground_kernel_parallel(z_raw, z_scale, z_offset, intensity, red, green, blue,
+                           x_raw, y_raw, x_scale, x_offset, y_scale, y_offset,
+                           ground, x0, y0, cell, z_range_eps, labels):
+    for i in numba.prange(z_raw.shape[0]):
+        labels[i] = classify_point(
+            z_raw[i] * z_scale + z_offset, intensity[i], red[i], green[i], blue[i],
+            ground_at(x_raw[i], y_raw[i], x_scale, x_offset, y_scale, y_offset,
+                      ground, x0, y0, cell),
+            z_range_eps
+        )
+
+
+@numba.njit(cache=True)
+def ground_kernel_serial(z_raw, z_scale, z_offset, intensity, red, green, blue,
+                         x_raw, y_raw, x_scale, x_offset, y_scale, y_offset,
+                         ground, x0, y0, cell, z_range_eps, labels):
+    for i in range(z_raw.shape[0]):
+        labels[i] = classify_point(
+            z_raw[i] * z_scale + z_offset, intensity[i], red[i], green[i], blue[i],
+            ground_at(x_raw[i], y_raw[i], x_scale, x_offset, y_scale, y_offset,
+                      ground, x0, y0, cell),
+            z_range_eps
+        )
+'''
+
+
+def _atom_source(atom):
+    feature, op, threshold = atom
+    if FEATURES[feature][0] == 'float32':
+        return f"f_{feature} {op} np.float32({threshold!r})"
+    return f"f_{feature} {op} {threshold!r}"
+
+
+def _rules_source(program, rules, depth):
+    """
+    Łańcuch if/return w kolejności priorytetu. Kolejne reguły zaczynające się
+    tym samym warunkiem idą pod jeden if (warunek liczony raz).
+    """
+    indent = '    ' * depth
+    lines = []
+    i = 0
+    while i < len(rules):
+        label, when, any_ = rules[i]
+        j = i + 1
+        while when and j < len(rules) and rules[j][1][:1] == when[:1]:
+            j += 1
+        if j - i > 1:
+            lines.append(f"{indent}if {_atom_source(program.atoms[when[0]])}:")
+            lines += _rules_source(program, [(l, w[1:], a) for l, w, a in rules[i:j]], depth + 1)
+            i = j
+            continue
+        conditions = [_atom_source(program.atoms[a]) for a in when]
+        if any_:
+            conditions.append('(' + ' or '.join(_atom_source(program.atoms[a]) for a in any_) + ')')
+        if not conditions:
+            lines.append(f"{indent}return {label}")
+            break  # dalsze reguły tej grupy są nieosiągalne
+        lines.append(f"{indent}if {' and '.join(conditions)}:")
+        lines.append(f"{indent}    return {label}")
+        i += 1
+    return lines
+
+
+def numba_source(program):
+    """Kod modułu kerneli dla programu reguł (do podglądu / debugowania)"""
+    body = [f"    f_{name} = {_FEATURE_SOURCE[name]}" for name in program.features]
+    body += _rules_source(program, program.rules, 1)
+    body.append(f"    return {program.default}")
+    return _NUMBA_TEMPLATE.format(fingerprint=program.fingerprint, body='\n'.join(body))
+
+
+_modules = {}
+_modules_lock = threading.Lock()
+
+
+def _module_dir():
+    for folder in (RULES_MODULE_DIR, Path(tempfile.gettempdir()) / 'cpk_rules'):
+        try:
+            folder.mkdir(parents=True, exist_ok=True)
+        except OSError:
+            continue
+        if os.access(folder, os.W_OK):
+            return folder
+    raise RuntimeError("No writable directory for generated classification kernels")
+
+
+def _numba_module(program):
+    """Moduł kerneli dla programu - generowany raz (plik zostaje między procesami)"""
+    with _modules_lock:
+        module = _modules.get(program.fingerprint)
+        if module is not None:
+            return module
+        name = f"cpk_rules_{program.fingerprint[:16]}"
+        path = _module_dir() / f"{name}.py"
+        source = numba_source(program)
+        # Nadpisanie zmienia mtime i unieważnia cache numby - piszemy tylko gdy trzeba
+        if not path.exists() or path.read_text() != source:
+            tmp_path = path.with_name(f".{name}.{os.getpid()}.tmp")
+            tmp_path.write_text(source)
+            os.replace(tmp_path, path)
+        spec = importlib.util.spec_from_file_location(name, path)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+        _modules[program.fingerprint] = module
+        return module
+
+
+def classify_points_numba(z, intensity, red, green, blue, z_min, z_range,
+                          z_scale=1.0, z_offset=0.0, parallel=True, ground=None, xy=None,
+                          program=None):
+    """
+    Klasyfikacja chunka kernelem Numba.
+
+    z to surowe Z z rekordu LAS (int32) razem z z_scale/z_offset albo już
+    przeskalowane współrzędne (domyślne scale=1, offset=0).
+
+    parallel=True rozdziela punkty na wątki numby (prange). Gdy chunki już są
+    klasyfikowane w puli workerów, używamy wersji szeregowej - bez
+    zagnieżdżonej równoległości i konfliktów warstwy wątków numby.
+
+    ground (GroundGrid) + xy = (X, Y, x_scale, x_offset, y_scale, y_offset)
+    → wysokość nad terenem zamiast z - z_min; z_range to wtedy zakres
+    wysokości nad terenem (z_min jest ignorowane).
+
+    program - skompilowane reguły (RuleSet.compile()), domyślnie wbudowane.
+    """
+    if not NUMBA_AVAILABLE:
+        raise RuntimeError("numba is not installed")
+
+    module = _numba_module(program or DEFAULT_RULES.compile())
+    labels = np.empty(len(z), dtype=np.uint8)
+    if ground is not None:
+        x_raw, y_raw, x_scale, x_offset, y_scale, y_offset = xy
+        kernel = module.ground_kernel_parallel if parallel else module.ground_kernel_serial
+        kernel(
+            np.asarray(z), np.float64(z_scale), np.float64(z_offset), intensity, red, green, blue,
+            np.asarray(x_raw), np.asarray(y_raw), np.float64(x_scale), np.float64(x_offset),
+            np.float64(y_scale), np.float64(y_offset),
+            np.asarray(ground.ground), np.float64(ground.x0), np.float64(ground.y0),
+            np.float64(ground.cell_size), np.float64(z_range + 1e-6), labels
+        )
+        return labels
+
+    kernel = module.kernel_parallel if parallel else module.kernel_serial
+    kernel(
+        np.asarray(z), np.float64(z_scale), np.float64(z_offset), intensity, red, green, blue,
+        np.float64(z_min), np.float64(z_range + 1e-6), labels
+    )
+    return labels
+
+
+class ClassificationWorkspace:
+    """
+    Prealokowane bufory do klasyfikacji numpy - jeden na workera.
+
+    Cechy liczone są ufuncami z out= w buforach o rozmiarze chunka (tylko te,
+    których używa program). Każda reguła startuje od maski punktów jeszcze
+    wolnych, warunki wspólne dla kilku reguł są buforowane, a gdy wolnych
+    zostaje mniej niż połowa, cechy potrzebne dalszym regułom są kompaktowane.
+    Jedyna nowa tablica na chunk to wynikowe etykiety (1 bajt / punkt).
+    """
+
+    def __init__(self, capacity):
+        self.capacity = 0
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        self.capacity = capacity
+        # Bufory cech / warunków / indeksów tworzone przy pierwszym użyciu
+        self._buffers = {}
+        self.free = np.empty(capacity, dtype=bool)
+        self.mask = np.empty(capacity, dtype=bool)
+        self.tmp = np.empty(capacity, dtype=bool)
+        self.either = np.empty(capacity, dtype=bool)
+        self.arange = np.arange(capacity, dtype=np.int64)
+
+    def _buffer(self, name, dtype, slot=0):
+        buffer = self._buffers.get((name, slot))
+        if buffer is None:
+            buffer = self._buffers[(name, slot)] = np.empty(self.capacity, dtype=dtype)
+        return buffer
+
+    def ensure(self, n):
+        if n > self.capacity:
+            self._allocate(n)
+
+    def _features(self, program, s, z, intensity, red, green, blue, z_min, z_range,
+                  z_scale, z_offset, ground, xy):
+        """Cechy programu (w miejscu); kolejność z FEATURES - zależności pierwsze"""
+        raw = {'intensity': intensity, 'red': red, 'green': green, 'blue': blue}
+        f = {}
+        for name in program.features:
+            out = self._buffer(name, FEATURES[name][0])[s]
+            if name == 'height':
+                np.multiply(z, z_scale, out=out)
+                np.add(out, z_offset, out=out)
+                if ground is None:
+                    np.subtract(out, z_min, out=out)
+                else:
+                    np.subtract(out, ground.heights(*xy, out=self._buffer('ground_z', np.float64)[s]),
+                                out=out)
+            elif name == 'z_rel':
+                if 'height' not in program.needed_from[0]:
+                    out = f['height']  # sama wysokość nie jest potrzebna - dzielimy w miejscu
+                np.divide(f['height'], z_range + 1e-6, out=out)
+            elif name in raw:
+                np.copyto(out, raw[name], casting='unsafe')
+                np.divide(out, np.float32(65535.0), out=out)
+            elif name == 'brightness':
+                np.add(f['red'], f['green'], out=out)
+                np.add(out, f['blue'], out=out)
+                np.divide(out, np.float32(3.0), out=out)
+            else:
+                # greenness / redness / blueness: kolor - średnia dwóch pozostałych
+                main = {'greenness': 'green', 'redness': 'red', 'blueness': 'blue'}[name]
+                first, second = (c for c in ('red', 'green', 'blue') if c != main)
+                np.add(f[first], f[second], out=out)
+                np.divide(out, np.float32(2.0), out=out)
+                np.subtract(f[main], out, out=out)
+            f[name] = out
+        return f
+
+    def classify(self, z, intensity, red, green, blue, z_min, z_range,
+                 z_scale=1.0, z_offset=0.0, ground=None, xy=None, program=None):
+        """
+        Etykiety chunka - identyczne z classify_points_numba dla tego samego programu.
+        ground/xy jak w classify_points_numba (wysokość nad terenem).
+        """
+        program = program or DEFAULT_RULES.compile()
+        n = len(z)
+        self.ensure(n)
+        s = slice(0, n)
+        f = self._features(program, s, z, intensity, red, green, blue, z_min, z_range,
+                           z_scale, z_offset, ground, xy)
+
+        labels = np.full(n, program.default, dtype=np.uint8)
+        free = self.free[s]
+        free.fill(True)
+        index, slot, atoms = None, 0, {}
+
+        # === PRIORYTETOWE REGUŁY (pierwsza pasująca wygrywa) ===
+        for position, (label, when, any_) in enumerate(program.rules):
+            k = len(free)
+            mask = self.mask[:k]
+            np.copyto(mask, free)
+            for atom in when:
+                np.logical_and(mask, self._atom(program, atom, f, atoms, k), out=mask)
+            if any_:
+                either = self.either[:k]
+                np.copyto(either, self._atom(program, any_[0], f, atoms, k))
+                for atom in any_[1:]:
+                    np.logical_or(either, self._atom(program, atom, f, atoms, k), out=either)
+                np.logical_and(mask, either, out=mask)
+            if index is None:
+                np.putmask(labels, mask, label)
+            else:
+                labels[index[mask]] = label
+            np.logical_xor(free, mask, out=free)  # mask ⊆ free → free & ~mask
+
+            if position == len(program.rules) - 1:
+                break
+            n_free = int(np.count_nonzero(free))
+            if n_free == 0:
+                break
+            if n_free < k // 2:
+                # Kompakcja: dalsze reguły liczone tylko na wolnych punktach
+                slot ^= 1
+                c = slice(0, n_free)
+                compact = {}
+                for name in program.needed_from[position + 1]:
+                    compact[name] = self._buffer(name, FEATURES[name][0], slot)[c]
+                    np.compress(free, f[name], out=compact[name])
+                new_index = self._buffer('index', np.int64, slot)[c]
+                np.compress(free, self.arange[s] if index is None else index, out=new_index)
+                f, index = compact, new_index
+                atoms.clear()
+                free = self.free[c]
+                free.fill(True)
+        return labels
+
+    def _atom(self, program, atom_id, f, cache, k):
+        """Maska warunku; warunki wspólne kilku reguł liczone raz na zbiór punktów"""
+        result = cache.get(atom_id)
+        if result is not None:
+            return result
+        feature, op, threshold = program.atoms[atom_id]
+        if atom_id in program.shared:
+            result = cache[atom_id] = self._buffer(f"atom{atom_id}", bool)[:k]
+        else:
+            result = self.tmp[:k]
+        _OPS[op](f[feature], np.dtype(FEATURES[feature][0]).type(threshold), out=result)
+        return result
+
+
+_local = threading.local()
+
+
+def get_workspace(n):
+    """Workspace bieżącego wątku/procesu workera (rośnie do największego chunka)"""
+    workspace = getattr(_local, 'workspace', None)
+    if workspace is None:
+        workspace = _local.workspace = ClassificationWorkspace(n)
+    workspace.ensure(n)
+    return workspace
@@ -0,0 +1,212 @@
+"""
+Lokalny model terenu (DTM) - grid 2D z minimalnym Z w każdej komórce.
+
+Zamiast jednego globalnego z_min klasyfikator liczy wysokość NAD TERENEM:
+z - ground[komórka(x, y)]. Na pochyłych kaflach (nasypy, zbocza wzdłuż
+trasy CPK) globalne z_min wrzucało całe zbocza do "wysokich" klas.
+
+Grid budowany jest jednym strumieniowym przebiegiem (chunk po chunku),
+więc pamięć zależy od rozmiaru gridu, a nie od liczby punktów. Duże gridy
+trafiają do np.memmap na dysku i są przetwarzane pasami wierszy.
+"""
+
+import math
+import os
+import numpy as np
+
+# Domyślna rozdzielczość gridu i szerokość okna erozji (metry)
+DEFAULT_CELL_SIZE = 2.0
+DEFAULT_WINDOW = 10.0
+
+# Powyżej tylu komórek grid idzie do memmap (8 B / komórkę)
+MEMMAP_CELLS = 16_000_000
+# Twardy limit - przy większym zasięgu komórka jest powiększana
+MAX_CELLS = 256_000_000
+
+# Wiersze gridu przetwarzane naraz (filtr na memmap czyta pasami)
+_BAND_ROWS = 1024
+
+
+class GroundGrid:
+    """
+    Raster wysokości terenu: ground[iy, ix] dla komórek cell_size × cell_size
+    liczonych od (x0, y0). Komórki bez punktów mają +inf.
+
+    height_range - największa wysokość punktu nad terenem (normalizacja z_rel).
+    Grid z memmap przechodzi do procesów workerów jako ścieżka, nie kopia.
+    """
+
+    def __init__(self, ground, x0, y0, cell_size, height_range, path=None):
+        self.ground = ground
+        self.x0 = float(x0)
+        self.y0 = float(y0)
+        self.cell_size = float(cell_size)
+        self.height_range = float(height_range)
+        self.path = path
+
+    @property
+    def shape(self):
+        return self.ground.shape
+
+    def flat_index(self, x_raw, y_raw, x_scale, x_offset, y_scale, y_offset):
+        """Indeks komórki (płaski) dla surowych X/Y z rekordu LAS"""
+        ny, nx = self.ground.shape
+        ix = np.multiply(x_raw, x_scale)
+        ix += x_offset
+        ix -= self.x0
+        ix /= self.cell_size
+        np.floor(ix, out=ix)
+        np.clip(ix, 0, nx - 1, out=ix)
+
+        iy = np.multiply(y_raw, y_scale)
+        iy += y_offset
+        iy -= self.y0
+        iy /= self.cell_size
+        np.floor(iy, out=iy)
+        np.clip(iy, 0, ny - 1, out=iy)
+
+        flat = iy.astype(np.int64)
+        flat *= nx
+        flat += ix.astype(np.int64)
+        return flat
+
+    def heights(self, x_raw, y_raw, x_scale, x_offset, y_scale, y_offset, out=None):
+        """Wysokość terenu pod każdym punktem (wektoryzowany lookup komórki)"""
+        flat = self.flat_index(x_raw, y_raw, x_scale, x_offset, y_scale, y_offset)
+        return np.take(self.ground.reshape(-1), flat, out=out)
+
+    def release(self):
+        """Zwolnij grid i usuń plik memmap"""
+        self.ground = None
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self.path is not None:
+            state['ground'] = None  # worker otwiera memmap sam
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.ground is None and self.path is not None:
+            self.ground = np.load(self.path, mmap_mode='r')
+
+
+def build_ground_grid(reader, chunk_size, cell_size=DEFAULT_CELL_SIZE, window=DEFAULT_WINDOW,
+                      memmap_path=None, memmap_cells=MEMMAP_CELLS, chunk_callback=None):
+    """
+    Strumieniowy przebieg po pliku: min/max Z w komórkach, potem erozja
+    (min w oknie `window` m) - dachy i korony drzew bez punktów gruntu
+    w swojej komórce dostają teren z sąsiedztwa.
+
+    memmap_path - gdzie zapisać grid, gdy ma więcej niż memmap_cells komórek
+    (None = zawsze w RAM). chunk_callback(points_done) wołany po każdym chunku.
+    Zwraca GroundGrid albo None, gdy nagłówek nie ma poprawnego zasięgu XY.
+    """
+    header = reader.header
+    x0, y0 = float(header.mins[0]), float(header.mins[1])
+    width, height = float(header.maxs[0]) - x0, float(header.maxs[1]) - y0
+    if not (np.isfinite([x0, y0, width, height]).all() and width >= 0 and height >= 0):
+        return None
+
+    while True:
+        nx = int(width // cell_size) + 1
+        ny = int(height // cell_size) + 1
+        if nx * ny <= MAX_CELLS:
+            break
+        cell_size *= 2
+
+    use_memmap = memmap_path is not None and nx * ny > memmap_cells
+    temp_paths = []
+
+    def alloc(suffix, fill):
+        if not use_memmap:
+            return np.full((ny, nx), fill, dtype=np.float64)
+        path = f"{os.path.splitext(str(memmap_path))[0]}{suffix}.npy"
+        array = np.lib.format.open_memmap(path, mode='w+', dtype=np.float64, shape=(ny, nx))
+        for r0 in range(0, ny, _BAND_ROWS):
+            array[r0:r0 + _BAND_ROWS] = fill
+        if suffix:
+            temp_paths.append(path)
+        return array
+
+    grid = GroundGrid(None, x0, y0, cell_size, 0.0)
+    z_low = alloc('_zmin', np.inf)
+    z_high = alloc('_zmax', -np.inf)
+    grid.ground = z_low  # flat_index potrzebuje tylko kształtu
+
+    try:
+        done = 0
+        for chunk in reader.chunk_iterator(chunk_size):
+            flat = grid.flat_index(chunk.X, chunk.Y, chunk.scales[0], chunk.offsets[0],
+                                   chunk.scales[1], chunk.offsets[1])
+            z = np.asarray(chunk.z, dtype=np.float64)
+            np.minimum.at(z_low.reshape(-1), flat, z)
+            np.maximum.at(z_high.reshape(-1), flat, z)
+            done += len(z)
+            if chunk_callback is not None:
+                chunk_callback(done)
+
+        ground = alloc('', np.inf)
+        radius = max(0, int(round(window / cell_size / 2)))
+        height_range = _erode(z_low, z_high, ground, radius)
+    finally:
+        del z_low, z_high
+        grid.ground = None
+        for path in temp_paths:
+            os.remove(path)
+
+    if use_memmap:
+        ground.flush()
+        grid.path = str(memmap_path)
+    grid.ground = ground
+    grid.height_range = height_range
+    return grid
+
+
+def _erode(z_low, z_high, ground, radius):
+    """
+    Separowalny filtr minimum (okno 2*radius+1 komórek) z z_low do ground,
+    pasami wierszy. Zwraca max(z_high - ground) - zakres wysokości nad terenem.
+    """
+    ny = z_low.shape[0]
+
+    # Oś X - wiersze niezależne, wynik z powrotem do z_low
+    for r0 in range(0, ny, _BAND_ROWS):
+        rows = np.array(z_low[r0:r0 + _BAND_ROWS])
+        out = rows.copy()
+        for d in range(1, radius + 1):
+            np.minimum(out[:, :-d], rows[:, d:], out=out[:, :-d])
+            np.minimum(out[:, d:], rows[:, :-d], out=out[:, d:])
+        z_low[r0:r0 + _BAND_ROWS] = out
+
+    # Oś Y - pas + radius wierszy zakładki z każdej strony
+    height_range = 0.0
+    for r0 in range(0, ny, _BAND_ROWS):
+        r1 = min(ny, r0 + _BAND_ROWS)
+        lo, hi = max(0, r0 - radius), min(ny, r1 + radius)
+        src = np.asarray(z_low[lo:hi])
+        off, n = r0 - lo, r1 - r0
+        out = src[off:off + n].copy()
+        for d in range(1, radius + 1):
+            a = max(0, d - off)
+            if a < n:
+                np.minimum(out[a:], src[a + off - d:n + off - d], out=out[a:])
+            b = min(n, len(src) - off - d)
+            if b > 0:
+                np.minimum(out[:b], src[off + d:off + d + b], out=out[:b])
+        ground[r0:r1] = out
+
+        above = np.asarray(z_high[r0:r1]) - out
+        above = above[np.isfinite(above)]
+        if above.size:
+            height_range = max(height_range, float(above.max()))
+
+    return height_range if math.isfinite(height_range) else 0.0
@@ -0,0 +1,493 @@
+"""
+Classification job scheduler.
+
+Jobs wait in a priority queue (FIFO within the same priority) and run on a
+bounded number of worker threads. A job is only admitted when its estimated
+memory fits in the budget next to the jobs already running. Every state change
+is persisted as JSON in the jobs folder, so queued and interrupted jobs are
+picked up again after a server restart.
+
+The jobs folder is also the only channel between processes: JobScheduler runs
+in exactly one process (runner lock) and polls the folder for job records
+written by JobQueueClient in request-serving processes, for cancel markers,
+and persists live progress so those processes can report it.
+"""
+
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+import traceback
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows - no runner lock, run a single job process
+    fcntl = None
+
+QUEUED = 'queued'
+RUNNING = 'running'
+COMPLETED = 'completed'
+ERROR = 'error'
+CANCELLED = 'cancelled'
+
+ACTIVE_STATES = (QUEUED, RUNNING)
+
+# Rough peak bytes per in-flight point: raw record + workspace buffers + labels + PLY row
+BYTES_PER_POINT = 160
+
+# A running job without a progress update for this long is reported as stalled
+STALL_SECONDS = 120
+
+# How often the runner looks for jobs/cancel markers from other processes, and the
+# least time between two progress writes of one job
+POLL_SECONDS = 1.0
+PROGRESS_PERSIST_SECONDS = 1.0
+
+RUNNER_LOCK = '.runner.lock'
+CANCEL_SUFFIX = '.cancel'
+
+
+def estimate_job_memory(point_count, chunk_size, inflight_chunks):
+    """Peak memory of one streaming job - bounded by chunk size, not file size"""
+    return min(point_count, chunk_size) * inflight_chunks * BYTES_PER_POINT
+
+
+def _read_point_count(input_path):
+    import laspy
+    with laspy.open(input_path) as f:
+        return f.header.point_count
+
+
+def _read_job(path):
+    with open(path) as f:
+        return Job.from_dict(json.load(f))
+
+
+def _write_job(path, job):
+    tmp_path = path.with_suffix('.json.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(job.to_dict(), f)
+    os.replace(tmp_path, path)
+
+
+def _describe(job, queue_order):
+    """Public view of a job; queue_order = ids of queued jobs, next to run first"""
+    info = job.to_dict()
+    if job.state == RUNNING and job.progress_updated is not None:
+        info['stalled'] = time.time() - job.progress_updated > STALL_SECONDS
+    if job.state == QUEUED:
+        info['queue_position'] = queue_order.index(job.job_id)
+    return info
+
+
+class Job:
+    """One classification job; persisted as <jobs_folder>/<job_id>.json"""
+
+    def __init__(self, job_id, input_path, output_path, priority=0, point_count=0,
+                 memory_estimate=0, state=QUEUED, submitted=None, started=None,
+                 finished=None, error=None, cache_key=None, progress=None,
+                 progress_updated=None, options=None):
+        self.job_id = job_id
+        self.input_path = str(input_path)
+        self.output_path = str(output_path)
+        self.priority = priority
+        self.point_count = point_count
+        self.memory_estimate = memory_estimate
+        self.state = state
+        self.submitted = submitted or time.time()
+        self.started = started
+        self.finished = finished
+        self.error = error
+        # Result cache key of the job's input + options (None = results are not cached)
+        self.cache_key = cache_key
+        # Classifier options chosen per upload (e.g. spatial_index)
+        self.options = options or {}
+        self.cancel_event = threading.Event()
+        # Live progress (persisted at most every PROGRESS_PERSIST_SECONDS) and a
+        # counter bumped on every update
+        self.progress = progress
+        self.progress_updated = progress_updated
+        self.progress_persisted = 0.0
+        self.version = 0
+
+    def to_dict(self):
+        return {
+            'job_id': self.job_id,
+            'input_path': self.input_path,
+            'output_path': self.output_path,
+            'priority': self.priority,
+            'point_count': self.point_count,
+            'memory_estimate': self.memory_estimate,
+            'state': self.state,
+            'submitted': self.submitted,
+            'started': self.started,
+            'finished': self.finished,
+            'error': self.error,
+            'cache_key': self.cache_key,
+            'progress': self.progress,
+            'progress_updated': self.progress_updated,
+            'options': self.options,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+
+class JobScheduler:
+    """
+    Bounded worker pool with a priority queue and memory-aware admission.
+
+    run_fn(job) does the actual work in a worker thread. It should poll
+    job.cancel_event and stop by raising; a job whose event is set ends up
+    'cancelled', any other exception marks it 'error'.
+
+    Only one process may run the jobs of a folder: claim() takes the runner
+    lock before recover()/start(). Jobs submitted and cancelled through
+    JobQueueClient are picked up every poll_interval seconds.
+    """
+
+    def __init__(self, jobs_folder, run_fn, max_workers=2, memory_budget=None,
+                 chunk_size=5_000_000, inflight_chunks=4, poll_interval=POLL_SECONDS):
+        self.jobs_folder = Path(jobs_folder)
+        self.jobs_folder.mkdir(exist_ok=True, parents=True)
+        self.run_fn = run_fn
+        self.max_workers = max_workers
+        self.memory_budget = memory_budget
+        self.chunk_size = chunk_size
+        self.inflight_chunks = inflight_chunks
+        self.poll_interval = poll_interval
+
+        self._jobs = {}
+        self._queue = []
+        self._seq = itertools.count()
+        self._running = set()
+        self._memory_in_use = 0
+        self._cond = threading.Condition()
+        self._dispatcher = None
+        self._lock_file = None
+        # mtime of every job record as last written or read here - changed ones come from clients
+        self._seen = {}
+
+    # === Public API ===
+
+    def claim(self):
+        """Take the runner lock of the jobs folder; False when another process holds it"""
+        if self._lock_file is not None or fcntl is None:
+            return True
+        lock_file = open(self.jobs_folder / RUNNER_LOCK, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file  # held for the life of the process
+        return True
+
+    def start(self):
+        """Start dispatching queued jobs (call recover() first to resume old ones)"""
+        self._dispatcher = threading.Thread(target=self._dispatch_loop,
+                                            name='JobDispatcher', daemon=True)
+        self._dispatcher.start()
+
+    def join(self):
+        """Block until the dispatcher stops (never, short of process exit)"""
+        self._dispatcher.join()
+
+    def recover(self):
+        """
+        Re-queue jobs that were queued or running when the server stopped.
+        Records of finished jobs are dropped - their outputs live on in the
+        result cache (or are removed by the startup cleanup).
+        """
+        with self._cond:
+            for path in sorted(self.jobs_folder.glob('*.json')):
+                try:
+                    job = _read_job(path)
+                except (OSError, ValueError, TypeError) as e:
+                    print(f"Skipping unreadable job file {path.name}: {e}")
+                    continue
+
+                if job.state in ACTIVE_STATES and Path(job.input_path).exists():
+                    print(f"Recovered job {job.job_id} ({job.state}) - re-queued")
+                    job.started = None
+                    self._enqueue(job)
+                else:
+                    path.unlink()
+
+    def submit(self, job_id, input_path, output_path, priority=0, cache_key=None, options=None):
+        point_count = _read_point_count(input_path)
+        job = Job(job_id, input_path, output_path, priority=priority,
+                  point_count=point_count, cache_key=cache_key, options=options,
+                  memory_estimate=estimate_job_memory(point_count, self.chunk_size,
+                                                      self.inflight_chunks))
+        with self._cond:
+            existing = self._jobs.get(job_id)
+            if existing is not None and existing.state in ACTIVE_STATES:
+                raise ValueError(f"Job {job_id} is already {existing.state}")
+            self._enqueue(job)
+            self._cond.notify_all()
+        return job
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job; returns the job or None"""
+        with self._cond:
+            return self._cancel(job_id)
+
+    def update_progress(self, job_id, progress):
+        """Record live progress reported by a running job and wake waiters"""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job.progress = progress
+            job.progress_updated = time.time()
+            job.version += 1
+            self._cond.notify_all()
+            # Other processes only see progress through the job record
+            if job.progress_updated - job.progress_persisted >= PROGRESS_PERSIST_SECONDS:
+                job.progress_persisted = job.progress_updated
+                self._write(job)
+
+    def wait_for_update(self, job_id, version, timeout):
+        """
+        Block until the job changes (progress or state) past `version`.
+        Returns (version, description); description is None for unknown jobs.
+        """
+        with self._cond:
+            self._cond.wait_for(
+                lambda: job_id not in self._jobs or self._jobs[job_id].version != version,
+                timeout
+            )
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None, None
+            return job.version, self._describe(job)
+
+    def get(self, job_id):
+        with self._cond:
+            job = self._jobs.get(job_id)
+            return self._describe(job) if job is not None else None
+
+    def list(self):
+        with self._cond:
+            return [self._describe(job) for job in self._jobs.values()]
+
+    def pending_inputs(self):
+        """Input files still needed by queued/running jobs"""
+        with self._cond:
+            return {Path(job.input_path) for job in self._jobs.values()
+                    if job.state in ACTIVE_STATES}
+
+    # === Internals ===
+
+    def _describe(self, job):
+        queue_order = []
+        if job.state == QUEUED:
+            queue_order = [entry[2] for entry in sorted(self._queue)
+                           if self._jobs[entry[2]].state == QUEUED]
+        return _describe(job, queue_order)
+
+    def _cancel(self, job_id):
+        job = self._jobs.get(job_id)
+        if job is None or job.state not in ACTIVE_STATES:
+            return job
+        job.cancel_event.set()
+        if job.state == QUEUED:
+            # Lazily dropped from the heap by the dispatcher
+            self._finish(job, CANCELLED)
+        self._cond.notify_all()
+        return job
+
+    def _poll(self):
+        """Pick up jobs queued and cancel markers dropped by JobQueueClient processes"""
+        submitted = []
+        for path in self.jobs_folder.glob('*.json'):
+            try:
+                mtime = path.stat().st_mtime_ns
+                if self._seen.get(path.name) == mtime:
+                    continue
+                self._seen[path.name] = mtime
+                job = _read_job(path)
+            except (OSError, ValueError, TypeError):
+                continue  # replaced or removed meanwhile - next poll
+            known = self._jobs.get(job.job_id)
+            if job.state == QUEUED and (known is None or known.state not in ACTIVE_STATES):
+                submitted.append(job)
+        for job in sorted(submitted, key=lambda job: job.submitted):
+            self._enqueue(job)
+        for path in self.jobs_folder.glob(f'*{CANCEL_SUFFIX}'):
+            path.unlink(missing_ok=True)
+            self._cancel(path.name[:-len(CANCEL_SUFFIX)])
+
+    def _enqueue(self, job):
+        job.state = QUEUED
+        self._jobs[job.job_id] = job
+        heapq.heappush(self._queue, (-job.priority, next(self._seq), job.job_id))
+        self._persist(job)
+
+    def _persist(self, job):
+        # Every persisted transition is also an update for wait_for_update()
+        job.version += 1
+        self._cond.notify_all()
+        self._write(job)
+
+    def _write(self, job):
+        path = self.jobs_folder / f"{job.job_id}.json"
+        _write_job(path, job)
+        self._seen[path.name] = path.stat().st_mtime_ns
+
+    def _admissible(self, job):
+        if len(self._running) >= self.max_workers:
+            return False
+        if self.memory_budget is None or not self._running:
+            return True  # an idle server always admits one job, however large
+        return self._memory_in_use + job.memory_estimate <= self.memory_budget
+
+    def _dispatch_loop(self):
+        last_poll = 0.0
+        while True:
+            with self._cond:
+                job = None
+                while job is None:
+                    # Progress updates wake this loop often - poll on time, not on timeouts
+                    if time.time() - last_poll >= self.poll_interval:
+                        self._poll()
+                        last_poll = time.time()
+                    # Drop cancelled entries from the head of the queue
+                    while self._queue and self._jobs[self._queue[0][2]].state != QUEUED:
+                        heapq.heappop(self._queue)
+                    if self._queue and self._admissible(self._jobs[self._queue[0][2]]):
+                        job = self._jobs[heapq.heappop(self._queue)[2]]
+                    else:
+                        self._cond.wait(self.poll_interval)
+
+                job.state = RUNNING
+                job.started = time.time()
+                self._running.add(job.job_id)
+                self._memory_in_use += job.memory_estimate
+                self._persist(job)
+
+            threading.Thread(target=self._run, args=(job,),
+                             name=f"ClassifyJob-{job.job_id}", daemon=True).start()
+
+    def _run(self, job):
+        state, error = COMPLETED, None
+        try:
+            self.run_fn(job)
+        except Exception as e:
+            state, error = ERROR, str(e)
+            if not job.cancel_event.is_set():
+                traceback.print_exc()
+
+        with self._cond:
+            self._running.discard(job.job_id)
+            self._memory_in_use -= job.memory_estimate
+            if job.cancel_event.is_set():
+                state, error = CANCELLED, None
+            self._finish(job, state, error)
+            self._cond.notify_all()
+
+    def _finish(self, job, state, error=None):
+        job.state = state
+        job.error = error
+        job.finished = time.time()
+        self._persist(job)
+
+
+class JobQueueClient:
+    """
+    The scheduler as seen from request-serving processes when another process
+    (python server.py --worker) holds the runner lock. Nothing is shared but
+    the jobs folder: submit() writes a queued job record, cancel() drops a
+    <job_id>.cancel marker, state and progress are read back from the records
+    the runner persists. Same interface as JobScheduler for the server.
+    """
+
+    def __init__(self, jobs_folder, chunk_size=5_000_000, inflight_chunks=4,
+                 poll_interval=POLL_SECONDS / 2):
+        self.jobs_folder = Path(jobs_folder)
+        self.jobs_folder.mkdir(exist_ok=True, parents=True)
+        self.chunk_size = chunk_size
+        self.inflight_chunks = inflight_chunks
+        self.poll_interval = poll_interval
+
+    def _path(self, job_id):
+        return self.jobs_folder / f"{job_id}.json"
+
+    def _load(self, job_id):
+        try:
+            return _read_job(self._path(job_id))
+        except (OSError, ValueError, TypeError):
+            return None
+
+    def _jobs(self):
+        jobs = []
+        for path in self.jobs_folder.glob('*.json'):
+            try:
+                jobs.append(_read_job(path))
+            except (OSError, ValueError, TypeError):
+                continue
+        return jobs
+
+    @staticmethod
+    def _queue_order(jobs):
+        queued = sorted((job for job in jobs if job.state == QUEUED),
+                        key=lambda job: (-job.priority, job.submitted))
+        return [job.job_id for job in queued]
+
+    def _describe(self, job):
+        info = _describe(job, self._queue_order(self._jobs()) if job.state == QUEUED else [])
+        if (self.jobs_folder / f"{job.job_id}{CANCEL_SUFFIX}").exists():
+            info['cancel_requested'] = True
+        return info
+
+    def submit(self, job_id, input_path, output_path, priority=0, cache_key=None, options=None):
+        point_count = _read_point_count(input_path)
+        job = Job(job_id, input_path, output_path, priority=priority,
+                  point_count=point_count, cache_key=cache_key, options=options,
+                  memory_estimate=estimate_job_memory(point_count, self.chunk_size,
+                                                      self.inflight_chunks))
+        existing = self._load(job_id)
+        if existing is not None and existing.state in ACTIVE_STATES:
+            raise ValueError(f"Job {job_id} is already {existing.state}")
+        (self.jobs_folder / f"{job_id}{CANCEL_SUFFIX}").unlink(missing_ok=True)
+        _write_job(self._path(job_id), job)
+        return job
+
+    def cancel(self, job_id):
+        """Ask the runner to cancel a queued or running job; returns the job or None"""
+        job = self._load(job_id)
+        if job is not None and job.state in ACTIVE_STATES:
+            (self.jobs_folder / f"{job_id}{CANCEL_SUFFIX}").touch()
+        return job
+
+    def wait_for_update(self, job_id, version, timeout):
+        """Like JobScheduler.wait_for_update; the version is the record's mtime"""
+        deadline = time.time() + timeout
+        while True:
+            try:
+                mtime = self._path(job_id).stat().st_mtime_ns
+            except OSError:
+                return None, None
+            remaining = deadline - time.time()
+            if mtime != version or remaining <= 0:
+                job = self._load(job_id)
+                return (mtime, self._describe(job)) if job is not None else (None, None)
+            time.sleep(min(self.poll_interval, remaining))
+
+    def get(self, job_id):
+        job = self._load(job_id)
+        return self._describe(job) if job is not None else None
+
+    def list(self):
+        jobs = self._jobs()
+        queue_order = self._queue_order(jobs)
+        return [_describe(job, queue_order) for job in jobs]
+
+    def pending_inputs(self):
+        """Input files still needed by queued/running jobs"""
+        return {Path(job.input_path) for job in self._jobs() if job.state in ACTIVE_STATES}
@@ -0,0 +1,127 @@
+"""
+Wynik "tylko klasyfikacja" - sama kolumna etykiet przypięta do pliku wejściowego.
+
+Pełny sklasyfikowany LAS to kopia wejścia różniąca się jednym bajtem na
+punkt. Klient, który ma już oryginał, potrzebuje tylko etykiet: plik
+.labels to nagłówek JSON (liczba punktów, skrót nagłówka LAS wejścia,
+zasięg) + strumień uint8 etykiet w kolejności punktów wejścia, spakowany
+zlib chunk po chunku. Etykiety są długimi seriami - kompresja rzędu 10-50×
+względem kolumny, setki razy względem LAS.
+
+Format:
+    MAGIC (8 B) | długość nagłówka JSON (uint32 LE) | JSON | strumień zlib
+"""
+
+import hashlib
+import json
+import struct
+import zlib
+import numpy as np
+import laspy
+
+MAGIC = b'CPKLBL01'
+COMPRESS_LEVEL = 1  # etykiety kompresują się świetnie już na najszybszym poziomie
+READ_BLOCK = 16 * 1024 * 1024
+
+
+def input_key(las_path):
+    """Identyfikacja wejścia: liczba punktów, format, zasięg i SHA-256 bajtów nagłówka + VLR"""
+    with laspy.open(las_path) as f:
+        header = f.header
+        header_size = header.offset_to_point_data
+        key = {
+            'point_count': int(header.point_count),
+            'point_format': int(header.point_format.id),
+            'mins': header.mins.tolist(),
+            'maxs': header.maxs.tolist(),
+        }
+    with open(las_path, 'rb') as f:
+        key['header_sha256'] = hashlib.sha256(f.read(header_size)).hexdigest()
+    return key
+
+
+class LabelDeltaWriter:
+    """Strumieniowy zapis etykiet - write(labels) po każdym chunku"""
+
+    def __init__(self, path, key):
+        self.path = path
+        self.key = key
+        self.count = 0
+        self._file = None
+        self._compressor = None
+
+    def __enter__(self):
+        meta = json.dumps({'version': 1, 'dtype': 'uint8', 'input': self.key}).encode('utf-8')
+        self._file = open(self.path, 'wb')
+        self._file.write(MAGIC + struct.pack('<I', len(meta)) + meta)
+        self._compressor = zlib.compressobj(COMPRESS_LEVEL)
+        return self
+
+    def write(self, labels):
+        labels = np.ascontiguousarray(labels, dtype=np.uint8)
+        self._file.write(self._compressor.compress(labels))
+        self.count += len(labels)
+
+    def __exit__(self, exc_type, *exc):
+        try:
+            if exc_type is None:
+                self._file.write(self._compressor.flush())
+                if self.count != self.key['point_count']:
+                    raise ValueError(f"Wrote {self.count} labels for "
+                                     f"{self.key['point_count']} input points")
+        finally:
+            self._file.close()
+
+
+def read_header(path):
+    """Nagłówek JSON pliku .labels i offset strumienia etykiet"""
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"Not a label delta file: {path}")
+        (size,) = struct.unpack('<I', f.read(4))
+        meta = json.loads(f.read(size))
+    return meta, len(MAGIC) + 4 + size
+
+
+def iter_labels(path, block=READ_BLOCK):
+    """Etykiety kolejnymi blokami (stała pamięć)"""
+    _, offset = read_header(path)
+    decompressor = zlib.decompressobj()
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        while True:
+            data = f.read(block)
+            if not data:
+                break
+            out = decompressor.decompress(data)
+            if out:
+                yield np.frombuffer(out, dtype=np.uint8)
+        tail = decompressor.flush()
+        if tail:
+            yield np.frombuffer(tail, dtype=np.uint8)
+
+
+def apply_labels(input_path, labels_path, output_path, chunk_size=5_000_000):
+    """
+    Odtwarza sklasyfikowany LAS/LAZ: punkty wejścia + etykiety z pliku .labels.
+    Sprawdza, czy delta jest przypięta do tego samego wejścia.
+    """
+    meta, _ = read_header(labels_path)
+    key = input_key(input_path)
+    if meta['input']['header_sha256'] != key['header_sha256'] \
+            or meta['input']['point_count'] != key['point_count']:
+        raise ValueError("Label delta does not match the input file")
+
+    labels = iter_labels(labels_path)
+    pending = np.empty(0, dtype=np.uint8)
+    with laspy.open(input_path) as f_in, \
+            laspy.open(output_path, mode='w', header=f_in.header) as f_out:
+        for chunk in f_in.chunk_iterator(chunk_size):
+            while len(pending) < len(chunk):
+                block = next(labels, None)
+                if block is None:
+                    raise ValueError("Label delta ends before the last input point")
+                pending = np.concatenate([pending, block])
+            chunk.classification = pending[:len(chunk)]
+            pending = pending[len(chunk):]
+            f_out.write_points(chunk)
@@ -0,0 +1,249 @@
+"""
+Kolumnowy odczyt nieskompresowanego LAS - tylko wymiary, których ktoś używa.
+
+laspy.chunk_iterator czyta każdy chunk w całości (read + bufor rekordów),
+a przebiegi klasyfikatora potrzebują kilku wymiarów: teren - X/Y/Z,
+klasyfikacja - Z, intensywność i RGB, statystyki - samo Z. LasColumns mapuje
+rekordy punktów pliku (np.memmap) i wystawia wymiary jako widoki z krokiem
+rekordu - bez kopii i bez parsowania pozostałych pól. x/y/z są skalowane
+dopiero przy dostępie, dokładnie jak w laspy (raw * scale + offset).
+
+Interfejs jak laspy.LasReader w zakresie używanym przez przebiegi
+(header, chunk_iterator, seek/read_points), a chunk jak ScaleAwarePointRecord
+(X, x, intensity, classification, scales, offsets, len). Pełne rekordy do
+zapisu daje dopiero ColumnChunk.records() - kopia tylko wtedy, gdy jest
+naprawdę potrzebna.
+
+LAZ (i pliki, których rekordy nie zgadzają się z nagłówkiem) czyta dalej
+laspy - open_reader() wybiera czytnik sam.
+
+Strony memmapu, po które sięgnął przebieg, liczą się do RSS procesu aż do
+zamknięcia pliku - przebieg po całym pliku trzymałby go w RSS w całości.
+chunk_iterator i write_classification zwalniają więc strony chunków już
+za nimi (release, madvise DONTNEED): dane zostają w page cache, ponowny
+dostęp mapuje je z powrotem.
+
+Tryb aktualizacji w miejscu: wynik LAS różni się od wejścia tylko bajtem
+klasyfikacji, więc zamiast przepisywać każdy rekord przez laspy plik jest
+kopiowany (copy_file: reflink / copy_file_range - bez przechodzenia przez
+Pythona), a etykiety trafiają wprost do memmapu kopii
+(LasColumns(..., mode='r+').write_classification).
+"""
+
+import mmap
+import os
+import shutil
+import numpy as np
+import laspy
+from laspy.point.dims import get_sub_fields_dict
+
+FICLONE = 0x40049409  # ioctl Linux: dst współdzieli bloki z src
+
+
+class ColumnChunk:
+    """Wycinek rekordów: wymiary jako widoki memmap, x/y/z skalowane na żądanie"""
+
+    def __init__(self, records, point_format, scales, offsets):
+        self._records = records
+        self.point_format = point_format
+        self.scales = scales
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self._records)
+
+    def __getattr__(self, name):
+        # Tylko wymiary - atrybuty obiektu są w __dict__ i tu nie trafiają
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return column(self._records, self.point_format, name)
+
+    @property
+    def x(self):
+        return self.X * self.scales[0] + self.offsets[0]
+
+    @property
+    def y(self):
+        return self.Y * self.scales[1] + self.offsets[1]
+
+    @property
+    def z(self):
+        return self.Z * self.scales[2] + self.offsets[2]
+
+    @property
+    def array(self):
+        """Surowe rekordy (widok tylko do odczytu)"""
+        return self._records
+
+    def records(self):
+        """Kopia rekordów jako laspy.ScaleAwarePointRecord - do zmiany i zapisu"""
+        return laspy.ScaleAwarePointRecord(np.array(self._records), self.point_format,
+                                           self.scales, self.offsets)
+
+
+def column(records, point_format, name):
+    """
+    Wymiar z tablicy rekordów: pole rekordu → widok bez kopii, pole bitowe
+    (np. classification w formatach 0-5) → wyliczone z bajtu, w którym leży.
+    """
+    if name in records.dtype.names:
+        return records[name]
+    sub_fields = get_sub_fields_dict(point_format.id)
+    if name in sub_fields:
+        composed, sub_field = sub_fields[name]
+        raw = records[composed]
+        shift = (sub_field.mask & -sub_field.mask).bit_length() - 1
+        return (raw & raw.dtype.type(sub_field.mask)) >> raw.dtype.type(shift)
+    raise AttributeError(f"{name} is not a valid dimension")
+
+
+class LasColumns:
+    """Rekordy punktów nieskompresowanego LAS w np.memmap (mode='r+' - zapis klasyfikacji)"""
+
+    def __init__(self, path, mode='r'):
+        if mode not in ('r', 'r+'):
+            raise ValueError(f"mode must be 'r' or 'r+', got {mode!r}")
+        self.path = path
+        self.mode = mode
+        with laspy.open(path) as f:
+            self.header = f.header
+        header = self.header
+        if header.are_points_compressed:
+            raise ValueError(f"{path}: compressed point data - use laspy for LAZ")
+        dtype = header.point_format.dtype()
+        n = int(header.point_count)
+        end = header.offset_to_point_data + n * dtype.itemsize
+        if dtype.itemsize != header.point_format.size or os.path.getsize(path) < end:
+            raise ValueError(f"{path}: point records do not match the header")
+        self._memmap = None
+        if n:
+            self._memmap = np.memmap(path, dtype=dtype, mode=mode,
+                                     offset=header.offset_to_point_data, shape=(n,))
+            self._records = self._memmap.view(np.ndarray)
+        else:
+            self._records = np.empty(0, dtype=dtype)
+        self._position = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._memmap is not None and self.mode == 'r+':
+            self._memmap.flush()
+        self._memmap = None
+        self._records = None
+
+    def __len__(self):
+        return len(self._records)
+
+    def column(self, name, start=0, stop=None):
+        """Jeden wymiar dla punktów start..stop (widok, gdy to pole rekordu)"""
+        return column(self._records[start:stop], self.header.point_format, name)
+
+    def chunk(self, start, stop):
+        return ColumnChunk(self._records[start:stop], self.header.point_format,
+                           self.header.scales, self.header.offsets)
+
+    def chunk_iterator(self, chunk_size):
+        # Chunk sprzed poprzedniego jest już zwykle przetworzony - jego strony poza RSS
+        previous = released = 0
+        for start in range(0, len(self._records), chunk_size):
+            self.release(released, previous)
+            released, previous = previous, start
+            yield self.chunk(start, start + chunk_size)
+        self.release(released, previous)
+
+    def release(self, start, stop):
+        """
+        Strony rekordów start..stop poza RSS procesu (madvise DONTNEED).
+        Mapowanie jest współdzielone: odczyt i zapisane etykiety zostają
+        w page cache, dostęp po zwolnieniu to tylko ponowne zmapowanie strony.
+        Strony dzielone z sąsiednimi rekordami zostają.
+        """
+        mapped = getattr(self._memmap, '_mmap', None)
+        if mapped is None or not hasattr(mapped, 'madvise') or not hasattr(mmap, 'MADV_DONTNEED'):
+            return
+        itemsize = self._records.dtype.itemsize
+        stop = min(stop, len(self._records))
+        # np.memmap mapuje od offsetu wyrównanego do ALLOCATIONGRANULARITY
+        base = self.header.offset_to_point_data % mmap.ALLOCATIONGRANULARITY
+        begin = -(-(base + start * itemsize) // mmap.PAGESIZE) * mmap.PAGESIZE
+        end = (base + stop * itemsize) // mmap.PAGESIZE * mmap.PAGESIZE
+        if end > begin:
+            mapped.madvise(mmap.MADV_DONTNEED, begin, end - begin)
+
+    def write_classification(self, start, labels):
+        """
+        Etykiety punktów start..start+len(labels) wprost w bajty rekordów.
+        Formaty 0-5: klasa to bity 0-4 bajtu, flagi synthetic/key_point/withheld
+        (bity 5-7) zostają nietknięte; formaty 6+: cały bajt classification.
+        """
+        if self.mode != 'r+':
+            raise ValueError(f"{self.path}: opened read-only")
+        labels = np.asarray(labels, dtype=np.uint8)
+        stop = start + len(labels)
+        if 'classification' in self._records.dtype.names:
+            self._records['classification'][start:stop] = labels
+        else:
+            if labels.size and labels.max() > 31:
+                raise ValueError(f"Point format {self.header.point_format.id} stores classes 0-31, "
+                                 f"got {int(labels.max())}")
+            raw = self._records['raw_classification'][start:stop]
+            raw[:] = (raw & np.uint8(0xE0)) | labels
+        # Zapis idzie po kolei - zapisane strony nie są już potrzebne w RSS
+        self.release(start, stop)
+
+    def seek(self, position):
+        self._position = int(position)
+
+    def read_points(self, n):
+        chunk = self.chunk(self._position, self._position + n)
+        self._position += len(chunk)
+        return chunk
+
+
+def open_reader(path, laz_backend=None):
+    """LasColumns dla nieskompresowanego LAS, laspy.LasReader dla LAZ / nietypowych plików"""
+    try:
+        return LasColumns(path)
+    except ValueError:
+        return laspy.open(path, laz_backend=laz_backend)
+
+
+def copy_file(src, dst):
+    """
+    Kopia pliku w jądrze: reflink (FICLONE - wspólne bloki na btrfs/XFS, koszt
+    zerowy), potem copy_file_range, na końcu shutil.copyfile (sendfile).
+    Zwraca użytą metodę.
+    """
+    with open(src, 'rb') as f_src, open(dst, 'wb') as f_dst:
+        try:
+            import fcntl
+            fcntl.ioctl(f_dst.fileno(), FICLONE, f_src.fileno())
+            return 'reflink'
+        except (ImportError, OSError):
+            pass
+        if hasattr(os, 'copy_file_range'):
+            size = os.fstat(f_src.fileno()).st_size
+            copied = 0
+            try:
+                while copied < size:
+                    n = os.copy_file_range(f_src.fileno(), f_dst.fileno(), size - copied,
+                                           copied, copied)
+                    if n == 0:
+                        break
+                    copied += n
+            except OSError:
+                copied = -1
+            if copied == size:
+                return 'copy_file_range'
+    shutil.copyfile(src, dst)
+    return 'copy'
+
+
+def writable_points(chunk):
+    """Rekordy chunka do ustawienia klasyfikacji i zapisu przez laspy"""
+    return chunk.records() if isinstance(chunk, ColumnChunk) else chunk
@@ -0,0 +1,271 @@
+"""
+Instrumentacja klasyfikatora - spany faz, liczniki punktów/bajtów i histogramy
+latencji chunków.
+
+Trace (jeden na zadanie) mierzy fazy: całe przebiegi (stats, ground,
+features, stream, index, preview, export_ply) i pojedyncze chunki (decode,
+classify, refine, write_las, write_ply, sample) - czas ściany (perf_counter)
+i CPU wątku (thread_time). Wall >> CPU = faza czeka na I/O, wall ≈ CPU =
+faza liczy. Do tego czas, w którym writer czekał na workery klasyfikacji,
+a reader na writer - widać, który etap potoku ogranicza zadanie.
+
+Każdy pomiar trafia też do rejestru procesu (REGISTRY): liczniki i
+histogramy w formacie tekstowym Prometheusa (/api/metrics). Z events=True
+Trace zbiera zdarzenia do pliku JSON w formacie Chrome Trace Event
+(chrome://tracing, Perfetto) z podsumowaniem faz.
+
+Uwagi: LasColumns dekoduje leniwie (memmap), więc odczyt z dysku
+nieskompresowanego LAS (page faults) liczy się w classify, nie w decode.
+Wątki kernela numba parallel nie wchodzą do CPU wątku. Moduł nie importuje
+numpy - serwer ładuje go przy starcie.
+"""
+
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+# Kubełki histogramu latencji chunka (sekundy)
+CHUNK_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Metryki: nazwa -> (typ Prometheusa, opis)
+METRICS = {
+    'cpk_phase_seconds_total': ('counter', 'Wall time spent in a classifier phase'),
+    'cpk_phase_cpu_seconds_total': ('counter', 'Thread CPU time spent in a classifier phase'),
+    'cpk_points_total': ('counter', 'Points processed by a classifier phase'),
+    'cpk_bytes_read_total': ('counter', 'Point record bytes decoded'),
+    'cpk_bytes_written_total': ('counter', 'Bytes written per output kind'),
+    'cpk_pipeline_wait_seconds_total': ('counter', 'Time a pipeline stage waited: classify = '
+                                        'writer waiting for workers, write = reader waiting '
+                                        'for the writer'),
+    'cpk_chunk_seconds': ('histogram', 'Latency of one chunk in a classifier phase'),
+    'cpk_jobs_total': ('counter', 'Finished classification jobs by final state'),
+    'cpk_jobs': ('gauge', 'Classification jobs by current state'),
+}
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+def render_samples(name, samples):
+    """Blok tekstu Prometheusa dla metryki z METRICS: samples = [(dict etykiet, wartość)]"""
+    kind, description = METRICS[name]
+    lines = [f"# HELP {name} {description}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        lines.append(f"{name}{_labels(tuple(sorted(labels.items())))} {float(value)!r}")
+    return '\n'.join(lines) + '\n'
+
+
+class Metrics:
+    """Liczniki i histogramy procesu (thread-safe), render w formacie Prometheusa"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}     # (nazwa, etykiety) -> wartość
+        self._histograms = {}   # (nazwa, etykiety) -> [kubełki..., +Inf, suma]
+        self._save_lock = threading.Lock()
+
+    def inc(self, name, value=1.0, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * (len(CHUNK_BUCKETS) + 1) + [0.0]
+            histogram[bisect.bisect_left(CHUNK_BUCKETS, value)] += 1
+            histogram[-1] += value
+
+    def render(self):
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: list(value) for key, value in self._histograms.items()}
+        blocks = []
+        for name, (kind, description) in METRICS.items():
+            if kind == 'histogram':
+                series = sorted(key for key in histograms if key[0] == name)
+                if not series:
+                    continue
+                lines = [f"# HELP {name} {description}", f"# TYPE {name} {kind}"]
+                for key in series:
+                    labels, histogram = key[1], histograms[key]
+                    cumulative = 0
+                    for bound, count in zip((*CHUNK_BUCKETS, '+Inf'), histogram):
+                        cumulative += count
+                        le = bound if bound == '+Inf' else repr(float(bound))
+                        lines.append(f"{name}_bucket{_labels(labels + (('le', le),))} {cumulative}")
+                    lines.append(f"{name}_sum{_labels(labels)} {histogram[-1]!r}")
+                    lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+                blocks.append('\n'.join(lines) + '\n')
+            else:
+                samples = [(dict(key[1]), counters[key])
+                           for key in sorted(key for key in counters if key[0] == name)]
+                if samples:
+                    blocks.append(render_samples(name, samples))
+        return ''.join(blocks)
+
+    def save(self, path, blocking=True):
+        """Atomowy zapis render() do pliku (dla procesów bez własnych pomiarów)"""
+        if not self._save_lock.acquire(blocking):
+            return False
+        try:
+            tmp_path = Path(f"{path}.tmp")
+            tmp_path.write_text(self.render())
+            os.replace(tmp_path, path)
+            return True
+        finally:
+            self._save_lock.release()
+
+
+REGISTRY = Metrics()
+
+
+class ChunkTiming:
+    """Pomiar wykonany poza wątkiem Trace (worker puli) - perf_counter jest wspólny dla hosta"""
+
+    __slots__ = ('start', 'seconds', 'cpu', 'pid', 'tid')
+
+    def __init__(self, start, seconds, cpu):
+        self.start = start
+        self.seconds = seconds
+        self.cpu = cpu
+        self.pid = os.getpid()
+        self.tid = threading.get_ident()
+
+
+class Trace:
+    """
+    Pomiary jednego zadania: podsumowanie faz (summary()), zapis do rejestru,
+    z events=True także zdarzenia do pliku (write()).
+    """
+
+    def __init__(self, registry=None, events=False):
+        self.registry = registry if registry is not None else REGISTRY
+        self.events = [] if events else None
+        self.phases = {}
+        self.waits = {}
+        self.bytes_written = {}
+        self._chunk_seconds = {}
+        self._origin = time.perf_counter()
+        self._started = time.time()
+        self._lock = threading.Lock()
+
+    def record(self, phase, seconds, cpu=0.0, points=0, bytes_read=0, chunk=False,
+               start=None, pid=None, tid=None):
+        """Jeden pomiar fazy (chunk=True - także do histogramu latencji chunków)"""
+        registry = self.registry
+        registry.inc('cpk_phase_seconds_total', seconds, phase=phase)
+        registry.inc('cpk_phase_cpu_seconds_total', cpu, phase=phase)
+        if points:
+            registry.inc('cpk_points_total', points, phase=phase)
+        if bytes_read:
+            registry.inc('cpk_bytes_read_total', bytes_read)
+        if chunk:
+            registry.observe('cpk_chunk_seconds', seconds, phase=phase)
+        with self._lock:
+            stats = self.phases.setdefault(phase, {'seconds': 0.0, 'cpu_seconds': 0.0,
+                                                   'chunks': 0, 'points': 0, 'bytes_read': 0})
+            stats['seconds'] += seconds
+            stats['cpu_seconds'] += cpu
+            stats['points'] += points
+            stats['bytes_read'] += bytes_read
+            if chunk:
+                stats['chunks'] += 1
+                self._chunk_seconds.setdefault(phase, []).append(seconds)
+            if self.events is not None:
+                start = start if start is not None else time.perf_counter() - seconds
+                self.events.append({
+                    'name': phase, 'cat': 'chunk' if chunk else 'phase', 'ph': 'X',
+                    'ts': round((start - self._origin) * 1e6, 1),
+                    'dur': round(seconds * 1e6, 1),
+                    'pid': pid if pid is not None else os.getpid(),
+                    'tid': tid if tid is not None else threading.get_ident(),
+                    'args': {'points': points, 'cpu_ms': round(cpu * 1e3, 3)},
+                })
+
+    def record_timing(self, phase, timing, points=0):
+        """Pomiar z ChunkTiming (np. klasyfikacja chunka w workerze)"""
+        self.record(phase, timing.seconds, timing.cpu, points, chunk=True,
+                    start=timing.start, pid=timing.pid, tid=timing.tid)
+
+    @contextmanager
+    def span(self, phase, chunk=False, points=0):
+        start, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            self.record(phase, time.perf_counter() - start, time.thread_time() - cpu,
+                        points, chunk=chunk, start=start)
+
+    def decode(self, chunks):
+        """Chunki z chunk_iterator z pomiarem dekodowania każdego z nich"""
+        iterator = iter(chunks)
+        while True:
+            start, cpu = time.perf_counter(), time.thread_time()
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                return
+            self.record('decode', time.perf_counter() - start, time.thread_time() - cpu,
+                        len(chunk), len(chunk) * chunk.point_format.size, chunk=True, start=start)
+            yield chunk
+
+    def wait(self, stage, seconds):
+        self.registry.inc('cpk_pipeline_wait_seconds_total', seconds, stage=stage)
+        with self._lock:
+            self.waits[stage] = self.waits.get(stage, 0.0) + seconds
+
+    def output(self, kind, path):
+        """Rozmiar gotowego pliku wyniku jako bajty zapisane"""
+        if path is None or not os.path.exists(path):
+            return
+        size = os.path.getsize(path)
+        self.registry.inc('cpk_bytes_written_total', size, output=kind)
+        with self._lock:
+            self.bytes_written[kind] = self.bytes_written.get(kind, 0) + size
+
+    def seconds(self, phase):
+        return self.phases.get(phase, {}).get('seconds', 0.0)
+
+    def summary(self):
+        """Fazy (czas, CPU, punkty, latencja chunków p50/p95/max), oczekiwania potoku, bajty"""
+        with self._lock:
+            phases = {}
+            for phase, stats in self.phases.items():
+                info = {key: round(value, 4) if isinstance(value, float) else value
+                        for key, value in stats.items()}
+                latencies = sorted(self._chunk_seconds.get(phase, ()))
+                if latencies:
+                    info['chunk_p50'] = round(latencies[len(latencies) // 2], 4)
+                    info['chunk_p95'] = round(latencies[min(len(latencies) - 1,
+                                                            int(len(latencies) * 0.95))], 4)
+                    info['chunk_max'] = round(latencies[-1], 4)
+                phases[phase] = info
+            return {
+                'phases': phases,
+                'waits': {stage: round(value, 4) for stage, value in self.waits.items()},
+                'bytes_written': dict(self.bytes_written),
+            }
+
+    def write(self, path, **metadata):
+        """Plik Chrome Trace Event (zdarzenia + podsumowanie w otherData)"""
+        data = {
+            'traceEvents': self.events or [],
+            'displayTimeUnit': 'ms',
+            'otherData': {**metadata, 'started': self._started, 'summary': self.summary()},
+        }
+        tmp_path = Path(f"{path}.tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
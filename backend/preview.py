@@ -0,0 +1,103 @@
+"""
+Podgląd chmury dla przeglądarki - stały budżet punktów z poziomami LOD.
+
+Pełny PLY (każdy punkt, float32 xyz) ma gigabajty - nie do wczytania w
+przeglądarce. Tu w tym samym strumieniowym przebiegu co klasyfikacja
+wybieramy budżet punktów (domyślnie 2M) przez próbkowanie priorytetowe:
+każdy punkt dostaje deterministyczny pseudolosowy priorytet (hash indeksu),
+trzymamy budget najwyższych. Plik jest posortowany malejąco po priorytecie,
+więc KAŻDY prefiks to równomierna próbka całej chmury - poziomy LOD to po
+prostu prefiksy (budżet/64, /16, /4, całość), wczytywane progresywnie.
+
+Rekord: xyz jako uint16 skwantyzowane w bbox pliku + klasa (7 bajtów).
+"""
+
+import json
+import os
+import numpy as np
+
+from pathlib import Path
+
+PREVIEW_BUDGET = 2_000_000
+LOD_LEVELS = 4
+
+PREVIEW_RECORD = np.dtype([('x', '<u2'), ('y', '<u2'), ('z', '<u2'), ('class', 'u1')])
+_QUANT_MAX = 65535
+
+
+def _priority(index):
+    """splitmix64 indeksu punktu - ta sama próbka niezależnie od chunkowania"""
+    z = np.asarray(index, dtype=np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+
+class PreviewSampler:
+    """
+    Top-k po priorytecie w stałej pamięci: bufor rośnie najwyżej do
+    2 × budget, potem argpartition zostawia budget najlepszych.
+    """
+
+    def __init__(self, mins, maxs, budget=PREVIEW_BUDGET):
+        self.budget = int(budget)
+        self.mins = np.asarray(mins, dtype=np.float64)
+        extent = np.asarray(maxs, dtype=np.float64) - self.mins
+        self.scale = np.where(extent > 0, extent / _QUANT_MAX, 1.0)
+        self._priority = np.empty(0, dtype=np.uint64)
+        self._records = np.empty(0, dtype=PREVIEW_RECORD)
+        self._threshold = None
+
+    def add(self, x, y, z, labels, start):
+        """Punkty chunka o globalnych indeksach start..start+n"""
+        priority = _priority(np.arange(start, start + len(labels), dtype=np.uint64))
+        if self._threshold is not None:
+            # Szybki odsiew: szansę mają tylko punkty lepsze od obecnego minimum top-k
+            keep = np.flatnonzero(priority > self._threshold)
+        else:
+            keep = np.arange(len(priority))
+        priority = priority[keep]
+
+        rec = np.empty(len(keep), dtype=PREVIEW_RECORD)
+        for name, values, axis in (('x', x, 0), ('y', y, 1), ('z', z, 2)):
+            q = (np.asarray(values)[keep] - self.mins[axis]) / self.scale[axis]
+            rec[name] = np.clip(np.rint(q), 0, _QUANT_MAX)
+        rec['class'] = np.asarray(labels)[keep]
+
+        self._priority = np.concatenate([self._priority, priority])
+        self._records = np.concatenate([self._records, rec])
+        if len(self._priority) >= 2 * self.budget:
+            self._shrink()
+
+    def _shrink(self):
+        top = np.argpartition(self._priority, len(self._priority) - self.budget)[-self.budget:]
+        self._priority = self._priority[top]
+        self._records = self._records[top]
+        self._threshold = self._priority.min()
+
+    def write(self, data_path, meta_path, palette=None):
+        """Zapisuje rekordy (malejąco po priorytecie) i sidecar JSON z poziomami LOD"""
+        if len(self._priority) > self.budget:
+            self._shrink()
+        order = np.argsort(self._priority)[::-1]
+        records = self._records[order]
+        records.tofile(data_path)
+
+        count = len(records)
+        levels = sorted({max(1, min(count, self.budget // 4 ** (LOD_LEVELS - 1 - i)))
+                         for i in range(LOD_LEVELS)}) if count else []
+        meta = {
+            'count': count,
+            'levels': levels,
+            'record': {'dtype': [[name, PREVIEW_RECORD[name].str] for name in PREVIEW_RECORD.names],
+                       'size': PREVIEW_RECORD.itemsize},
+            'mins': self.mins.tolist(),
+            'scale': self.scale.tolist(),
+            'palette': {str(k): list(v) for k, v in (palette or {}).items()},
+            'data_file': Path(data_path).name,
+        }
+        tmp_path = Path(f"{meta_path}.tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, meta_path)
+        return meta
@@ -0,0 +1,165 @@
+"""
+Content-addressed cache of classification results.
+
+An entry is keyed on a hash of the input file content, the classifier
+version and the options that change its outputs. It holds hard links to the
+result files of the job that produced it (no second copy on disk), named
+without the file_id prefix, plus entry.json. A later upload of identical
+content with the same options materializes the entry under its own file_id
+(hard links again) instead of being classified.
+
+Entries are evicted least-recently-used first once their total size exceeds
+max_bytes; the owners (file_ids materialized from an entry) are reported
+to the caller so their outputs can be dropped as well.
+"""
+
+import json
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+
+ENTRY_FILE = 'entry.json'
+
+
+def _link_or_copy(src, dst):
+    """Hard link src to dst (replacing dst); copy when linking is not possible"""
+    if os.path.exists(dst) and os.path.samefile(src, dst):
+        return  # already linked - rename() onto the same inode would be a no-op
+    tmp = Path(f"{dst}.tmp")
+    tmp.unlink(missing_ok=True)
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copy2(src, tmp)
+    os.replace(tmp, dst)
+
+
+class ResultCache:
+    """Result entries in <folder>/<key>/ with LRU + size-based eviction"""
+
+    def __init__(self, folder, max_bytes):
+        self.folder = Path(folder)
+        self.folder.mkdir(exist_ok=True, parents=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def entry_path(self, key):
+        return self.folder / key
+
+    def _load(self, key):
+        try:
+            with open(self.entry_path(key) / ENTRY_FILE) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _save(self, entry):
+        path = self.entry_path(entry['key']) / ENTRY_FILE
+        tmp_path = path.with_suffix('.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, path)
+
+    def lookup(self, key):
+        """The entry for key (marked as just used) or None"""
+        with self._lock:
+            entry = self._load(key)
+            if entry is not None:
+                entry['last_used'] = time.time()
+                self._save(entry)
+            return entry
+
+    def touch(self, key):
+        self.lookup(key)
+
+    def store(self, key, files, owner):
+        """
+        Add an entry from finished outputs. files maps the name inside the
+        entry (file name without the owner's file_id prefix) to its path.
+        """
+        with self._lock:
+            entry_dir = self.entry_path(key)
+            tmp_dir = self.folder / f".{key}.tmp"
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            tmp_dir.mkdir()
+            size = 0
+            for name, path in files.items():
+                _link_or_copy(path, tmp_dir / name)
+                size += Path(path).stat().st_size
+            now = time.time()
+            entry = {
+                'key': key,
+                'files': sorted(files),
+                'size': size,
+                'owners': [owner],
+                'origin': owner,
+                'created': now,
+                'last_used': now,
+            }
+            with open(tmp_dir / ENTRY_FILE, 'w') as f:
+                json.dump(entry, f)
+            # An entry for the same key (concurrent identical job) is simply replaced
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            os.replace(tmp_dir, entry_dir)
+            return entry
+
+    def materialize(self, key, dest_folder, owner):
+        """
+        Link the entry's files into dest_folder as <owner><name>.
+        Returns {name: path} or None when the entry is gone or incomplete.
+        """
+        with self._lock:
+            entry = self._load(key)
+            if entry is None:
+                return None
+            entry_dir = self.entry_path(key)
+            paths = {}
+            try:
+                for name in entry['files']:
+                    paths[name] = Path(dest_folder) / f"{owner}{name}"
+                    _link_or_copy(entry_dir / name, paths[name])
+            except OSError:
+                for path in paths.values():
+                    path.unlink(missing_ok=True)
+                return None
+            if owner not in entry['owners']:
+                entry['owners'].append(owner)
+            entry['last_used'] = time.time()
+            self._save(entry)
+            return paths
+
+    def entries(self):
+        with self._lock:
+            return [entry for entry in (self._load(path.name) for path in self.folder.iterdir()
+                                        if path.is_dir() and not path.name.startswith('.'))
+                    if entry is not None]
+
+    def owners(self):
+        return {owner for entry in self.entries() for owner in entry['owners']}
+
+    def size(self):
+        return sum(entry['size'] for entry in self.entries())
+
+    def evict(self, protect=()):
+        """
+        Drop least-recently-used entries until the total fits max_bytes.
+        Entries whose key is in protect stay. Returns the evicted entries.
+        """
+        entries = sorted(self.entries(), key=lambda entry: entry['last_used'])
+        total = sum(entry['size'] for entry in entries)
+        evicted = []
+        with self._lock:
+            for entry in entries:
+                if total <= self.max_bytes:
+                    break
+                if entry['key'] in protect:
+                    continue
+                shutil.rmtree(self.entry_path(entry['key']), ignore_errors=True)
+                total -= entry['size']
+                evicted.append(entry)
+            # Half-written entries of an interrupted store()
+            for path in self.folder.glob('.*.tmp'):
+                shutil.rmtree(path, ignore_errors=True)
+        return evicted
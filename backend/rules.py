@@ -0,0 +1,305 @@
+"""
+Reguły klasyfikacji - deklaratywna tabela klas i progów cech.
+
+Jedno źródło prawdy dla klasyfikatora (etykiety, kolory PLY/podglądu)
+i serwera (nazwy klas w /api/stats). Reguła to lista warunków
+(cecha, operator, próg) - wszystkie muszą być spełnione ('when'), plus
+opcjonalnie 'any' (co najmniej jeden). Kolejność listy to priorytet:
+punkt dostaje klasę PIERWSZEJ pasującej reguły, bez dopasowania - default.
+
+Strojenie pod konkretny teren nie wymaga zmian w kodzie: RuleSet.load()
+czyta ten sam układ z pliku JSON ({"classes": ..., "rules": [...], "default": 1}).
+
+RuleSet.compile() zamienia tabelę raz na program dla backendów
+(classifier_kernels.py): unikalne warunki (wspólne podwyrażenia liczone
+raz), tylko potrzebne cechy, zbiory cech wymaganych od danej reguły dalej
+(kompakcja wolnych punktów) i odcisk reguł do nazw cache.
+
+Moduł nie importuje numpy - serwer czyta stąd także wersję klasyfikatora
+i formaty wyniku bez ładowania klasyfikatora.
+"""
+
+import hashlib
+import json
+import threading
+from pathlib import Path
+
+# Wersja reguł klasyfikacji - podbić przy każdej zmianie etykiet dla tego samego
+# wejścia i opcji (klucz cache wyników w serwerze)
+CLASSIFIER_VERSION = '2.2'
+
+# Formaty wyniku: pełny LAS, skompresowany LAZ, sama kolumna etykiet (label_delta.py)
+OUTPUT_FORMATS = {'.las': 'las', '.laz': 'laz', '.labels': 'labels'}
+
+# Cechy dostępne w regułach: nazwa -> (dtype, zależności). Kolory i intensywność
+# znormalizowane do [0, 1] w float32, wysokości w float64.
+FEATURES = {
+    'height': ('float64', ()),                  # metry nad terenem (grid) albo nad z_min
+    'z_rel': ('float64', ('height',)),          # height / zakres wysokości pliku
+    'intensity': ('float32', ()),
+    'red': ('float32', ()),
+    'green': ('float32', ()),
+    'blue': ('float32', ()),
+    'greenness': ('float32', ('red', 'green', 'blue')),    # g - (r + b) / 2
+    'brightness': ('float32', ('red', 'green', 'blue')),   # (r + g + b) / 3
+    'redness': ('float32', ('red', 'green', 'blue')),      # r - (g + b) / 2
+    'blueness': ('float32', ('red', 'green', 'blue')),     # b - (r + g) / 2
+}
+
+OPERATORS = ('<', '<=', '>', '>=')
+
+CLASSES = {
+    1:  {'name': 'Unclassified', 'color': [200, 200, 200]},
+    2:  {'name': 'Ground', 'color': [139, 69, 19]},
+    3:  {'name': 'Low Vegetation', 'color': [144, 238, 144]},
+    4:  {'name': 'Medium Vegetation', 'color': [34, 139, 34]},
+    5:  {'name': 'High Vegetation', 'color': [0, 100, 0]},
+    6:  {'name': 'Building', 'color': [70, 130, 180]},
+    7:  {'name': 'Noise', 'color': [255, 0, 255]},
+    9:  {'name': 'Water', 'color': [0, 0, 255]},
+    11: {'name': 'Fence', 'color': [255, 255, 0]},
+    13: {'name': 'Bridge', 'color': [128, 0, 128]},
+    14: {'name': 'Rail', 'color': [255, 140, 0]},
+    15: {'name': 'Pole', 'color': [255, 0, 0]},
+    16: {'name': 'Sign', 'color': [255, 192, 203]},
+    17: {'name': 'Road', 'color': [64, 64, 64]},
+    18: {'name': 'Sidewalk', 'color': [192, 192, 192]},
+}
+
+# === PRIORYTETOWA KLASYFIKACJA (kolejność = priorytet) ===
+RULES = [
+    # GROUND - bardzo nisko, brązowe/szare, nie zielone
+    {'name': 'ground', 'class': 2,
+     'when': [['z_rel', '<', 0.03], ['greenness', '<', 0.08], ['brightness', '>', 0.15]]},
+    # WATER - bardzo nisko, bardzo ciemne
+    {'name': 'water', 'class': 9,
+     'when': [['z_rel', '<', 0.02], ['brightness', '<', 0.12]]},
+    # VEGETATION - zielone, klasa wg wysokości
+    {'name': 'vegetation_low', 'class': 3,
+     'when': [['greenness', '>', 0.08], ['z_rel', '<', 0.15]]},
+    {'name': 'vegetation_medium', 'class': 4,
+     'when': [['greenness', '>', 0.08], ['z_rel', '>=', 0.15], ['z_rel', '<', 0.40]]},
+    {'name': 'vegetation_high', 'class': 5,
+     'when': [['greenness', '>', 0.08], ['z_rel', '>=', 0.40]]},
+    # ROAD - nisko, ciemne, odbijające
+    {'name': 'road', 'class': 17,
+     'when': [['z_rel', '<', 0.05], ['brightness', '<', 0.35], ['intensity', '>', 0.45]]},
+    # BRIDGE/MOST - średnia wysokość, jasne, struktury mostowe
+    {'name': 'bridge', 'class': 13,
+     'when': [['z_rel', '>', 0.10], ['z_rel', '<', 0.35], ['brightness', '>', 0.35],
+              ['greenness', '<', 0.05]]},
+    # BUILDING - bardzo wysokie (wyżej niż most), jasne
+    {'name': 'building', 'class': 6,
+     'when': [['z_rel', '>', 0.40], ['brightness', '>', 0.30], ['greenness', '<', 0.08]]},
+    # SIDEWALK - nisko/średnio, jasne betonowe
+    {'name': 'sidewalk', 'class': 18,
+     'when': [['z_rel', '>', 0.03], ['z_rel', '<', 0.12], ['brightness', '>', 0.35],
+              ['brightness', '<', 0.55]]},
+    # RAIL - metaliczne szyny (wysoka intensywność)
+    {'name': 'rail', 'class': 14,
+     'when': [['z_rel', '<', 0.08], ['intensity', '>', 0.65], ['brightness', '<', 0.35]]},
+    # POLE/SŁUP - punkty wysoko nad mostem (słupy energetyczne)
+    {'name': 'pole', 'class': 15,
+     'when': [['z_rel', '>', 0.70]]},
+    # FENCE - balustrady mostu, średnia wysokość
+    {'name': 'fence', 'class': 11,
+     'when': [['z_rel', '>', 0.15], ['z_rel', '<', 0.30], ['intensity', '>', 0.40],
+              ['greenness', '<', 0.05]]},
+    # SIGN - znaki drogowe (jasne albo czerwone, średnia wysokość)
+    {'name': 'sign', 'class': 16,
+     'when': [['z_rel', '>', 0.10], ['z_rel', '<', 0.25]],
+     'any': [['redness', '>', 0.15], ['brightness', '>', 0.60]]},
+]
+
+DEFAULT_CLASS = 1
+
+# Klasa punktu w LAS: formaty 0-5 mają na nią 5 bitów, formaty 6+ cały bajt
+MAX_CLASS = 255
+MAX_CLASS_LEGACY_FORMATS = 31
+
+# Klasy, na których operuje korekta geometrią (classifier_genius._refine_with_geometry) -
+# szukane po nazwie w tabeli klas, więc reguły z innymi numerami klas nadal działają.
+# "Nieznana" to klasa domyślna reguł; brak klasy w tabeli wyłącza jej krok korekty
+GEOMETRY_CLASSES = {
+    'pole': 'Pole',
+    'building': 'Building',
+    'noise': 'Noise',
+    'vegetation_medium': 'Medium Vegetation',
+    'vegetation_high': 'High Vegetation',
+}
+
+
+class CompiledRules:
+    """
+    Program dla backendów:
+    atoms       - unikalne warunki (cecha, op, próg), każdy liczony raz
+    rules       - (klasa, indeksy atomów 'when', indeksy atomów 'any')
+    features    - potrzebne cechy w kolejności zależności (z pośrednimi)
+    shared      - atomy użyte w więcej niż jednej regule (warto je buforować)
+    needed_from - needed_from[i]: cechy używane przez reguły od i-tej dalej
+    """
+
+    def __init__(self, ruleset):
+        self.fingerprint = ruleset.fingerprint
+        self.default = ruleset.default
+        self.atoms = []
+        index = {}
+        self.rules = []
+        usage = {}
+        for rule in ruleset.rules:
+            groups = []
+            for key in ('when', 'any'):
+                ids = []
+                for feature, op, threshold in rule.get(key, ()):
+                    atom = (feature, op, float(threshold))
+                    if atom not in index:
+                        index[atom] = len(self.atoms)
+                        self.atoms.append(atom)
+                    ids.append(index[atom])
+                groups.append(tuple(dict.fromkeys(ids)))
+            for atom_id in set(groups[0]) | set(groups[1]):
+                usage[atom_id] = usage.get(atom_id, 0) + 1
+            self.rules.append((int(rule['class']), groups[0], groups[1]))
+        self.shared = {atom_id for atom_id, count in usage.items() if count > 1}
+
+        used = [{self.atoms[a][0] for a in when + any_} for _, when, any_ in self.rules]
+        self.needed_from = []
+        tail = set()
+        for names in reversed(used):
+            tail = tail | names
+            self.needed_from.append(frozenset(tail))
+        self.needed_from.reverse()
+        self.features = _with_dependencies(set().union(*used) if used else set())
+
+
+def _with_dependencies(names):
+    """Cechy + ich zależności, w kolejności z FEATURES (zależności pierwsze)"""
+    closure = set()
+    stack = list(names)
+    while stack:
+        name = stack.pop()
+        if name not in closure:
+            closure.add(name)
+            stack.extend(FEATURES[name][1])
+    return tuple(name for name in FEATURES if name in closure)
+
+
+class RuleSet:
+    """Walidowana tabela klas i reguł; fingerprint = SHA-256 kanonicznego JSON"""
+
+    def __init__(self, rules, classes=None, default=DEFAULT_CLASS):
+        self.classes = {int(k): {'name': v['name'], 'color': [int(c) for c in v['color']]}
+                        for k, v in (classes if classes is not None else CLASSES).items()}
+        for class_id in self.classes:
+            if not 0 <= class_id <= MAX_CLASS:
+                raise ValueError(f"Class {class_id} is outside 0-{MAX_CLASS} (one byte in LAS)")
+        self.default = int(default)
+        self.rules = [self._validate(rule, i) for i, rule in enumerate(rules)]
+        if self.default not in self.classes:
+            raise ValueError(f"Default class {self.default} is not in the class table")
+        payload = json.dumps(self.to_dict(), sort_keys=True, separators=(',', ':'))
+        self.fingerprint = hashlib.sha256(payload.encode('utf-8')).hexdigest()
+        self._compiled = None
+        self._lock = threading.Lock()
+
+    def _validate(self, rule, position):
+        name = rule.get('name', f"rule_{position}")
+        if 'class' not in rule:
+            raise ValueError(f"Rule {name!r} has no 'class'")
+        class_id = int(rule['class'])
+        if class_id not in self.classes:
+            raise ValueError(f"Rule {name!r}: class {class_id} is not in the class table")
+        if not rule.get('when') and not rule.get('any'):
+            raise ValueError(f"Rule {name!r} has no conditions")
+        clean = {'name': name, 'class': class_id}
+        for key in ('when', 'any'):
+            conditions = []
+            for condition in rule.get(key, ()):
+                feature, op, threshold = condition
+                if feature not in FEATURES:
+                    raise ValueError(f"Rule {name!r}: unknown feature {feature!r} "
+                                     f"(one of {', '.join(FEATURES)})")
+                if op not in OPERATORS:
+                    raise ValueError(f"Rule {name!r}: unknown operator {op!r} (one of {OPERATORS})")
+                conditions.append([feature, op, float(threshold)])
+            if conditions:
+                clean[key] = conditions
+        return clean
+
+    @property
+    def class_names(self):
+        return {class_id: info['name'] for class_id, info in self.classes.items()}
+
+    def class_id(self, name):
+        """Numer klasy o tej nazwie w tabeli (bez rozróżniania wielkości liter) albo None"""
+        name = name.lower()
+        return next((class_id for class_id, info in sorted(self.classes.items())
+                     if info['name'].lower() == name), None)
+
+    def geometry_classes(self):
+        """GEOMETRY_CLASSES → numery klas tej tabeli (None - klasy nie ma)"""
+        return {role: self.class_id(name) for role, name in GEOMETRY_CLASSES.items()}
+
+    def check_point_format(self, point_format_id, classes=()):
+        """
+        ValueError, gdy reguły (+ dodatkowe klasy, np. z korekty geometrią) nadają
+        klasy, których format punktów LAS nie zapisze - zamiast ich obcięcia
+        """
+        limit = MAX_CLASS if point_format_id >= 6 else MAX_CLASS_LEGACY_FORMATS
+        assigned = {self.default, *(rule['class'] for rule in self.rules), *classes}
+        too_high = sorted(class_id for class_id in assigned if class_id > limit)
+        if too_high:
+            raise ValueError(f"Point format {point_format_id} stores classes 0-{limit}, "
+                             f"the rules assign {too_high}")
+
+    def to_dict(self):
+        return {
+            'classes': {str(k): v for k, v in sorted(self.classes.items())},
+            'rules': self.rules,
+            'default': self.default,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        classes = data.get('classes')
+        if classes is not None:
+            classes = {int(k): v for k, v in classes.items()}
+        return cls(data['rules'], classes, data.get('default', DEFAULT_CLASS))
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+    def save(self, path):
+        Path(path).write_text(json.dumps(self.to_dict(), indent=2) + '\n')
+
+    def compile(self):
+        """Program dla backendów - budowany raz na RuleSet"""
+        with self._lock:
+            if self._compiled is None:
+                self._compiled = CompiledRules(self)
+            return self._compiled
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_lock'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+
+DEFAULT_RULES = RuleSet(RULES, CLASSES, DEFAULT_CLASS)
+
+
+def load_rules(source=None):
+    """None → reguły wbudowane; RuleSet; dict w układzie JSON; ścieżka do pliku JSON"""
+    if source is None:
+        return DEFAULT_RULES
+    if isinstance(source, RuleSet):
+        return source
+    if isinstance(source, dict):
+        return RuleSet.from_dict(source)
+    return RuleSet.load(source)
@@ -1,28 +1,107 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Blueprint, Flask, Request, Response, request, jsonify
 from flask_cors import CORS
+from contextlib import contextmanager, nullcontext
 from pathlib import Path
+import argparse
+import os
 import json
-from classifier_genius import GeniusStreamingClassifier
+import time
+import uuid
+import hashlib
+import tempfile
+from jobs import ACTIVE_STATES, JobQueueClient, JobScheduler, estimate_job_memory
+from metrics import REGISTRY, Trace, render_samples
+from result_cache import ResultCache
+from rules import CLASSIFIER_VERSION, OUTPUT_FORMATS, load_rules
 from werkzeug.utils import secure_filename
+from werkzeug.exceptions import RequestEntityTooLarge
 import threading
-import laspy
-import numpy as np
 
-app = Flask(__name__)
-CORS(app)
+try:
+    import fcntl
+except ImportError:  # Windows - uploads are locked per process only
+    fcntl = None
+
+# numpy, laspy and the classifier are imported where they are used: a request-serving
+# process starts fast and never loads the classification stack it does not run
 
 # Configuration
 UPLOAD_FOLDER = Path(__file__).parent / 'uploads'
 OUTPUT_FOLDER = Path(__file__).parent / 'outputs'
+JOBS_FOLDER = Path(__file__).parent / 'jobs'
+CACHE_FOLDER = Path(__file__).parent / 'cache'
+
+# Job scheduling
+MAX_CONCURRENT_JOBS = 2
+JOB_MEMORY_BUDGET = 8 * 1024 * 1024 * 1024  # 8GB across running jobs
+CHUNK_SIZE = 5_000_000
+# Classifier threads per job: the cores split between concurrent jobs, capped so that
+# MAX_CONCURRENT_JOBS jobs of any size fit the budget together - a job holds workers + 2
+# chunks in flight (jobs.estimate_job_memory). Defaults: 5M-point chunks take ~800MB,
+# 4GB per job leaves 3 workers on any machine with 6+ cores; raise JOB_MEMORY_BUDGET
+# (or lower CHUNK_SIZE) to give jobs more cores
+CLASSIFIER_WORKERS = max(1, min(
+    (os.cpu_count() or 1) // MAX_CONCURRENT_JOBS,
+    JOB_MEMORY_BUDGET // MAX_CONCURRENT_JOBS // estimate_job_memory(CHUNK_SIZE, CHUNK_SIZE, 1) - 2,
+))
+# Neighbourhood (kNN eigen) features per spatial tile - two extra passes, much slower
+GEOMETRIC_FEATURES = False
+# Write LAS outputs sorted by tile (Morton order) with an index sidecar for /api/points;
+# per upload with ?spatial_index=1. Off by default: the tile spool rewrites the whole
+# LAS once more (about twice the output I/O) and rules out the in-place LAS copy
+SPATIAL_INDEX = False
+POINTS_QUERY_LIMIT = 100_000
+# Fixed-budget LOD preview for the web viewer (0 disables)
+PREVIEW_POINTS = 2_000_000
+POINTS_QUERY_MAX_LIMIT = 1_000_000
+# Default result format: 'las', 'laz' (compressed) or 'labels' (label column only);
+# per upload with ?output_format=
+OUTPUT_FORMAT = 'las'
+OUTPUT_SUFFIXES = {fmt: suffix for suffix, fmt in OUTPUT_FORMATS.items()}
+# Results of identical inputs are reused; least recently used ones are evicted above this size
+RESULT_CACHE_BYTES = 200 * 1024 * 1024 * 1024  # 200GB
+# Class table + rule thresholds tuned for a site (JSON in the rules.py layout, also via
+# the CPK_RULES environment variable); None = built-in rules
+CLASSIFICATION_RULES = os.environ.get('CPK_RULES') or None
+# Who runs classification jobs: 'thread' - the serving process itself (python server.py,
+# one WSGI worker), 'external' - a separate `python server.py --worker` process
+# (production: any number of WSGI workers, see README)
+JOB_RUNNER = os.environ.get('CPK_JOB_RUNNER', 'thread')
+# Maintenance cleanup leaves files modified more recently than this alone (uploads in flight)
+CLEANUP_MIN_AGE = 3600
+# Per-job trace file <file_id>_trace.json (Chrome trace format: phase and chunk spans)
+JOB_TRACES = os.environ.get('CPK_JOB_TRACES') == '1'
+# The job runner publishes its metrics here for /api/metrics in request-serving processes
+METRICS_PATH = JOBS_FOLDER / 'metrics.prom'
+METRICS_SAVE_SECONDS = 5
+
+# Set by _init_storage() (create_app(), run_worker(), --cleanup) - nothing is created on import
+result_cache = None
+# Single source of class ids/names for the classifier and /api/stats
+classification_rules = load_rules(CLASSIFICATION_RULES)
+
+# Set by create_app() (request serving) or run_worker() (classification process):
+# JobScheduler where this process runs the jobs, JobQueueClient where another one does
+scheduler = None
 
 def cleanup_folders():
-    """Clean up uploads and outputs folders on startup"""
+    """
+    Maintenance (python server.py --cleanup - never on startup): evict the result
+    cache down to its budget, then remove files in uploads/outputs that belong
+    neither to a cached result nor to a queued/running job and were not touched
+    for CLEANUP_MIN_AGE - partial outputs of crashed jobs, uncached results.
+    """
+    _evict_results()
+    active = [job for job in scheduler.list() if job['state'] in ACTIVE_STATES]
+    keep = {Path(job['input_path']) for job in active}
+    owners = tuple(f"{owner}_" for owner in result_cache.owners() | {job['job_id'] for job in active})
+    cutoff = time.time() - CLEANUP_MIN_AGE
     for folder in [UPLOAD_FOLDER, OUTPUT_FOLDER]:
         if folder.exists():
             try:
-                # Remove all files in the folder
                 for file in folder.glob('*'):
-                    if file.is_file():
+                    if (file.is_file() and file not in keep and not file.name.startswith(owners)
+                            and file.stat().st_mtime < cutoff):
                         file.unlink()
                         print(f"Deleted: {file.name}")
                 print(f"Cleaned: {folder.name}/")
@@ -35,16 +114,146 @@ def cleanup_folders():
     
     print("="*70 + "\n")
 
-# Clean folders on startup
-cleanup_folders()
+_metrics_saved = 0.0
+
+def _save_metrics(force=False):
+    """Publish this (job runner) process's metrics - at most every METRICS_SAVE_SECONDS"""
+    global _metrics_saved
+    now = time.time()
+    if force or now - _metrics_saved >= METRICS_SAVE_SECONDS:
+        # A save already in progress in another job thread is as good as this one
+        if REGISTRY.save(METRICS_PATH, blocking=force):
+            _metrics_saved = now
+
+def _job_progress(job, progress):
+    scheduler.update_progress(job.job_id, progress)
+    _save_metrics()
+
+def _run_job(job):
+    trace = Trace(events=JOB_TRACES)
+    state = 'error'
+    try:
+        _classify_file(job.input_path, job.output_path, job.job_id, job.cancel_event,
+                       progress_callback=lambda progress: _job_progress(job, progress),
+                       cache_key=job.cache_key, trace=trace,
+                       spatial_index=job.options.get('spatial_index', SPATIAL_INDEX))
+        state = 'completed'
+    finally:
+        if job.cancel_event.is_set():
+            state = 'cancelled'
+        REGISTRY.inc('cpk_jobs_total', state=state)
+        _save_metrics(force=True)
+        if JOB_TRACES:
+            trace.write(_trace_path(job.job_id), job_id=job.job_id, state=state,
+                        point_count=job.point_count)
+
+def _job_scheduler():
+    # Queued/running jobs are persisted in JOBS_FOLDER and resumed after a restart
+    return JobScheduler(
+        JOBS_FOLDER, _run_job,
+        max_workers=MAX_CONCURRENT_JOBS,
+        memory_budget=JOB_MEMORY_BUDGET,
+        chunk_size=CHUNK_SIZE,
+        inflight_chunks=CLASSIFIER_WORKERS + 2
+    )
+
+def _init_storage():
+    """Data folders and the result cache of this process"""
+    global result_cache
+    for folder in (UPLOAD_FOLDER, OUTPUT_FOLDER):
+        folder.mkdir(exist_ok=True, parents=True)
+    if result_cache is None:
+        result_cache = ResultCache(CACHE_FOLDER, RESULT_CACHE_BYTES)
+    return result_cache
+
+def _init_jobs(job_runner):
+    """
+    Set up `scheduler` for this process. 'thread' runs the jobs here unless
+    another process already holds the runner lock (a second WSGI worker, a
+    --worker process) - then, like 'external', this process only queues them.
+    """
+    global scheduler
+    if scheduler is not None:
+        return scheduler
+    if job_runner not in ('thread', 'external'):
+        raise ValueError(f"job_runner must be 'thread' or 'external', got {job_runner!r}")
+    if job_runner == 'thread':
+        runner = _job_scheduler()
+        if runner.claim():
+            runner.recover()
+            runner.start()
+            scheduler = runner
+            return scheduler
+        print(f"Jobs in {JOBS_FOLDER.name}/ are run by another process - serving requests only")
+    scheduler = JobQueueClient(JOBS_FOLDER, chunk_size=CHUNK_SIZE,
+                               inflight_chunks=CLASSIFIER_WORKERS + 2)
+    return scheduler
 
 MAX_FILE_SIZE = 30 * 1024 * 1024 * 1024  # 30GB
 ALLOWED_EXTENSIONS = {'.las', '.laz'}
+UPLOAD_CHECKSUM = 'sha256'  # hash computed while streaming the upload (None = off)
+DOWNLOAD_CHECKSUM = 'sha256'  # hash of the result computed once at job completion (None = off)
+DOWNLOAD_BLOCK_SIZE = 1024 * 1024
+
+
+class UploadSpool:
+    """
+    Temp file in UPLOAD_FOLDER that receives the multipart file part.
+
+    Werkzeug writes the body here in small blocks as it parses the request,
+    so the upload never sits in worker RAM. The size limit is enforced and the
+    checksum updated on every block; on success the spool is renamed into place.
+    """
+
+    def __init__(self, folder, max_size, checksum=None):
+        self.file = tempfile.NamedTemporaryFile(
+            'w+b', dir=folder, prefix='.upload-', suffix='.part', delete=False
+        )
+        self.max_size = max_size
+        self.hasher = hashlib.new(checksum) if checksum else None
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.max_size:
+            raise RequestEntityTooLarge()
+        if self.hasher is not None:
+            self.hasher.update(data)
+        return self.file.write(data)
+
+    def hexdigest(self):
+        return self.hasher.hexdigest() if self.hasher is not None else None
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+
+class UploadRequest(Request):
+    """Request that streams uploaded files straight into UPLOAD_FOLDER"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None,
+                         content_length=None):
+        spool = UploadSpool(UPLOAD_FOLDER, MAX_FILE_SIZE, UPLOAD_CHECKSUM)
+        self.environ.setdefault('cpk.upload_spools', []).append(spool)
+        return spool
+
+
+# Routes live on a blueprint; create_app() builds the application around it
+api = Blueprint('api', __name__)
+
+
+@api.teardown_app_request
+def _remove_upload_spools(exc):
+    """Drop spool files that were not moved into place (errors, aborted uploads)"""
+    for spool in request.environ.get('cpk.upload_spools', []):
+        spool.file.close()
+        if os.path.exists(spool.file.name):
+            os.unlink(spool.file.name)
 
 def allowed_file(filename):
     return Path(filename).suffix.lower() in ALLOWED_EXTENSIONS
 
-@app.route('/api/upload', methods=['POST'])
+@api.route('/api/upload', methods=['POST'])
 def upload_file():
     """Handle file upload and start classification"""
     try:
@@ -56,6 +265,13 @@ def upload_file():
         print(f"Method: {request.method}")
         print(f"Content-Type: {request.content_type}")
         print(f"Content-Length: {request.content_length}")
+        
+        # Reject oversized uploads before reading a single byte
+        if request.content_length is not None and request.content_length > MAX_FILE_SIZE + 1024 * 1024:
+            print(f"ERROR: Request too large ({request.content_length} bytes)")
+            return jsonify({'error': f'File too large. Max size: 30GB'}), 413
+        
+        # Accessing request.files streams the body into an UploadSpool on disk
         print(f"Files in request: {list(request.files.keys())}")
         
         if 'file' not in request.files:
@@ -76,91 +292,472 @@ def upload_file():
         
         print(f"File extension valid: {Path(file.filename).suffix}")
         
-        # IMPORTANT: Read the entire file into memory ONCE
-        print("📖 Reading file content into memory...")
-        file_data = file.read()
-        file_size = len(file_data)
+        # The body was already streamed to disk block by block while parsing
+        spool = file.stream
+        spool.flush()
+        file_size = spool.size
+        checksum = spool.hexdigest()
         
-        print(f"File read complete")
+        print(f"File streamed to disk")
         print(f"File size: {file_size} bytes ({file_size / 1024 / 1024:.2f} MB)")
+        if checksum:
+            print(f"{UPLOAD_CHECKSUM}: {checksum}")
         
         # Verify file is not empty
         if file_size == 0:
-            print("ERROR: File is empty after read!")
+            print("ERROR: File is empty after upload!")
             print(f"Request content_length: {request.content_length}")
             return jsonify({'error': 'Uploaded file is empty'}), 400
         
-        if file_size > MAX_FILE_SIZE:
-            print(f"ERROR: File too large ({file_size / 1024 / 1024 / 1024:.2f} GB > 30GB)")
-            return jsonify({'error': f'File too large. Max size: 30GB'}), 413
+        expected_checksum = request.headers.get('X-Content-SHA256')
+        if expected_checksum and UPLOAD_CHECKSUM == 'sha256' and expected_checksum.lower() != checksum:
+            print(f"ERROR: Checksum mismatch (expected {expected_checksum})")
+            return jsonify({'error': 'Checksum mismatch'}), 400
         
         print("File size validation passed")
         
-        # Save uploaded file from memory
-        filename = secure_filename(file.filename)
-        input_path = UPLOAD_FOLDER / filename
+        priority = request.args.get('priority', 0, type=int)
+        try:
+            output_format, spatial_index = _upload_options()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        print(f"Writing file to disk: {input_path}")
-        with open(input_path, 'wb') as f:
-            bytes_written = f.write(file_data)
+        # The spool is moved into place (no second copy) or dropped on a cache hit
+        spool.file.close()
+        response_data, status = _start_classification(
+            Path(spool.file.name), secure_filename(file.filename), file_size, checksum,
+            priority, output_format, spatial_index
+        )
         
-        print(f"File written: {bytes_written} bytes")
+        if status == 200:
+            print(f"\nUPLOAD SUCCESSFUL")
+        print("="*70 + "\n")
         
-        # Verify file was saved correctly
-        saved_size = input_path.stat().st_size
-        print(f"File verified on disk: {saved_size} bytes")
+        return jsonify(response_data), status
+    
+    except RequestEntityTooLarge:
+        print(f"ERROR: Upload exceeded {MAX_FILE_SIZE} bytes while streaming")
+        return jsonify({'error': f'File too large. Max size: 30GB'}), 413
+    
+    except Exception as e:
+        print(f"\nUPLOAD FAILED: {e}")
+        import traceback
+        traceback.print_exc()
+        print("="*70 + "\n")
+        return jsonify({'error': str(e)}), 500
+
+def _job_active(file_id):
+    job = scheduler.get(file_id)
+    return job is not None and job['state'] in ('queued', 'running')
+
+def _output_paths(file_id):
+    """Candidate result paths, one per output format"""
+    return [OUTPUT_FOLDER / f"{file_id}_classified{suffix}" for suffix in OUTPUT_SUFFIXES.values()]
+
+def _output_path(file_id):
+    """The classified result of file_id in whichever format it was written, or None"""
+    return next((path for path in _output_paths(file_id) if path.exists()), None)
+
+def _result_paths(file_id):
+    """Every file a job writes to OUTPUT_FOLDER for file_id"""
+    return [*_output_paths(file_id), OUTPUT_FOLDER / f"{file_id}_classified.ply",
+            _index_path(file_id), *_preview_paths(file_id), _meta_path(file_id),
+            OUTPUT_FOLDER / f"{file_id}_status.json", _trace_path(file_id)]
+
+def _classifier_options(output_format, spatial_index=SPATIAL_INDEX):
+    """process_file_streaming options that change the outputs - part of the cache key"""
+    return {
+        'output_format': output_format,
+        'geometric_features': GEOMETRIC_FEATURES,
+        # The index only exists for uncompressed LAS - elsewhere the flag changes nothing
+        'spatial_index': bool(spatial_index) and output_format == 'las',
+        'preview_budget': PREVIEW_POINTS,
+    }
+
+def _cache_key(checksum, output_format, spatial_index=SPATIAL_INDEX):
+    """Result cache key: input content hash + classifier version + rules + output-relevant options"""
+    payload = json.dumps({
+        'input': f"{UPLOAD_CHECKSUM}:{checksum}",
+        'classifier': CLASSIFIER_VERSION,
+        'rules': classification_rules.fingerprint,
+        'options': _classifier_options(output_format, spatial_index),
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def _flag_arg(name, default):
+    """Boolean query argument (?name=1/0, true/false, yes/no); ValueError otherwise"""
+    value = request.args.get(name)
+    if value is None:
+        return default
+    if value.lower() in ('1', 'true', 'yes'):
+        return True
+    if value.lower() in ('0', 'false', 'no'):
+        return False
+    raise ValueError(f"{name} must be 1 or 0, got {value!r}")
+
+def _upload_options():
+    """Per-upload query options (?output_format=, ?spatial_index=) - ValueError if invalid"""
+    output_format = request.args.get('output_format', OUTPUT_FORMAT)
+    if output_format not in OUTPUT_SUFFIXES:
+        raise ValueError(f"Unknown output_format: {output_format} "
+                         f"(one of {', '.join(OUTPUT_SUFFIXES)})")
+    return output_format, _flag_arg('spatial_index', SPATIAL_INDEX)
+
+def _start_classification(source_path, filename, file_size, checksum=None, priority=0,
+                          output_format=OUTPUT_FORMAT, spatial_index=SPATIAL_INDEX):
+    """
+    Classify an uploaded file (source_path, a temp file in UPLOAD_FOLDER).
+    With a checksum the file_id is derived from the cache key, so identical
+    content + options map to the same id: a cached result is linked into place
+    at once and a running job is shared. Returns (response, http_status);
+    source_path is moved into place or removed.
+    """
+    spatial_index = _classifier_options(output_format, spatial_index)['spatial_index']
+    cache_key = _cache_key(checksum, output_format, spatial_index) if checksum else None
+    stem, suffix = Path(filename).stem, Path(filename).suffix.lower()
+    file_id = f"{stem}-{cache_key[:12]}" if cache_key else stem
+    output_filename = f"{file_id}_classified{OUTPUT_SUFFIXES[output_format]}"
+    response = {
+        'status': 'success',
+        'input_file': filename,
+        'output_file': output_filename,
+        'output_format': output_format,
+        'spatial_index': spatial_index,
+        'file_id': file_id,
+        'file_size_mb': round(file_size / 1024 / 1024, 2),
+        'checksum': checksum,
+        'cached': False,
+    }
+    
+    if _job_active(file_id):
+        source_path.unlink(missing_ok=True)
+        if cache_key is None:
+            return {'error': f'File {filename} is already being classified'}, 409
+        print(f"Identical upload of {file_id} is already being classified - sharing the job")
+        return {**response, 'message': 'Identical file is already being classified',
+                'job': scheduler.get(file_id)}, 200
+    
+    if cache_key is not None and _adopt_cached_result(cache_key, file_id, filename):
+        source_path.unlink(missing_ok=True)
+        print(f"Result cache hit for {file_id} - classification skipped")
+        return {**response, 'message': 'Identical file already classified - cached result',
+                'cached': True, 'job': None}, 200
+    
+    input_path = UPLOAD_FOLDER / f"{file_id}{suffix}"
+    output_path = OUTPUT_FOLDER / output_filename
+    os.replace(source_path, input_path)
+    
+    print(f"\nClassification details:")
+    print(f"   Input:  {input_path}")
+    print(f"   Output: {output_path}")
+    print(f"   File ID: {file_id}")
+    
+    # A re-upload under the same name must not report (or overwrite in place) a previous result
+    for path in _result_paths(file_id):
+        path.unlink(missing_ok=True)
+    
+    job = scheduler.submit(file_id, input_path, output_path, priority=priority, cache_key=cache_key,
+                           options={'spatial_index': spatial_index})
+    print(f"Job queued (priority {priority}, {job.point_count:,} points)")
+    
+    return {**response, 'message': 'File uploaded and classification queued',
+            'job': scheduler.get(file_id)}, 200
+
+def _adopt_cached_result(cache_key, file_id, filename):
+    """Link a cached result into OUTPUT_FOLDER as file_id; False when there is none"""
+    entry = result_cache.lookup(cache_key)
+    if entry is None or result_cache.materialize(cache_key, OUTPUT_FOLDER, file_id) is None:
+        return False
+    origin = entry['origin']
+    if origin != file_id:
+        # Sidecars name their sibling files - rewrite them for this file_id.
+        # os.replace gives them a new inode, the hard-linked cached copies stay intact.
+        meta = _load_meta(file_id)
+        meta['file_id'] = file_id
+        meta['input_file'] = filename
+        for info in meta['outputs'].values():
+            info['path'] = file_id + info['path'][len(origin):]
+        _write_json(_meta_path(file_id), meta)
+        preview_meta_path = _preview_paths(file_id)[0]
+        if preview_meta_path.exists():
+            with open(preview_meta_path) as f:
+                preview = json.load(f)
+            preview['data_file'] = _preview_paths(file_id)[1].name
+            _write_json(preview_meta_path, preview)
+    _write_json(OUTPUT_FOLDER / f"{file_id}_status.json",
+                {'status': 'completed', 'file_id': file_id, 'cached': True})
+    return True
+
+def _cache_result(file_id, cache_key, input_path):
+    """Store a finished job's outputs in the result cache and drop its input"""
+    files = {path.name[len(file_id):]: path for path in _result_paths(file_id)
+             if path.exists() and not path.name.endswith('_status.json')}
+    result_cache.store(cache_key, files, owner=file_id)
+    Path(input_path).unlink(missing_ok=True)
+    _evict_results(protect={cache_key})
+
+def _evict_results(protect=()):
+    """LRU eviction of the result cache; outputs linked from evicted entries go too"""
+    for entry in result_cache.evict(protect):
+        print(f"Result cache: evicted {entry['key'][:12]} ({entry['size'] / 1024 / 1024:.1f} MB)")
+        for owner in entry['owners']:
+            if not _job_active(owner):
+                for path in _result_paths(owner):
+                    path.unlink(missing_ok=True)
+
+# === Resumable uploads ===
+# POST /api/uploads                    -> init, returns upload_id
+# PUT  /api/uploads/<id>               -> write a byte range (Content-Range: bytes a-b/size)
+# GET  /api/uploads/<id>               -> received ranges + contiguous offset to resume from
+# POST /api/uploads/<id>/complete      -> move into UPLOAD_FOLDER and start classification
+#
+# Parts are written at their offset straight into one preallocated file, so
+# parallel PUTs need no assembly step and nothing is re-read on finalize.
+
+PARTIAL_FOLDER = UPLOAD_FOLDER / '.partial'
+UPLOAD_BLOCK_SIZE = 1024 * 1024
+RECOMMENDED_PART_SIZE = 64 * 1024 * 1024
+
+_upload_locks = {}
+_upload_locks_guard = threading.Lock()
+
+@contextmanager
+def _flock(path, key, shared=False):
+    """
+    flock on path - across WSGI worker processes and, because every holder opens
+    its own file description, across threads too. Without fcntl (Windows) a
+    thread lock per key stands in and shared holders are serialized as well.
+    A missing path (upload completed meanwhile) is not locked - callers then
+    find no upload state.
+    """
+    if fcntl is None:
+        with _upload_locks_guard:
+            lock = _upload_locks.setdefault(key, threading.Lock())
+    else:
+        lock = nullcontext()
+    with lock:
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except FileNotFoundError:
+            yield
+            return
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+def _upload_lock(upload_id, shared=False):
+    """
+    Lock on the part file of one upload: PUTs write their ranges under the
+    shared lock (in parallel), complete takes it exclusively - it waits for
+    writes in flight, and later PUTs find the upload closed
+    """
+    _, part_path = _upload_paths(upload_id)
+    return _flock(part_path, upload_id, shared)
+
+def _upload_state_lock():
+    """Short exclusive lock for read-modify-write of upload state (range merges)"""
+    return _flock(PARTIAL_FOLDER, '.partial')
+
+def _upload_paths(upload_id):
+    upload_id = secure_filename(upload_id)
+    return PARTIAL_FOLDER / f"{upload_id}.json", PARTIAL_FOLDER / f"{upload_id}.part"
+
+def _load_upload(upload_id):
+    state_path, _ = _upload_paths(upload_id)
+    if not state_path.exists():
+        return None
+    with open(state_path) as f:
+        return json.load(f)
+
+def _save_upload(state):
+    state_path, _ = _upload_paths(state['upload_id'])
+    tmp_path = state_path.with_suffix('.json.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, state_path)
+
+def _merge_ranges(ranges, start, end):
+    """Add half-open range [start, end) to a sorted list of disjoint ranges"""
+    merged = []
+    for a, b in sorted(ranges + [[start, end]]):
+        if merged and a <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], b)
+        else:
+            merged.append([a, b])
+    return merged
+
+def _upload_progress(state):
+    ranges = state['ranges']
+    offset = ranges[0][1] if ranges and ranges[0][0] == 0 else 0
+    received = sum(b - a for a, b in ranges)
+    return {
+        'upload_id': state['upload_id'],
+        'filename': state['filename'],
+        'size': state['size'],
+        'offset': offset,
+        'received': received,
+        'ranges': ranges,
+        'complete': offset == state['size'],
+        'part_size': RECOMMENDED_PART_SIZE
+    }
+
+@api.route('/api/uploads', methods=['POST'])
+def init_upload():
+    """Start a resumable upload"""
+    try:
+        data = request.get_json(silent=True) or {}
+        filename = secure_filename(data.get('filename', ''))
+        size = data.get('size')
         
-        if saved_size == 0:
-            print("ERROR: File saved but is empty!")
-            return jsonify({'error': 'File save failed - empty file'}), 500
+        if not filename or not allowed_file(filename):
+            return jsonify({'error': 'Invalid file format. Only LAS/LAZ supported'}), 400
+        if not isinstance(size, int) or size <= 0:
+            return jsonify({'error': 'size must be a positive integer'}), 400
+        if size > MAX_FILE_SIZE:
+            return jsonify({'error': f'File too large. Max size: 30GB'}), 413
         
-        if saved_size != file_size:
-            print(f"WARNING: Size mismatch! Expected {file_size}, got {saved_size}")
+        PARTIAL_FOLDER.mkdir(exist_ok=True, parents=True)
+        upload_id = uuid.uuid4().hex
+        _, part_path = _upload_paths(upload_id)
         
-        # Generate output path
-        output_filename = f"{input_path.stem}_classified.las"
-        output_path = OUTPUT_FOLDER / output_filename
-        file_id = input_path.stem
+        # Sparse preallocation - every part lands at its final offset
+        with open(part_path, 'wb') as f:
+            f.truncate(size)
         
-        print(f"\nClassification details:")
-        print(f"   Input:  {input_path}")
-        print(f"   Output: {output_path}")
-        print(f"   File ID: {file_id}")
+        state = {'upload_id': upload_id, 'filename': filename, 'size': size,
+                 'ranges': [], 'created': time.time()}
+        _save_upload(state)
+        print(f"Resumable upload started: {upload_id} ({filename}, {size} bytes)")
         
-        # Start classification in background thread
-        print(f"\nStarting background classification thread...")
-        thread = threading.Thread(
-            target=_classify_file,
-            args=(str(input_path), str(output_path), file_id),
-            name=f"ClassifyThread-{file_id}"
-        )
-        thread.daemon = True
-        thread.start()
-        print(f"Thread started")
-        
-        response_data = {
-            'status': 'success',
-            'message': 'File uploaded and classification started',
-            'input_file': filename,
-            'output_file': output_filename,
-            'file_id': file_id,
-            'file_size_mb': round(file_size / 1024 / 1024, 2)
-        }
+        return jsonify(_upload_progress(state)), 201
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/api/uploads/<upload_id>', methods=['GET'])
+def get_upload(upload_id):
+    """Report received ranges so the client knows where to resume"""
+    state = _load_upload(upload_id)
+    if state is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    progress = _upload_progress(state)
+    response = jsonify(progress)
+    response.headers['Upload-Offset'] = str(progress['offset'])
+    return response, 200
+
+@api.route('/api/uploads/<upload_id>', methods=['PUT'])
+def put_upload_part(upload_id):
+    """Write one byte range of a resumable upload"""
+    try:
+        state = _load_upload(upload_id)
+        if state is None:
+            return jsonify({'error': 'Upload not found'}), 404
         
-        print(f"\nUPLOAD SUCCESSFUL")
-        print("="*70 + "\n")
+        # Content-Range: bytes <start>-<end>/<size>  (end inclusive)
+        content_range = request.headers.get('Content-Range', '')
+        try:
+            unit, spec = content_range.split(' ', 1)
+            span, total = spec.split('/', 1)
+            start, end = (int(v) for v in span.split('-', 1))
+            total = int(total)
+        except ValueError:
+            return jsonify({'error': 'Content-Range header required: bytes <start>-<end>/<size>'}), 400
+        
+        if unit != 'bytes' or total != state['size'] or not 0 <= start <= end < total:
+            return jsonify({'error': 'Content-Range does not match upload'}), 416
         
-        return jsonify(response_data), 200
+        expected = end - start + 1
+        hasher = hashlib.sha256() if request.headers.get('X-Content-SHA256') else None
+        _, part_path = _upload_paths(upload_id)
+        
+        # The whole write holds the shared lock: complete cannot finalize the part
+        # file under it, and once completed the state is gone and nothing is written
+        with _upload_lock(upload_id, shared=True):
+            if _load_upload(upload_id) is None:
+                return jsonify({'error': 'Upload already completed'}), 409
+            
+            # Stream the body at its offset in bounded blocks
+            written = 0
+            with open(part_path, 'r+b') as f:
+                f.seek(start)
+                while written < expected:
+                    block = request.stream.read(min(UPLOAD_BLOCK_SIZE, expected - written))
+                    if not block:
+                        break
+                    f.write(block)
+                    if hasher is not None:
+                        hasher.update(block)
+                    written += len(block)
+            
+            if hasher is not None and written == expected:
+                if hasher.hexdigest() != request.headers['X-Content-SHA256'].lower():
+                    return jsonify({'error': 'Checksum mismatch', 'offset': start}), 400
+            
+            # Only bytes that actually arrived count - a dropped connection resumes from here
+            with _upload_state_lock():
+                state = _load_upload(upload_id)
+                if written:
+                    state['ranges'] = _merge_ranges(state['ranges'], start, start + written)
+                _save_upload(state)
+        
+        progress = _upload_progress(state)
+        status = 200 if written == expected else 400
+        if status != 200:
+            progress['error'] = f'Incomplete part: received {written} of {expected} bytes'
+        response = jsonify(progress)
+        response.headers['Upload-Offset'] = str(progress['offset'])
+        return response, status
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/api/uploads/<upload_id>/complete', methods=['POST'])
+def complete_upload(upload_id):
+    """Finalize a resumable upload and start classification"""
+    try:
+        # Rejected before finalizing - the client can retry with valid options
+        try:
+            output_format, spatial_index = _upload_options()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        with _upload_lock(upload_id):
+            state = _load_upload(upload_id)
+            if state is None:
+                return jsonify({'error': 'Upload not found'}), 404
+            
+            progress = _upload_progress(state)
+            if not progress['complete']:
+                progress['error'] = 'Upload incomplete'
+                return jsonify(progress), 409
+            
+            state_path, part_path = _upload_paths(upload_id)
+            source_path = UPLOAD_FOLDER / f".upload-{upload_id}.part"
+            os.replace(part_path, source_path)
+            state_path.unlink()
+        
+        with _upload_locks_guard:
+            _upload_locks.pop(upload_id, None)
+        
+        # Parts arrive out of order - the content hash (cache key) needs one pass over the file
+        checksum = _file_checksum(source_path, UPLOAD_CHECKSUM) if UPLOAD_CHECKSUM else None
+        print(f"Resumable upload completed: {upload_id} -> {state['filename']}")
+        priority = request.args.get('priority', 0, type=int)
+        response_data, status = _start_classification(source_path, state['filename'], state['size'],
+                                                      checksum, priority, output_format,
+                                                      spatial_index)
+        return jsonify(response_data), status
     
     except Exception as e:
-        print(f"\nUPLOAD FAILED: {e}")
-        import traceback
-        traceback.print_exc()
-        print("="*70 + "\n")
         return jsonify({'error': str(e)}), 500
 
-def _classify_file(input_path, output_path, file_id):
-    """Background task to classify the file"""
+def _classify_file(input_path, output_path, file_id, cancel_event=None, progress_callback=None,
+                   cache_key=None, trace=None, spatial_index=SPATIAL_INDEX):
+    """Job body: classify the file, record the outcome in its status file and cache the result"""
+    from classifier_genius import GeniusStreamingClassifier, ClassificationCancelled
     try:
         print(f"\n{'='*70}")
         print(f"CLASSIFICATION THREAD STARTED: {file_id}")
@@ -177,8 +774,23 @@ def _classify_file(input_path, output_path, file_id):
         if input_size == 0:
             raise ValueError("Input file is empty!")
         
-        classifier = GeniusStreamingClassifier()
-        classifier.process_file_streaming(input_path, output_path)
+        classifier = GeniusStreamingClassifier(workers=CLASSIFIER_WORKERS, rules=classification_rules)
+        summary = classifier.process_file_streaming(input_path, output_path, chunk_size=CHUNK_SIZE,
+                                                    cancel_event=cancel_event,
+                                                    progress_callback=progress_callback,
+                                                    trace=trace,
+                                                    **_classifier_options(OUTPUT_FORMATS.get(
+                                                        Path(output_path).suffix, 'las'),
+                                                        spatial_index))
+        
+        # Histogram, timings, sizes and the download checksum for O(1) /api/stats and ETags
+        _write_job_meta(file_id, input_path, summary, checksum=DOWNLOAD_CHECKSUM, cache_key=cache_key)
+        
+        if cache_key is not None:
+            try:
+                _cache_result(file_id, cache_key, input_path)
+            except OSError as e:
+                print(f"WARNING: Could not cache result of {file_id}: {e}")
         
         # Save status
         status_file = OUTPUT_FOLDER / f"{file_id}_status.json"
@@ -187,32 +799,45 @@ def _classify_file(input_path, output_path, file_id):
         
         print(f"\nClassification completed for {file_id}")
         print(f"{'='*70}\n")
+    except ClassificationCancelled:
+        # Drop partial outputs of a cancelled job
+        for partial in _result_paths(file_id):
+            partial.unlink(missing_ok=True)
+        status_file = OUTPUT_FOLDER / f"{file_id}_status.json"
+        with open(status_file, 'w') as f:
+            json.dump({'status': 'cancelled', 'file_id': file_id}, f)
+        print(f"\nClassification cancelled for {file_id}")
+        print(f"{'='*70}\n")
+        raise
     except Exception as e:
         status_file = OUTPUT_FOLDER / f"{file_id}_status.json"
         with open(status_file, 'w') as f:
             json.dump({'status': 'error', 'file_id': file_id, 'error': str(e)}, f)
         print(f"\nClassification failed for {file_id}: {e}")
-        import traceback
-        traceback.print_exc()
         print(f"{'='*70}\n")
+        raise
 
-@app.route('/api/status/<file_id>', methods=['GET'])
+@api.route('/api/status/<file_id>', methods=['GET'])
 def get_status(file_id):
     """Get classification status"""
     try:
         status_file = OUTPUT_FOLDER / f"{file_id}_status.json"
-        output_path = OUTPUT_FOLDER / f"{file_id}_classified.las"
+        output_path = _output_path(file_id)
         
         if status_file.exists():
             with open(status_file) as f:
                 status_data = json.load(f)
             return jsonify(status_data), 200
         
-        if output_path.exists():
+        job = scheduler.get(file_id)
+        if job is not None:
+            return jsonify(_job_status(job)), 200
+        
+        if output_path is not None:
             return jsonify({
                 'status': 'completed',
                 'file_id': file_id,
-                'output_file': f"{file_id}_classified.las"
+                'output_file': output_path.name
             }), 200
         
         return jsonify({
@@ -223,11 +848,187 @@ def get_status(file_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/stats/<file_id>', methods=['GET'])
+def _job_status(job):
+    """Status payload for a scheduler job: state, queue position, live progress"""
+    status_data = {'status': job['state'], 'file_id': job['job_id']}
+    for key in ('queue_position', 'progress', 'stalled'):
+        if job.get(key) is not None:
+            status_data[key] = job[key]
+    return status_data
+
+def _final_status(file_id):
+    status_file = OUTPUT_FOLDER / f"{file_id}_status.json"
+    if status_file.exists():
+        with open(status_file) as f:
+            return json.load(f)
+    return None
+
+SSE_KEEPALIVE_SECONDS = 15
+
+@api.route('/api/events/<file_id>', methods=['GET'])
+def job_events(file_id):
+    """Server-Sent Events stream of job progress; ends with a final 'status' event"""
+    def sse(event, data):
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+    
+    def stream():
+        version = None
+        while True:
+            new_version, job = scheduler.wait_for_update(file_id, version, SSE_KEEPALIVE_SECONDS)
+            
+            if job is None or job['state'] not in ('queued', 'running'):
+                final = _final_status(file_id) or (
+                    _job_status(job) if job is not None
+                    else {'status': 'error', 'file_id': file_id, 'error': 'Job not found'}
+                )
+                yield sse('status', final)
+                return
+            
+            if new_version == version:
+                yield ": keepalive\n\n"
+            else:
+                yield sse('progress', _job_status(job))
+            version = new_version
+    
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@api.route('/api/jobs', methods=['GET'])
+def list_jobs():
+    """List known classification jobs"""
+    return jsonify({'jobs': scheduler.list()}), 200
+
+@api.route('/api/jobs/<file_id>/cancel', methods=['POST'])
+def cancel_job(file_id):
+    """Cancel a queued or running classification job"""
+    job = scheduler.cancel(file_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(scheduler.get(file_id)), 200
+
+@api.route('/api/jobs/<file_id>/trace', methods=['GET'])
+def get_job_trace(file_id):
+    """Trace of the job's last run (CPK_JOB_TRACES=1) - open in Perfetto / chrome://tracing"""
+    trace_path = _trace_path(file_id)
+    if not trace_path.exists():
+        return jsonify({'error': 'No trace for this job (CPK_JOB_TRACES=1 enables traces)'}), 404
+    return Response(trace_path.read_bytes(), mimetype='application/json')
+
+@api.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Prometheus text exposition: phase times, point/byte counters and chunk
+    latency histograms of the job runner, plus the current job counts
+    """
+    if isinstance(scheduler, JobScheduler):
+        text = REGISTRY.render()
+    else:
+        # Jobs run in another process - serve what it last published
+        try:
+            text = METRICS_PATH.read_text()
+        except FileNotFoundError:
+            text = ''
+    counts = dict.fromkeys(ACTIVE_STATES, 0)
+    for job in scheduler.list():
+        if job['state'] in counts:
+            counts[job['state']] += 1
+    text += render_samples('cpk_jobs', [({'state': state}, count) for state, count in counts.items()])
+    return Response(text, mimetype='text/plain; version=0.0.4')
+
+def _meta_path(file_id):
+    return OUTPUT_FOLDER / f"{file_id}_meta.json"
+
+def _trace_path(file_id):
+    return OUTPUT_FOLDER / f"{file_id}_trace.json"
+
+def _load_meta(file_id):
+    if not _meta_path(file_id).exists():
+        return None
+    with open(_meta_path(file_id)) as f:
+        return json.load(f)
+
+def _write_json(path, data):
+    """Atomic JSON write (tmp + replace) - readers never see a partial file"""
+    tmp_path = Path(f"{path}.tmp")
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+def _file_checksum(path, algorithm):
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        while block := f.read(DOWNLOAD_BLOCK_SIZE):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _write_job_meta(file_id, input_path, summary, checksum=None, cache_key=None):
+    """
+    Persist class histogram, timings and file sizes next to the outputs.
+    With checksum (e.g. 'sha256') the downloadable result is hashed once here;
+    the digest becomes its ETag for as long as size and mtime still match.
+    """
+    output_format = summary.get('output_format', 'las')
+    outputs = {}
+    for kind, path in summary.get('outputs', {}).items():
+        if path is None or not Path(path).exists():
+            continue
+        stat = Path(path).stat()
+        outputs[kind] = {'path': Path(path).name, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        if checksum and kind == output_format:
+            outputs[kind][checksum] = _file_checksum(path, checksum)
+    meta = {
+        'file_id': file_id,
+        'total_points': summary['total_points'],
+        'class_counts': {str(k): v for k, v in summary['class_counts'].items()},
+        'timings': summary.get('timings'),
+        'profile': summary.get('profile'),
+        'output_format': output_format,
+        'input_file': Path(input_path).name if input_path else None,
+        'input_size': Path(input_path).stat().st_size if input_path and Path(input_path).exists() else 0,
+        'outputs': outputs,
+        'cache_key': cache_key,
+        'created': time.time()
+    }
+    _write_json(_meta_path(file_id), meta)
+    return meta
+
+def _stream_class_histogram(las_path, chunk_size=10_000_000):
+    """
+    Class histogram of an existing LAS decoding only the classification field.
+    Uncompressed files are memory-mapped; LAZ falls back to chunked decoding,
+    a label delta is read as its label stream.
+    """
+    import laspy
+    import numpy as np
+    from label_delta import iter_labels
+    counts = np.zeros(256, dtype=np.int64)
+    if Path(las_path).suffix == OUTPUT_SUFFIXES['labels']:
+        for labels in iter_labels(las_path):
+            counts += np.bincount(labels, minlength=256)
+        return {int(c): int(counts[c]) for c in np.flatnonzero(counts)}
+    with laspy.open(las_path) as f:
+        header = f.header
+        if not header.are_points_compressed:
+            records = np.memmap(las_path, dtype=header.point_format.dtype(), mode='r',
+                                offset=header.offset_to_point_data, shape=(header.point_count,))
+            legacy = 'raw_classification' in records.dtype.names
+            field = records['raw_classification'] if legacy else records['classification']
+            for start in range(0, header.point_count, chunk_size):
+                values = field[start:start + chunk_size]
+                if legacy:
+                    values = values & 0x1F  # bits 0-4; 5-7 are synthetic/key-point/withheld
+                counts += np.bincount(values, minlength=256)
+            del records
+        else:
+            for chunk in f.chunk_iterator(chunk_size):
+                counts += np.bincount(np.asarray(chunk.classification, dtype=np.uint8), minlength=256)
+    return {int(c): int(counts[c]) for c in np.flatnonzero(counts)}
+
+@api.route('/api/stats/<file_id>', methods=['GET'])
 def get_stats(file_id):
     """Get classification statistics for completed file"""
     try:
-        output_path = OUTPUT_FOLDER / f"{file_id}_classified.las"
+        output_path = _output_path(file_id)
         status_file = OUTPUT_FOLDER / f"{file_id}_status.json"
         
         # Check if classification is still processing
@@ -237,90 +1038,52 @@ def get_stats(file_id):
             if status_data.get('status') == 'error':
                 return jsonify({'error': status_data.get('error')}), 400
         
-        if not output_path.exists():
+        if output_path is None:
             return jsonify({'error': 'File not found or still processing'}), 404
         
-        # Read the classified LAS file
-        print(f"Reading statistics from {output_path}")
-        
-        las = laspy.read(str(output_path))
-
-        print(f"LAS file loaded: {len(las.points)} points")
-        print(f"Has classification: {hasattr(las, 'classification')}")
-        print(f"Classification data: {las.classification}")
-        
-        # Get classification data
-        classifications = las.classification
-        total_points = len(classifications)
-        
-        # Class names mapping (ASPRS LAS 1.4 standard)
-        class_names = {
-            0: 'Never Classified',
-            1: 'Unclassified',
-            2: 'Ground',
-            3: 'Low Vegetation',
-            4: 'Medium Vegetation',
-            5: 'High Vegetation',
-            6: 'Building',
-            7: 'Low Point (noise)',
-            8: 'Model Key-point',
-            9: 'Water',
-            10: 'Rail',
-            11: 'Road Surface',
-            12: 'Reserved',
-            13: 'Wire - Guard (Shield)',
-            14: 'Wire - Conductor (Phase)',
-            15: 'Transmission Tower',
-            16: 'Wire - Structure Connector',
-            17: 'Bridge Deck',
-            18: 'High noise',
-            19: 'Overhead Structure',
-            20: 'Ignored Ground',
-            21: 'Snow',
-            22: 'Temporal Exclusion'
-        }
+        meta = _load_meta(file_id)
+        if meta is not None:
+            # Precomputed at job completion - no point I/O
+            if meta.get('cache_key'):
+                result_cache.touch(meta['cache_key'])
+        else:
+            # Older outputs: one streaming pass over the classification field, then cache it
+            print(f"No metadata for {file_id} - streaming class histogram from {output_path}")
+            class_counts = _stream_class_histogram(str(output_path))
+            input_path = next(UPLOAD_FOLDER.glob(f"{file_id}.la[sz]"), None)
+            meta = _write_job_meta(file_id, input_path, {
+                'total_points': sum(class_counts.values()),
+                'class_counts': class_counts,
+                'output_format': OUTPUT_FORMATS[output_path.suffix],
+                'outputs': {OUTPUT_FORMATS[output_path.suffix]: str(output_path)}
+            })
         
-        # Calculate statistics per class
-        class_stats = {}
-        for class_id in np.unique(classifications):
-            class_id = int(class_id)
-            count = np.sum(classifications == class_id)
-            percentage = (count / total_points) * 100
-            class_name = class_names.get(class_id, f'Class {class_id}')
-            
-            class_stats[class_id] = {
-                'name': class_name,
-                'count': int(count),
-                'percentage': round(percentage, 2)
+        total_points = meta['total_points']
+        classes = [
+            {
+                'id': int(class_id),
+                'name': classification_rules.class_names.get(int(class_id), f'Class {class_id}'),
+                'points': count,
+                'percentage': round(count / total_points * 100, 2) if total_points else 0.0
             }
-        
+            for class_id, count in meta['class_counts'].items()
+        ]
         # Sort by count descending
-        sorted_stats = sorted(class_stats.items(), key=lambda x: x[1]['count'], reverse=True)
-        
-        # Get file info
-        input_path = UPLOAD_FOLDER / f"{file_id}.las"
-        input_size = input_path.stat().st_size if input_path.exists() else 0
-        output_size = output_path.stat().st_size
+        classes.sort(key=lambda c: c['points'], reverse=True)
         
+        output_format = meta.get('output_format', 'las')
+        output_info = meta['outputs'].get(output_format, {})
         stats_response = {
             'file_id': file_id,
             'total_points': int(total_points),
-            'input_file_size_mb': round(input_size / 1024 / 1024, 2),
-            'output_file_size_mb': round(output_size / 1024 / 1024, 2),
-            'classes': [
-                {
-                    'id': class_id,
-                    'name': data['name'],
-                    'points': data['count'],
-                    'percentage': data['percentage']
-                }
-                for class_id, data in sorted_stats
-            ]
+            'input_file_size_mb': round(meta['input_size'] / 1024 / 1024, 2),
+            'output_format': output_format,
+            'output_file_size_mb': round(output_info.get('size', 0) / 1024 / 1024, 2),
+            'timings': meta.get('timings'),
+            'profile': meta.get('profile'),
+            'classes': classes
         }
-
-        print(stats_response)
         
-        print(f"Statistics calculated: {total_points} points in {len(sorted_stats)} classes")
         return jsonify(stats_response), 200
     
     except Exception as e:
@@ -329,24 +1092,262 @@ def get_stats(file_id):
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/download/<file_id>', methods=['GET'])
+def _output_validators(meta, file_path, stat):
+    """
+    (etag, checksum) of a result file. The checksum recorded at job completion
+    is trusted only while size and mtime match; otherwise (older outputs, no
+    checksum) the ETag falls back to the file identity and no checksum is sent.
+    """
+    if meta is not None:
+        for info in meta.get('outputs', {}).values():
+            checksum = info.get(DOWNLOAD_CHECKSUM) if DOWNLOAD_CHECKSUM else None
+            if (checksum and info['path'] == file_path.name and info['size'] == stat.st_size
+                    and info.get('mtime_ns') == stat.st_mtime_ns):
+                return f"{DOWNLOAD_CHECKSUM}-{checksum}", checksum
+    identity = f"{stat.st_ino}-{stat.st_size}-{stat.st_mtime_ns}"
+    return hashlib.sha1(identity.encode()).hexdigest(), None
+
+def _read_range(f, length):
+    """Fallback body for servers without wsgi.file_wrapper: length bytes in blocks"""
+    try:
+        while length > 0:
+            block = f.read(min(DOWNLOAD_BLOCK_SIZE, length))
+            if not block:
+                break
+            length -= len(block)
+            yield block
+    finally:
+        f.close()
+
+@api.route('/api/download/<file_id>', methods=['GET'])
 def download_file(file_id):
-    """Download classified file"""
+    """
+    Download classified file. Supports a single byte Range (resume / parallel
+    segments), If-Range and If-None-Match against a precomputed strong ETag.
+    The body is handed to the server's wsgi.file_wrapper positioned at the
+    range start with an exact Content-Length, so gunicorn & co. transfer it
+    with sendfile(2) without copying through Python.
+    """
     try:
-        file_path = OUTPUT_FOLDER / f"{file_id}_classified.las"
+        file_path = _output_path(file_id)
         
-        if not file_path.exists():
+        if file_path is None:
+            return jsonify({'error': 'File not found. Classification may still be in progress'}), 404
+        
+        stat = file_path.stat()
+        size = stat.st_size
+        meta = _load_meta(file_id)
+        etag, checksum = _output_validators(meta, file_path, stat)
+        if meta is not None and meta.get('cache_key'):
+            result_cache.touch(meta['cache_key'])
+        
+        def headers(response):
+            response.set_etag(etag)
+            response.last_modified = stat.st_mtime
+            response.headers['Accept-Ranges'] = 'bytes'
+            response.headers['Cache-Control'] = 'no-cache'
+            if checksum:
+                response.headers['X-Content-SHA256'] = checksum
+            return response
+        
+        if request.if_none_match.contains_weak(etag):
+            return headers(Response(status=304))
+        
+        start, length, status = 0, size, 200
+        byte_range = request.range
+        # A stale If-Range validator (or a date) means the client's copy changed - send it whole
+        if byte_range is not None and request.headers.get('If-Range', '').strip() not in ('', f'"{etag}"'):
+            byte_range = None
+        if byte_range is not None and len(byte_range.ranges) == 1:
+            bounds = byte_range.range_for_length(size)
+            if bounds is None:
+                response = headers(Response(status=416))
+                response.headers['Content-Range'] = f'bytes */{size}'
+                return response
+            start, stop = bounds
+            length, status = stop - start, 206
+        
+        f = open(file_path, 'rb')
+        f.seek(start)
+        file_wrapper = request.environ.get('wsgi.file_wrapper')
+        body = file_wrapper(f, DOWNLOAD_BLOCK_SIZE) if file_wrapper else _read_range(f, length)
+        
+        response = headers(Response(body, status=status, mimetype='application/octet-stream',
+                                    direct_passthrough=True))
+        response.content_length = length
+        response.headers.set('Content-Disposition', 'attachment', filename=file_path.name)
+        if status == 206:
+            response.headers['Content-Range'] = f'bytes {start}-{start + length - 1}/{size}'
+        return response
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def _index_path(file_id):
+    return OUTPUT_FOLDER / f"{file_id}_classified_index.json"
+
+def _parse_number_list(value, cast, name):
+    try:
+        return [cast(v) for v in value.split(',') if v.strip()]
+    except ValueError:
+        raise ValueError(f"Invalid {name}: {value!r}")
+
+@api.route('/api/points/<file_id>', methods=['GET'])
+def query_points_endpoint(file_id):
+    """
+    Points of a classified file inside ?bbox=min_x,min_y,max_x,max_y and/or of
+    ?classes=2,6 - reads only the matching tiles of the spatially sorted LAS.
+    """
+    import numpy as np
+    from spatial_index import query_points
+    try:
+        las_path = OUTPUT_FOLDER / f"{file_id}_classified.las"
+        index_path = _index_path(file_id)
+        if not las_path.exists():
             return jsonify({'error': 'File not found. Classification may still be in progress'}), 404
+        if not index_path.exists():
+            return jsonify({'error': 'No spatial index for this file'}), 404
+        
+        try:
+            bbox = None
+            if request.args.get('bbox'):
+                bbox = _parse_number_list(request.args['bbox'], float, 'bbox')
+                if len(bbox) != 4 or bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+                    raise ValueError("bbox must be min_x,min_y,max_x,max_y")
+            classes = None
+            if request.args.get('classes'):
+                classes = _parse_number_list(request.args['classes'], int, 'classes')
+            limit = request.args.get('limit', POINTS_QUERY_LIMIT, type=int)
+            if limit is None or not 0 < limit <= POINTS_QUERY_MAX_LIMIT:
+                raise ValueError(f"limit must be between 1 and {POINTS_QUERY_MAX_LIMIT}")
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        with open(index_path) as f:
+            index = json.load(f)
+        points, truncated = query_points(str(las_path), index, bbox=bbox, classes=classes, limit=limit)
         
-        return send_file(str(file_path), as_attachment=True, download_name=f"{file_id}_classified.las")
+        columns = [np.asarray(points.x), np.asarray(points.y), np.asarray(points.z),
+                   np.asarray(points.classification)]
+        return jsonify({
+            'file_id': file_id,
+            'count': len(points),
+            'truncated': truncated,
+            'fields': ['x', 'y', 'z', 'classification'],
+            'points': np.column_stack(columns).tolist() if len(points) else [],
+        }), 200
     
     except Exception as e:
+        print(f"Points query error: {e}")
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/health', methods=['GET'])
+def _preview_paths(file_id):
+    """(metadata, data) of the LOD preview"""
+    return (OUTPUT_FOLDER / f"{file_id}_classified_preview.json",
+            OUTPUT_FOLDER / f"{file_id}_classified_preview.bin")
+
+@api.route('/api/preview/<file_id>', methods=['GET'])
+def get_preview(file_id):
+    """Preview metadata: LOD level sizes, record layout, dequantization and class palette"""
+    meta_path, data_path = _preview_paths(file_id)
+    if not meta_path.exists() or not data_path.exists():
+        return jsonify({'error': 'Preview not found. Classification may still be in progress'}), 404
+    
+    with open(meta_path) as f:
+        meta = json.load(f)
+    meta.pop('data_file', None)
+    meta['file_id'] = file_id
+    meta['data_url'] = f"/api/preview/{file_id}/data"
+    return jsonify(meta), 200
+
+@api.route('/api/preview/<file_id>/data', methods=['GET'])
+def get_preview_data(file_id):
+    """
+    Binary preview records. ?level=k returns the first levels[k] records -
+    every prefix is a uniform sample, so clients load coarse levels first.
+    """
+    meta_path, data_path = _preview_paths(file_id)
+    if not meta_path.exists() or not data_path.exists():
+        return jsonify({'error': 'Preview not found. Classification may still be in progress'}), 404
+    
+    with open(meta_path) as f:
+        meta = json.load(f)
+    levels = meta['levels']
+    # An empty input has no levels - level 0 is then the empty payload
+    last_level = max(0, len(levels) - 1)
+    level = request.args.get('level', last_level, type=int)
+    if level is None or not 0 <= level <= last_level:
+        return jsonify({'error': f"level must be between 0 and {last_level}"}), 400
+    
+    count = levels[level] if levels else 0
+    with open(data_path, 'rb') as f:
+        payload = f.read(count * meta['record']['size'])
+    
+    response = Response(payload, mimetype='application/octet-stream')
+    response.headers['X-Point-Count'] = str(count)
+    response.headers['Cache-Control'] = 'private, max-age=3600'
+    return response
+
+@api.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
     return jsonify({'status': 'healthy', 'service': 'CPK Cloud Classifier'}), 200
 
+def create_app(job_runner=None):
+    """
+    Application factory (gunicorn: 'server:create_app()'). Startup creates the
+    data folders and sets up the jobs - no folder scans, nothing is deleted.
+    job_runner defaults to JOB_RUNNER ('thread' / 'external').
+    """
+    _init_storage()
+    _init_jobs(job_runner or JOB_RUNNER)
+    
+    app = Flask(__name__)
+    app.request_class = UploadRequest
+    CORS(app)
+    app.register_blueprint(api)
+    return app
+
+def run_worker():
+    """
+    Classification process of the production setup: runs the queued jobs
+    (also those recovered after a restart) and serves no requests
+    """
+    runner = _job_scheduler()
+    if not runner.claim():
+        raise SystemExit(f"Another process already runs the jobs in {JOBS_FOLDER}")
+    global scheduler
+    scheduler = runner
+    _init_storage()
+    scheduler.recover()
+    scheduler.start()
+    print(f"Classification worker: up to {MAX_CONCURRENT_JOBS} jobs from {JOBS_FOLDER}")
+    try:
+        scheduler.join()
+    except KeyboardInterrupt:
+        # Running jobs stay 'running' on disk and are re-queued by the next worker
+        print("Worker stopped")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="CPK point cloud classifier API")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--debug', action='store_true', help="Flask debugger (no reloader)")
+    parser.add_argument('--worker', action='store_true',
+                        help="only run classification jobs queued by CPK_JOB_RUNNER=external servers")
+    parser.add_argument('--cleanup', action='store_true',
+                        help="evict the result cache and remove orphaned uploads/outputs, then exit")
+    args = parser.parse_args(argv)
+    
+    if args.worker:
+        run_worker()
+    elif args.cleanup:
+        _init_storage()
+        _init_jobs('external')
+        cleanup_folders()
+    else:
+        # The reloader would run a second copy of the process - and of the jobs
+        create_app().run(debug=args.debug, use_reloader=False, host=args.host, port=args.port)
+
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    main()
\ No newline at end of file
@@ -0,0 +1,208 @@
+"""
+Indeks przestrzenny wyniku - LAS posortowany kaflami + sidecar JSON.
+
+Klasyfikacja zapisuje punkty w kolejności wejścia, więc zapytanie "punkty
+w bbox / klasy X" musiało czytać cały plik. W trybie indeksu rekordy
+chunków są rozrzucane do plików kafli (spool na dysku, stała pamięć),
+a na końcu składane w kolejności krzywej Mortona (Z-order) po (tx, ty).
+Sidecar mapuje kafel → zakres punktów, bbox i histogram klas, więc
+zapytanie czyta przez memmap tylko pasujące zakresy.
+"""
+
+import json
+import os
+import shutil
+import numpy as np
+import laspy
+
+from pathlib import Path
+
+INDEX_TILE_SIZE = 100.0
+INDEX_VERSION = 1
+
+# Ile rekordów trzymamy w buforach spoola przed zrzutem na dysk
+BUFFER_POINTS = 4_000_000
+
+
+def morton_code(tx, ty):
+    """Przeplot bitów (tx, ty) - sąsiednie kafle lądują blisko w pliku"""
+    def spread(v):
+        v = np.asarray(v, dtype=np.uint64) & np.uint64(0xFFFFFFFF)
+        v = (v | (v << np.uint64(16))) & np.uint64(0x0000FFFF0000FFFF)
+        v = (v | (v << np.uint64(8))) & np.uint64(0x00FF00FF00FF00FF)
+        v = (v | (v << np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+        v = (v | (v << np.uint64(2))) & np.uint64(0x3333333333333333)
+        v = (v | (v << np.uint64(1))) & np.uint64(0x5555555555555555)
+        return v
+    return spread(tx) | (spread(ty) << np.uint64(1))
+
+
+class TileSpool:
+    """
+    Surowe rekordy punktów (po klasyfikacji) rozrzucone na pliki kafli.
+    Dla każdego kafla zbiera liczność, bbox i histogram klas.
+    """
+
+    def __init__(self, spool_dir, point_format, x0, y0, tile_size=INDEX_TILE_SIZE):
+        self.spool_dir = Path(spool_dir)
+        self.spool_dir.mkdir(parents=True, exist_ok=True)
+        self.point_format = point_format
+        self.x0, self.y0 = float(x0), float(y0)
+        self.tile_size = float(tile_size)
+        self.tiles = {}  # (tx, ty) -> {'count', 'mins', 'maxs', 'classes'}
+        self._buffers = {}
+        self._buffered = 0
+
+    def tile_path(self, key):
+        return self.spool_dir / f"tile_{key[0]}_{key[1]}.bin"
+
+    def add(self, chunk, labels):
+        """Rekordy chunka (chunk.array) z już ustawioną klasyfikacją"""
+        x, y, z = (np.asarray(c, dtype=np.float64) for c in (chunk.x, chunk.y, chunk.z))
+        tx = np.maximum(np.floor((x - self.x0) / self.tile_size), 0).astype(np.int64)
+        ty = np.maximum(np.floor((y - self.y0) / self.tile_size), 0).astype(np.int64)
+        keys = (ty << 32) | tx
+
+        order = np.argsort(keys, kind='stable')
+        bounds = np.flatnonzero(np.diff(keys[order])) + 1
+        records = chunk.array
+        for part in np.split(order, bounds):
+            key = (int(tx[part[0]]), int(ty[part[0]]))
+            rec = records[part]
+            self._buffers.setdefault(key, []).append(rec)
+            self._buffered += len(rec)
+
+            xyz = np.column_stack([x[part], y[part], z[part]])
+            info = self.tiles.get(key)
+            if info is None:
+                info = self.tiles[key] = {
+                    'count': 0, 'mins': xyz.min(axis=0), 'maxs': xyz.max(axis=0),
+                    'classes': np.zeros(256, dtype=np.int64),
+                }
+            else:
+                info['mins'] = np.minimum(info['mins'], xyz.min(axis=0))
+                info['maxs'] = np.maximum(info['maxs'], xyz.max(axis=0))
+            info['count'] += len(rec)
+            info['classes'] += np.bincount(labels[part], minlength=256)
+
+        if self._buffered >= BUFFER_POINTS:
+            self.flush()
+
+    def flush(self):
+        for key, parts in self._buffers.items():
+            with open(self.tile_path(key), 'ab') as f:
+                for rec in parts:
+                    f.write(rec)
+        self._buffers.clear()
+        self._buffered = 0
+
+    def write_sorted(self, writer, callback=None):
+        """
+        Zapisuje kafle do otwartego laspy writera w kolejności Mortona.
+        Zwraca listę wpisów indeksu (start/count w punktach).
+        callback(points_done) wołany po każdym kaflu.
+        """
+        self.flush()
+        keys = sorted(self.tiles, key=lambda k: int(morton_code(k[0], k[1])))
+        dtype = self.point_format.dtype()
+        entries = []
+        start = 0
+        for key in keys:
+            info = self.tiles[key]
+            path = self.tile_path(key)
+            records = np.fromfile(path, dtype=dtype)
+            writer.write_points(laspy.PackedPointRecord(records, self.point_format))
+            os.remove(path)
+            entries.append({
+                'tile': list(key),
+                'start': start,
+                'count': info['count'],
+                'mins': info['mins'].tolist(),
+                'maxs': info['maxs'].tolist(),
+                'classes': {int(c): int(info['classes'][c])
+                            for c in np.flatnonzero(info['classes'])},
+            })
+            start += info['count']
+            if callback is not None:
+                callback(start)
+        return entries
+
+    def discard(self):
+        self._buffers.clear()
+        shutil.rmtree(self.spool_dir, ignore_errors=True)
+
+
+def write_index(index_path, las_path, tile_size, x0, y0, entries):
+    """Sidecar indeksu - offset danych i rozmiar rekordu czytane z gotowego LAS"""
+    with laspy.open(las_path) as f:
+        header = f.header
+        if header.are_points_compressed:
+            return None  # zakresy bajtów mają sens tylko dla nieskompresowanego LAS
+        index = {
+            'version': INDEX_VERSION,
+            'order': 'morton',
+            'tile_size': float(tile_size),
+            'origin': [float(x0), float(y0)],
+            'point_count': int(header.point_count),
+            'point_format': int(header.point_format.id),
+            'point_size': int(header.point_format.size),
+            'offset_to_point_data': int(header.offset_to_point_data),
+            'scales': header.scales.tolist(),
+            'offsets': header.offsets.tolist(),
+            'tiles': entries,
+        }
+    tmp_path = Path(f"{index_path}.tmp")
+    with open(tmp_path, 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp_path, index_path)
+    return index
+
+
+def query_points(las_path, index, bbox=None, classes=None, limit=None):
+    """
+    Punkty w bbox (min_x, min_y, max_x, max_y) i/lub z podanych klas.
+    Czyta przez memmap tylko zakresy kafli, których bbox i histogram
+    pasują do zapytania. Zwraca (ScaleAwarePointRecord, truncated).
+    """
+    with laspy.open(las_path) as f:
+        point_format = f.header.point_format
+    dtype = point_format.dtype()
+    data = np.memmap(las_path, dtype=dtype, mode='r',
+                     offset=index['offset_to_point_data'], shape=(index['point_count'],))
+    scales = np.asarray(index['scales'])
+    offsets = np.asarray(index['offsets'])
+    wanted = set(classes) if classes else None
+
+    parts = []
+    total = 0
+    truncated = False
+    for entry in index['tiles']:
+        if bbox is not None:
+            mins, maxs = entry['mins'], entry['maxs']
+            if maxs[0] < bbox[0] or mins[0] > bbox[2] or maxs[1] < bbox[1] or mins[1] > bbox[3]:
+                continue
+        if wanted is not None and not wanted & {int(c) for c in entry['classes']}:
+            continue
+
+        tile = laspy.ScaleAwarePointRecord(
+            np.array(data[entry['start']:entry['start'] + entry['count']]),
+            point_format, scales, offsets
+        )
+        mask = np.ones(len(tile), dtype=bool)
+        if bbox is not None:
+            x, y = np.asarray(tile.x), np.asarray(tile.y)
+            mask &= (x >= bbox[0]) & (x <= bbox[2]) & (y >= bbox[1]) & (y <= bbox[3])
+        if wanted is not None:
+            mask &= np.isin(np.asarray(tile.classification), list(wanted))
+
+        selected = tile.array[mask]
+        if limit is not None and total + len(selected) > limit:
+            selected = selected[:limit - total]
+            truncated = True
+        parts.append(selected)
+        total += len(selected)
+        if truncated:
+            break
+
+    records = np.concatenate(parts) if parts else np.empty(0, dtype=dtype)
+    return laspy.ScaleAwarePointRecord(records, point_format, scales, offsets), truncated
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Moduły backendu są płaskie (import classifier_genius, rules...) - jak w server.py
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
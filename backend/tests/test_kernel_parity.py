@@ -0,0 +1,184 @@
+"""
+Kernel numby i ClassificationWorkspace (numpy) dają identyczne etykiety.
+
+Losowe punkty (pełne zakresy kolorów i intensywności, wysokości także poza
+zakresem pliku) plus punkty dokładnie na progach reguł i o jedną jednostkę
+surową obok - tam różnica kolejności działań albo precyzji (float32/float64)
+zmieniłaby klasę. Oba tryby terenu: globalne z_min i grid (z pustymi
+komórkami i punktami poza zasięgiem gridu).
+
+Reguły wbudowane (load_rules(None)) muszą dawać etykiety klasyfikatora
+sprzed tabeli reguł (_legacy_labels), własna tabela idzie z pliku JSON.
+"""
+
+import json
+
+import numpy as np
+import pytest
+
+pytest.importorskip('numba')
+
+from classifier_kernels import ClassificationWorkspace, classify_points_numba
+from ground_model import GroundGrid
+from rules import load_rules
+
+SCALE = 65535
+Z_SCALE, Z_OFFSET = 0.01, 100.0
+X_SCALE, X_OFFSET = 0.01, 500_000.0
+Y_SCALE, Y_OFFSET = 0.01, 250_000.0
+Z_MIN, Z_RANGE = 100.0, 40.0
+CELL, NX, NY = 2.0, 50, 40
+N_RANDOM = 200_000
+PER_THRESHOLD = 200
+
+# Tabela JSON z pozostałymi operatorami i samym 'any' - poza tabelą wbudowaną
+CUSTOM_RULES = {
+    'classes': {
+        '1': {'name': 'Unclassified', 'color': [200, 200, 200]},
+        '2': {'name': 'Ground', 'color': [0, 0, 0]},
+        '6': {'name': 'Building', 'color': [0, 0, 0]},
+        '9': {'name': 'Water', 'color': [0, 0, 0]},
+    },
+    'rules': [
+        {'name': 'low_dark', 'class': 2, 'when': [['height', '<=', 0.5], ['brightness', '<=', 0.2]]},
+        {'name': 'reddish', 'class': 6, 'any': [['redness', '>=', 0.1], ['blueness', '>=', 0.1]]},
+        {'name': 'bright', 'class': 9, 'when': [['z_rel', '>=', 0.25], ['intensity', '>', 0.5]]},
+    ],
+    'default': 1,
+}
+
+
+def _load_rules(name, tmp_path):
+    if name == 'default':
+        return load_rules(None)
+    path = tmp_path / 'rules.json'
+    path.write_text(json.dumps(CUSTOM_RULES))
+    return load_rules(path)
+
+
+def _legacy_labels(z, intensity, red, green, blue, z_min, z_range, ground=None, xy=None):
+    """
+    Klasyfikator sprzed tabeli reguł: progi i priorytety zapisane wprost,
+    z_rel w float64, kolory w float32 - wzorzec dla reguł wbudowanych.
+    """
+    z_rel = z * Z_SCALE + Z_OFFSET
+    z_rel -= z_min if ground is None else ground.heights(*xy)
+    z_rel /= z_range + 1e-6
+    f32 = np.float32
+    i, r, g, b = (np.asarray(c, dtype=np.float32) / f32(65535.0)
+                  for c in (intensity, red, green, blue))
+    gr = g - (r + b) / f32(2.0)
+    br = (r + g + b) / f32(3.0)
+    rd = r - (g + b) / f32(2.0)
+
+    veg = gr > f32(0.08)
+    rules = [
+        (2, (z_rel < 0.03) & (gr < f32(0.08)) & (br > f32(0.15))),
+        (9, (z_rel < 0.02) & (br < f32(0.12))),
+        (3, veg & (z_rel < 0.15)),
+        (4, veg & (z_rel >= 0.15) & (z_rel < 0.40)),
+        (5, veg & (z_rel >= 0.40)),
+        (17, (z_rel < 0.05) & (br < f32(0.35)) & (i > f32(0.45))),
+        (13, (z_rel > 0.10) & (z_rel < 0.35) & (br > f32(0.35)) & (gr < f32(0.05))),
+        (6, (z_rel > 0.40) & (br > f32(0.30)) & (gr < f32(0.08))),
+        (18, (z_rel > 0.03) & (z_rel < 0.12) & (br > f32(0.35)) & (br < f32(0.55))),
+        (14, (z_rel < 0.08) & (i > f32(0.65)) & (br < f32(0.35))),
+        (15, z_rel > 0.70),
+        (11, (z_rel > 0.15) & (z_rel < 0.30) & (i > f32(0.40)) & (gr < f32(0.05))),
+        (16, (z_rel > 0.10) & (z_rel < 0.25) & ((rd > f32(0.15)) | (br > f32(0.60)))),
+    ]
+    # np.select bierze pierwszy spełniony warunek - priorytet jak kolejność reguł
+    return np.select([cond for _, cond in rules], [label for label, _ in rules],
+                     default=1).astype(np.uint8)
+
+
+def _ground_grid(rng):
+    # Teren w jednostkach skali Z - punkty trafiają na progi dokładnie, jak przy z_min
+    ground = Z_MIN + rng.integers(0, 500, (NY, NX)) * Z_SCALE
+    ground[rng.random((NY, NX)) < 0.05] = np.inf  # komórki bez punktów
+    return GroundGrid(ground, X_OFFSET, Y_OFFSET, CELL, Z_RANGE)
+
+
+def _points(rng, program, grid):
+    """Surowe kolumny LAS: losowe + na progach każdego warunku programu (±1 jednostka)"""
+    n = N_RANDOM + len(program.atoms) * 3 * PER_THRESHOLD
+    # X/Y także poza gridem - przycięcie komórki
+    x = rng.integers(-2_000, int(NX * CELL / X_SCALE) + 2_000, n).astype(np.int32)
+    y = rng.integers(-2_000, int(NY * CELL / Y_SCALE) + 2_000, n).astype(np.int32)
+    z = rng.integers(int((Z_MIN - 5 - Z_OFFSET) / Z_SCALE),
+                     int((Z_MIN + Z_RANGE + 5 - Z_OFFSET) / Z_SCALE), n).astype(np.int32)
+    columns = {name: rng.integers(0, SCALE + 1, n).astype(np.uint16)
+               for name in ('intensity', 'red', 'green', 'blue')}
+
+    start = N_RANDOM
+    for feature, _, threshold in program.atoms:
+        for delta in (-1, 0, 1):
+            s = slice(start, start + PER_THRESHOLD)
+            start += PER_THRESHOLD
+            value = int(round(threshold * SCALE)) + delta
+            if feature in ('intensity', 'red', 'green', 'blue'):
+                columns[feature][s] = np.clip(value, 0, SCALE)
+            elif feature == 'brightness':
+                for channel in ('red', 'green', 'blue'):
+                    columns[channel][s] = np.clip(value, 0, SCALE)
+            elif feature in ('greenness', 'redness', 'blueness'):
+                main = feature.replace('ness', '')
+                for channel in ('red', 'green', 'blue'):
+                    columns[channel][s] = np.clip(value, 0, SCALE) if channel == main else 0
+            else:
+                # height / z_rel: wysokość nad terenem (grid) albo nad Z_MIN
+                height = threshold * (Z_RANGE + 1e-6) if feature == 'z_rel' else threshold
+                base = Z_MIN
+                if grid is not None:
+                    ix = np.clip(np.floor((x[s] * X_SCALE) / CELL), 0, NX - 1).astype(int)
+                    iy = np.clip(np.floor((y[s] * Y_SCALE) / CELL), 0, NY - 1).astype(int)
+                    base = grid.ground[iy, ix]
+                    base = np.where(np.isfinite(base), base, Z_MIN)
+                raw = np.round((base + height - Z_OFFSET) / Z_SCALE).astype(np.int64) + delta
+                z[s] = raw.astype(np.int32)
+    return z, columns, x, y
+
+
+def _inputs(ruleset, ground_model):
+    rng = np.random.default_rng(20)
+    program = ruleset.compile()
+    grid = _ground_grid(rng) if ground_model == 'grid' else None
+    z, columns, x, y = _points(rng, program, grid)
+    xy = (x, y, X_SCALE, X_OFFSET, Y_SCALE, Y_OFFSET) if grid is not None else None
+    args = (z, columns['intensity'], columns['red'], columns['green'], columns['blue'],
+            Z_MIN, Z_RANGE)
+    kwargs = dict(z_scale=Z_SCALE, z_offset=Z_OFFSET, ground=grid, xy=xy, program=program)
+    return args, kwargs
+
+
+def _assert_same(labels, expected, what):
+    mismatches = np.flatnonzero(labels != expected)
+    assert mismatches.size == 0, (
+        f"{mismatches.size} labels differ ({what}), first at {mismatches[:10]}: "
+        f"{labels[mismatches[:10]]} vs expected {expected[mismatches[:10]]}"
+    )
+
+
+@pytest.mark.parametrize('rules_name', ['default', 'custom'])
+@pytest.mark.parametrize('ground_model', ['global', 'grid'])
+def test_numba_matches_numpy(rules_name, ground_model, tmp_path):
+    args, kwargs = _inputs(_load_rules(rules_name, tmp_path), ground_model)
+
+    expected = ClassificationWorkspace(len(args[0])).classify(*args, **kwargs)
+    for parallel in (True, False):
+        labels = classify_points_numba(*args, parallel=parallel, **kwargs)
+        _assert_same(labels, expected, f"numba parallel={parallel} vs numpy")
+    # Test ma sens tylko, gdy reguły faktycznie rozróżniają punkty
+    assert len(np.unique(expected)) > 2
+
+
+@pytest.mark.parametrize('ground_model', ['global', 'grid'])
+def test_default_rules_match_legacy_classifier(ground_model, tmp_path):
+    args, kwargs = _inputs(_load_rules('default', tmp_path), ground_model)
+
+    expected = _legacy_labels(*args, ground=kwargs['ground'], xy=kwargs['xy'])
+    _assert_same(ClassificationWorkspace(len(args[0])).classify(*args, **kwargs), expected,
+                 "numpy vs legacy")
+    _assert_same(classify_points_numba(*args, **kwargs), expected, "numba vs legacy")
+    # Wszystkie klasy z reguł wbudowanych występują - każda reguła jest sprawdzona
+    assert set(np.unique(expected)) == {1, 2, 3, 4, 5, 6, 9, 11, 13, 14, 15, 16, 17, 18}
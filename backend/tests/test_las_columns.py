@@ -0,0 +1,100 @@
+"""
+Zapis etykiet w miejscu (LasColumns.write_classification) daje ten sam plik
+co przepisanie przez laspy.
+
+Formaty 1 (klasa w bitach 0-4, flagi synthetic/key_point/withheld w 5-7)
+i 6 (osobny bajt klasyfikacji i bajt flag). Kopia wejścia dostaje etykiety
+kilkoma chunkami; poza bajtem klasyfikacji żaden bajt pliku się nie zmienia,
+a rekordy punktów są identyczne z rekordami z laspy.
+"""
+
+import numpy as np
+import pytest
+
+import laspy
+
+from las_columns import LasColumns, copy_file
+
+N_POINTS = 10_000
+CHUNK = 3_000  # ostatni chunk niepełny
+
+
+def _write_input(path, point_format, rng):
+    header = laspy.LasHeader(point_format=point_format,
+                             version='1.4' if point_format >= 6 else '1.2')
+    header.scales = np.array([0.01, 0.01, 0.01])
+    header.offsets = np.array([500_000.0, 250_000.0, 0.0])
+    las = laspy.LasData(header)
+    las.X = rng.integers(0, 100_000, N_POINTS, dtype=np.int32)
+    las.Y = rng.integers(0, 100_000, N_POINTS, dtype=np.int32)
+    las.Z = rng.integers(0, 10_000, N_POINTS, dtype=np.int32)
+    las.intensity = rng.integers(0, 65536, N_POINTS, dtype=np.uint16)
+    las.classification = rng.integers(0, 32, N_POINTS, dtype=np.uint8)
+    las.gps_time = rng.random(N_POINTS) * 1e6
+    # Flagi dzielące bajt z klasą w formatach 0-5 - po zapisie mają zostać
+    for flag in ('synthetic', 'key_point', 'withheld'):
+        setattr(las, flag, rng.random(N_POINTS) < 0.5)
+    if point_format >= 6:
+        las.overlap = rng.random(N_POINTS) < 0.5
+    las.write(path)
+
+
+def _point_bytes(path):
+    """Rekordy punktów pliku jako macierz bajtów (punkt × bajt rekordu)"""
+    with laspy.open(path) as f:
+        offset = f.header.offset_to_point_data
+        size = f.header.point_format.size
+        count = f.header.point_count
+    data = np.fromfile(path, dtype=np.uint8)
+    return data[:offset], data[offset:offset + count * size].reshape(count, size)
+
+
+@pytest.mark.parametrize('point_format', [1, 6])
+def test_write_classification_matches_laspy(tmp_path, point_format):
+    rng = np.random.default_rng(point_format)
+    source = tmp_path / 'input.las'
+    _write_input(source, point_format, rng)
+    max_class = 31 if point_format < 6 else 255
+    labels = rng.integers(0, max_class + 1, N_POINTS, dtype=np.uint8)
+
+    in_place = tmp_path / 'in_place.las'
+    copy_file(source, in_place)
+    with LasColumns(in_place, mode='r+') as f:
+        for start in range(0, N_POINTS, CHUNK):
+            f.write_classification(start, labels[start:start + CHUNK])
+
+    rewritten = tmp_path / 'laspy.las'
+    las = laspy.read(source)
+    las.classification = labels
+    las.write(rewritten)
+
+    result, original = laspy.read(in_place), laspy.read(source)
+    np.testing.assert_array_equal(np.asarray(result.classification), labels)
+    for flag in ('synthetic', 'key_point', 'withheld') + (('overlap',) if point_format >= 6 else ()):
+        np.testing.assert_array_equal(np.asarray(getattr(result, flag)),
+                                      np.asarray(getattr(original, flag)), err_msg=flag)
+
+    # Rekordy bajt w bajt jak po przepisaniu przez laspy
+    header, records = _point_bytes(in_place)
+    _, expected_records = _point_bytes(rewritten)
+    np.testing.assert_array_equal(records, expected_records)
+
+    # Względem wejścia zmienia się tylko bajt klasyfikacji, nagłówek i VLR bez zmian
+    source_header, source_records = _point_bytes(source)
+    assert header.tobytes() == source_header.tobytes()
+    assert in_place.stat().st_size == source.stat().st_size
+    name = 'classification' if point_format >= 6 else 'raw_classification'
+    class_byte = las.point_format.dtype().fields[name][1]
+    changed = np.flatnonzero((records != source_records).any(axis=0))
+    assert set(changed) <= {class_byte}
+
+
+def test_write_classification_rejects_classes_above_31_in_legacy_formats(tmp_path):
+    rng = np.random.default_rng(0)
+    source = tmp_path / 'input.las'
+    _write_input(source, 1, rng)
+    before = source.read_bytes()
+    with LasColumns(source, mode='r+') as f:
+        with pytest.raises(ValueError, match='0-31'):
+            f.write_classification(0, np.full(10, 32, dtype=np.uint8))
+    assert source.read_bytes() == before
@@ -0,0 +1,143 @@
+"""
+HTTP API przez klienta testowego Flaska - foldery danych w tmp_path,
+zadania tylko kolejkowane (job_runner='external'), bez klasyfikacji.
+"""
+
+import numpy as np
+import pytest
+
+import server
+from preview import PreviewSampler
+
+RESULT = bytes(range(256)) * 40  # 10240 B
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    for name in ('UPLOAD_FOLDER', 'OUTPUT_FOLDER', 'JOBS_FOLDER', 'CACHE_FOLDER'):
+        monkeypatch.setattr(server, name, tmp_path / name.split('_')[0].lower())
+    monkeypatch.setattr(server, 'scheduler', None)
+    monkeypatch.setattr(server, 'result_cache', None)
+    app = server.create_app(job_runner='external')
+    return app.test_client()
+
+
+@pytest.fixture
+def result_id():
+    file_id = 'tile-0123456789ab'
+    (server.OUTPUT_FOLDER / f"{file_id}_classified.las").write_bytes(RESULT)
+    return file_id
+
+
+def test_download_whole_file(client, result_id):
+    response = client.get(f'/api/download/{result_id}')
+    assert response.status_code == 200
+    assert response.data == RESULT
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    assert response.headers['Content-Length'] == str(len(RESULT))
+    assert response.headers['ETag']
+
+
+def test_head_sends_headers_only(client, result_id):
+    response = client.head(f'/api/download/{result_id}')
+    assert response.status_code == 200
+    assert response.data == b''
+    assert response.headers['Content-Length'] == str(len(RESULT))
+
+
+def test_single_range(client, result_id):
+    response = client.get(f'/api/download/{result_id}', headers={'Range': 'bytes=100-299'})
+    assert response.status_code == 206
+    assert response.data == RESULT[100:300]
+    assert response.headers['Content-Range'] == f'bytes 100-299/{len(RESULT)}'
+    assert response.headers['Content-Length'] == '200'
+
+
+def test_open_ended_range_stops_at_the_end(client, result_id):
+    response = client.get(f'/api/download/{result_id}', headers={'Range': 'bytes=10000-'})
+    assert response.status_code == 206
+    assert response.data == RESULT[10000:]
+    assert response.headers['Content-Range'] == f'bytes 10000-{len(RESULT) - 1}/{len(RESULT)}'
+
+
+def test_suffix_range(client, result_id):
+    response = client.get(f'/api/download/{result_id}', headers={'Range': 'bytes=-500'})
+    assert response.status_code == 206
+    assert response.data == RESULT[-500:]
+    assert response.headers['Content-Range'] == (
+        f'bytes {len(RESULT) - 500}-{len(RESULT) - 1}/{len(RESULT)}'
+    )
+
+
+def test_unsatisfiable_range(client, result_id):
+    response = client.get(f'/api/download/{result_id}',
+                          headers={'Range': f'bytes={len(RESULT)}-{len(RESULT) + 10}'})
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == f'bytes */{len(RESULT)}'
+    assert response.data == b''
+
+
+def test_if_range_with_current_etag_sends_the_range(client, result_id):
+    etag = client.head(f'/api/download/{result_id}').headers['ETag']
+    response = client.get(f'/api/download/{result_id}',
+                          headers={'Range': 'bytes=0-9', 'If-Range': etag})
+    assert response.status_code == 206
+    assert response.data == RESULT[:10]
+
+
+def test_stale_if_range_sends_the_whole_file(client, result_id):
+    for validator in ('"stale-etag"', 'Wed, 21 Oct 2015 07:28:00 GMT'):
+        response = client.get(f'/api/download/{result_id}',
+                              headers={'Range': 'bytes=0-9', 'If-Range': validator})
+        assert response.status_code == 200, validator
+        assert response.data == RESULT
+        assert 'Content-Range' not in response.headers
+
+
+def test_if_none_match_returns_304(client, result_id):
+    etag = client.head(f'/api/download/{result_id}').headers['ETag']
+    response = client.get(f'/api/download/{result_id}', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+    assert response.headers['ETag'] == etag
+
+    response = client.get(f'/api/download/{result_id}', headers={'If-None-Match': '"other"'})
+    assert response.status_code == 200
+    assert response.data == RESULT
+
+
+def test_download_missing_result(client):
+    assert client.get('/api/download/missing-0123456789ab').status_code == 404
+
+
+def _write_preview(file_id, n_points):
+    sampler = PreviewSampler(np.zeros(3), np.full(3, 100.0), budget=64)
+    if n_points:
+        rng = np.random.default_rng(0)
+        x, y, z = (rng.random(n_points) * 100 for _ in range(3))
+        sampler.add(x, y, z, np.ones(n_points, dtype=np.uint8), 0)
+    meta_path, data_path = server._preview_paths(file_id)
+    return sampler.write(data_path, meta_path)
+
+
+def test_preview_data_defaults_to_the_finest_level(client):
+    meta = _write_preview('tile-0123456789ab', 1000)
+    response = client.get('/api/preview/tile-0123456789ab/data')
+    assert response.status_code == 200
+    assert response.headers['X-Point-Count'] == str(meta['levels'][-1])
+    assert len(response.data) == meta['levels'][-1] * meta['record']['size']
+
+    response = client.get('/api/preview/tile-0123456789ab/data?level=0')
+    assert response.headers['X-Point-Count'] == str(meta['levels'][0])
+    assert client.get(f"/api/preview/tile-0123456789ab/data?level={len(meta['levels'])}").status_code == 400
+
+
+def test_preview_data_of_an_empty_input(client):
+    meta = _write_preview('empty-0123456789ab', 0)
+    assert meta['levels'] == []
+    for query in ('', '?level=0'):
+        response = client.get(f'/api/preview/empty-0123456789ab/data{query}')
+        assert response.status_code == 200, query
+        assert response.headers['X-Point-Count'] == '0'
+        assert response.data == b''
+    assert client.get('/api/preview/empty-0123456789ab/data?level=1').status_code == 400
@@ -0,0 +1,83 @@
+"""
+Szczytowa pamięć przebiegu strumieniowego nie rośnie z liczbą punktów.
+
+process_file_streaming idzie w osobnym procesie na syntetycznych LAS
+16× i 160× chunk_size. ru_maxrss dzieci (RUSAGE_CHILDREN) czyta driver -
+ten plik uruchomiony w świeżym procesie, więc inne dzieci pytesta nie
+zawyżają pomiaru. Przy 16× potok (chunki w locie u workerów) jest już
+pełny, więc dalszy przyrost szczytu to pamięć proporcjonalna do liczby
+punktów. Limit to ułamek bajta na punkt - tablica etykiet na całą chmurę
+(uint8 + kopia z np.concatenate, ~2 B/punkt) go przekracza kilkukrotnie.
+"""
+
+import contextlib
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+resource = pytest.importorskip('resource')
+
+CHUNK_SIZE = 50_000
+SIZES = (16, 160)
+# Dopuszczalny przyrost szczytu RSS na punkt (bajty)
+MAX_BYTES_PER_POINT = 0.25
+WORKERS = 2
+# Podgląd ma stały budżet punktów - mały, żeby nie zasłaniał pamięci przebiegu
+PREVIEW_BUDGET = 10_000
+
+
+def _classify(input_path, output_path):
+    """Dziecko: jeden pełny przebieg (LAS w miejscu + PLY + podgląd)"""
+    from classifier_genius import GeniusStreamingClassifier
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        classifier = GeniusStreamingClassifier(workers=WORKERS, backend='numpy')
+        classifier.process_file_streaming(input_path, output_path, chunk_size=CHUNK_SIZE,
+                                          preview_budget=PREVIEW_BUDGET)
+
+
+def _peaks(input_paths):
+    """Driver: każdy plik w osobnym dziecku; szczyt RSS dzieci (bajty) po każdym"""
+    peaks = []
+    for input_path in input_paths:
+        output_path = Path(input_path).with_name(f"{Path(input_path).stem}_classified.las")
+        subprocess.run([sys.executable, __file__, 'classify', str(input_path), str(output_path)],
+                       check=True)
+        peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        # Linux podaje KB, macOS bajty
+        peaks.append(peak if sys.platform == 'darwin' else peak * 1024)
+    return peaks
+
+
+def test_peak_memory_does_not_scale_with_points(tmp_path):
+    from benchmark import DEFAULT_DENSITY, generate_las
+
+    # Ten sam zasięg XY dla wszystkich plików (gęstość rośnie z k) - grid terenu
+    # ma wtedy stały rozmiar i przyrost mierzy tylko pamięć zależną od punktów
+    input_paths = [generate_las(tmp_path / f"tile_{k}x.las", k * CHUNK_SIZE, chunk_size=CHUNK_SIZE,
+                                density=DEFAULT_DENSITY * k / SIZES[0])
+                   for k in SIZES]
+    result = subprocess.run([sys.executable, __file__, 'peaks', *map(str, input_paths)],
+                            capture_output=True, text=True, check=True)
+    peaks = json.loads(result.stdout)
+
+    growth = peaks[-1] - peaks[0]
+    added_points = (SIZES[-1] - SIZES[0]) * CHUNK_SIZE
+    bound = MAX_BYTES_PER_POINT * added_points
+    assert growth < bound, (
+        f"Peak RSS grew by {growth / 2**20:.1f} MB ({growth / added_points:.2f} B/point) "
+        f"from {SIZES[0]}x to {SIZES[-1]}x chunk_size (bound {bound / 2**20:.1f} MB); "
+        f"peaks: {[round(p / 2**20) for p in peaks]} MB"
+    )
+
+
+if __name__ == '__main__':
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+    if sys.argv[1] == 'classify':
+        _classify(sys.argv[2], sys.argv[3])
+    else:
+        print(json.dumps(_peaks(sys.argv[2:])))
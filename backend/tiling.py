@@ -0,0 +1,260 @@
+"""
+Kafelkowanie przestrzenne z zakładką (halo) - cechy sąsiedztwa punktów.
+
+Reguły klasyfikatora są per-punkt (wysokość, kolor, intensywność). Słupy,
+płoty i budynki rozpoznaje się po lokalnej geometrii: liniowość, płaskość,
+pionowość, gęstość. Tu liczymy je w stałej pamięci:
+
+1. Bucketing - punkty ze strumienia chunków trafiają do kafli tile_size m
+   (+ kopie w zakładce halo m sąsiednich kafli), bufory zrzucane na dysk.
+2. Kafle równolegle - cKDTree na rdzeń + halo, k najbliższych sąsiadów,
+   kowariancja i wartości własne partiami.
+3. Cechy rdzenia kafla lądują w memmap (N × FEATURES) po globalnym indeksie
+   punktu, więc klasyfikator czyta je wycinkiem zgodnym z chunkiem.
+
+W RAM jest naraz tylko bufor bucketingu i kafle w trakcie liczenia.
+"""
+
+import math
+import os
+import shutil
+import numpy as np
+
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from pathlib import Path
+from scipy.spatial import cKDTree
+
+TILE_SIZE = 50.0
+HALO = 2.0
+K_NEIGHBORS = 16
+
+# Kolumny memmapy cech
+# verticality = 1 - |n_z| (normalna płaszczyzny), direction_z = |e1_z| (oś linii)
+FEATURES = ('linearity', 'planarity', 'scattering', 'verticality', 'direction_z', 'density')
+LINEARITY, PLANARITY, SCATTERING, VERTICALITY, DIRECTION_Z, DENSITY = range(len(FEATURES))
+
+# Rekord punktu w pliku kafla: xyz względem początku kafla + globalny indeks (-1 = halo)
+TILE_RECORD = np.dtype([('x', '<f4'), ('y', '<f4'), ('z', '<f4'), ('index', '<i8')])
+
+# Ile rekordów trzymamy w buforach przed zrzutem na dysk
+BUFFER_POINTS = 4_000_000
+# Punkty rdzenia na jedną partię zapytań kNN / eigh
+BATCH_POINTS = 65_536
+
+
+class GeometricFeatures:
+    """
+    Memmap cech (N × FEATURES) po globalnym indeksie punktu.
+    Context manager - plik znika po zakończeniu klasyfikacji.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.values = np.load(self.path, mmap_mode='r')
+
+    def __getitem__(self, key):
+        return self.values[key]
+
+    def release(self):
+        self.values = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class TileBucketer:
+    """
+    Rozdziela punkty chunków na pliki kafli (append). Punkt przy krawędzi
+    kafla trafia też - jako halo - do sąsiada, żeby jego kNN nie urywało się
+    na granicy.
+    """
+
+    def __init__(self, tiles_dir, x0, y0, z0, width, height, tile_size=TILE_SIZE, halo=HALO):
+        self.tiles_dir = Path(tiles_dir)
+        self.tiles_dir.mkdir(parents=True, exist_ok=True)
+        self.x0, self.y0, self.z0 = float(x0), float(y0), float(z0)
+        self.tile_size = float(tile_size)
+        self.halo = min(float(halo), self.tile_size / 2)
+        self.nx = int(width // self.tile_size) + 1
+        self.ny = int(height // self.tile_size) + 1
+        self._buffers = {}
+        self._buffered = 0
+        self.counts = {}  # tile -> liczba punktów rdzenia
+
+    def tile_path(self, tile):
+        return self.tiles_dir / f"tile_{tile}.bin"
+
+    def tile_origin(self, tile):
+        ty, tx = divmod(tile, self.nx)
+        return self.x0 + tx * self.tile_size, self.y0 + ty * self.tile_size
+
+    def add(self, x, y, z, start):
+        """Punkty chunka (przeskalowane xyz) o globalnych indeksach start..start+n"""
+        x, y, z = (np.asarray(c, dtype=np.float64) for c in (x, y, z))
+        fx = (x - self.x0) / self.tile_size
+        fy = (y - self.y0) / self.tile_size
+        tx = np.clip(np.floor(fx), 0, self.nx - 1).astype(np.int64)
+        ty = np.clip(np.floor(fy), 0, self.ny - 1).astype(np.int64)
+        # Pozycja w kaflu [0, 1) - decyduje o kopiach do zakładek sąsiadów
+        u, v = fx - tx, fy - ty
+        h = self.halo / self.tile_size
+        index = np.arange(start, start + len(fx), dtype=np.int64)
+
+        groups = []
+        for dy in (-1, 0, 1):
+            for dx in (-1, 0, 1):
+                mask = np.ones(len(fx), dtype=bool)
+                if dx:
+                    mask &= (u < h) if dx < 0 else (u >= 1 - h)
+                    mask &= (tx + dx >= 0) & (tx + dx < self.nx)
+                if dy:
+                    mask &= (v < h) if dy < 0 else (v >= 1 - h)
+                    mask &= (ty + dy >= 0) & (ty + dy < self.ny)
+                sel = np.flatnonzero(mask)
+                if sel.size == 0:
+                    continue
+                tiles = (ty[sel] + dy) * self.nx + (tx[sel] + dx)
+                groups.append((sel, tiles, dx == 0 and dy == 0))
+
+        for sel, tiles, core in groups:
+            order = np.argsort(tiles, kind='stable')
+            sel, tiles = sel[order], tiles[order]
+            bounds = np.flatnonzero(np.diff(tiles)) + 1
+            for part in np.split(np.arange(len(sel)), bounds):
+                tile = int(tiles[part[0]])
+                pts = sel[part]
+                ox, oy = self.tile_origin(tile)
+                rec = np.empty(len(pts), dtype=TILE_RECORD)
+                rec['x'] = x[pts] - ox
+                rec['y'] = y[pts] - oy
+                rec['z'] = z[pts] - self.z0
+                rec['index'] = index[pts] if core else -1
+                self._buffers.setdefault(tile, []).append(rec)
+                self._buffered += len(rec)
+                if core:
+                    self.counts[tile] = self.counts.get(tile, 0) + len(rec)
+
+        if self._buffered >= BUFFER_POINTS:
+            self.flush()
+
+    def flush(self):
+        for tile, parts in self._buffers.items():
+            with open(self.tile_path(tile), 'ab') as f:
+                for rec in parts:
+                    f.write(rec)
+        self._buffers.clear()
+        self._buffered = 0
+
+
+def tile_features(path, k=K_NEIGHBORS):
+    """
+    Cechy rdzenia jednego kafla: (globalne indeksy, tablica n × FEATURES).
+    Wartości własne l1 >= l2 >= l3 kowariancji k sąsiadów (Demantké i in.).
+    """
+    rec = np.fromfile(path, dtype=TILE_RECORD)
+    xyz = np.column_stack([rec['x'], rec['y'], rec['z']]).astype(np.float64)
+    core = np.flatnonzero(rec['index'] >= 0)
+    out = np.zeros((len(core), len(FEATURES)), dtype=np.float32)
+    if len(rec) < 3:
+        return rec['index'][core], out
+
+    k = min(k, len(rec))
+    tree = cKDTree(xyz)
+    for b0 in range(0, len(core), BATCH_POINTS):
+        batch = core[b0:b0 + BATCH_POINTS]
+        dist, nn = tree.query(xyz[batch], k=k)
+        nbrs = xyz[nn]
+        nbrs -= nbrs.mean(axis=1, keepdims=True)
+        cov = np.einsum('bki,bkj->bij', nbrs, nbrs) / k
+        evals, evecs = np.linalg.eigh(cov)  # rosnąco: l3, l2, l1
+        np.maximum(evals, 0, out=evals)
+        l3, l2, l1 = evals[:, 0], evals[:, 1], evals[:, 2]
+        l1_safe = np.where(l1 > 0, l1, 1.0)
+
+        res = out[b0:b0 + len(batch)]
+        res[:, LINEARITY] = (l1 - l2) / l1_safe
+        res[:, PLANARITY] = (l2 - l3) / l1_safe
+        res[:, SCATTERING] = l3 / l1_safe
+        # Normalna = wektor własny najmniejszej wartości; pionowa płaszczyzna → normalna pozioma
+        res[:, VERTICALITY] = 1.0 - np.abs(evecs[:, 2, 0])
+        res[:, DIRECTION_Z] = np.abs(evecs[:, 2, 2])
+        radius = np.maximum(dist[:, -1], 1e-3)
+        res[:, DENSITY] = k / (4.0 / 3.0 * math.pi * radius ** 3)
+
+    return rec['index'][core], out
+
+
+def compute_geometric_features(reader, chunk_size, work_dir, stem, tile_size=TILE_SIZE,
+                               halo=HALO, k=K_NEIGHBORS, workers=1,
+                               chunk_callback=None, tile_callback=None):
+    """
+    Pełny przebieg: bucketing strumienia → cechy kafli równolegle → memmap.
+
+    Zwraca GeometricFeatures (N × FEATURES, float32, kolejność punktów
+    z pliku) albo None, gdy nagłówek nie ma poprawnego zasięgu XY. Pliki
+    kafli są usuwane od razu; memmap cech zwalnia wołający (release()).
+    chunk_callback(points_done) - postęp bucketingu,
+    tile_callback(points_done) - postęp cech (punkty rdzenia gotowych kafli).
+    """
+    header = reader.header
+    x0, y0, z0 = (float(v) for v in header.mins)
+    width, height = float(header.maxs[0]) - x0, float(header.maxs[1]) - y0
+    if not (np.isfinite([x0, y0, z0, width, height]).all() and width >= 0 and height >= 0):
+        return None
+
+    n_total = header.point_count
+    work_dir = Path(work_dir)
+    tiles_dir = work_dir / f"{stem}_tiles"
+    features_path = work_dir / f"{stem}_features.npy"
+
+    try:
+        bucketer = TileBucketer(tiles_dir, x0, y0, z0, width, height, tile_size, halo)
+        done = 0
+        for chunk in reader.chunk_iterator(chunk_size):
+            bucketer.add(chunk.x, chunk.y, chunk.z, done)
+            done += len(chunk)
+            if chunk_callback is not None:
+                chunk_callback(done)
+        bucketer.flush()
+
+        features = np.lib.format.open_memmap(features_path, mode='w+', dtype=np.float32,
+                                             shape=(n_total, len(FEATURES)))
+
+        def run(tile):
+            index, values = tile_features(bucketer.tile_path(tile), k)
+            features[index] = values
+            os.remove(bucketer.tile_path(tile))
+            return len(index)
+
+        # Ograniczona liczba kafli w locie - pamięć nie rośnie z liczbą kafli
+        done = 0
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            pending = set()
+            for tile in sorted(bucketer.counts):
+                if len(pending) >= 2 * max(1, workers):
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        done += future.result()
+                        if tile_callback is not None:
+                            tile_callback(done)
+                pending.add(pool.submit(run, tile))
+            for future in pending:
+                done += future.result()
+                if tile_callback is not None:
+                    tile_callback(done)
+
+        features.flush()
+        del features
+    except BaseException:
+        if features_path.exists():
+            features_path.unlink()
+        raise
+    finally:
+        shutil.rmtree(tiles_dir, ignore_errors=True)
+
+    return GeometricFeatures(features_path)